@@ -0,0 +1,285 @@
+'''Benchmarks parsing, serializing and copying synthetic boards.
+
+The boards and footprints are generated from a seed, so every run and every
+commit benchmarks the same files.  Results are written as JSON, pass an
+earlier result to --compare to see the change.
+
+    python benchmark.py --output new.json --compare old.json
+'''
+import argparse
+import copy
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+from pykicad import __version__
+from pykicad.pcb import *
+from pykicad.module import *
+
+
+def generate_module(rng, name, pads=8):
+    '''Returns a two row smd footprint with pads pads.'''
+    rows = (pads + 1) // 2
+    pitch = 1.27
+    width = (rows - 1) * pitch
+    pad_list = []
+    for i in range(pads):
+        row, col = i // rows, i % rows
+        x = round(-width / 2 + col * pitch, 4)
+        y = -2.7 if row == 0 else 2.7
+        pad_list.append(Pad(str(i + 1), type='smd', shape='rect',
+                            size=[0.6, 1.5], at=[x, y],
+                            layers=['F.Cu', 'F.Paste', 'F.Mask']))
+
+    texts = [
+        Text('reference', 'REF**', at=[0, -4.5], layer='F.SilkS',
+             size=[1, 1], thickness=0.15),
+        Text('value', name, at=[0, 4.5], layer='F.Fab', size=[1, 1],
+             thickness=0.15)
+    ]
+
+    lines = []
+    for layer, w, h, line_width in [('F.SilkS', width / 2 + 0.5, 1.8, 0.12),
+                                    ('F.CrtYd', width / 2 + 1, 3.7, 0.05)]:
+        corners = [(-w, -h), (w, -h), (w, h), (-w, h)]
+        for start, end in zip(corners, corners[1:] + corners[:1]):
+            lines.append(Line(list(start), list(end), layer=layer,
+                              width=line_width))
+
+    return Module(name, layer='F.Cu', tedit='%08X' % rng.getrandbits(32),
+                  descr='Synthetic %d pin footprint' % pads,
+                  tags='synthetic smd', attr='smd', texts=texts, lines=lines,
+                  pads=pad_list)
+
+
+def generate_footprints(rng, count=10, pads=8):
+    '''Returns count footprints with between 2 and 2 * pads pads.'''
+    return [generate_module(rng, 'FP_%d' % i, rng.randint(1, pads) * 2)
+            for i in range(count)]
+
+
+def generate_pcb(rng, footprints, modules=100, segments=1000, vias=100,
+                 zone_points=1000, nets=50, size=100):
+    '''Returns a board with the given number of items.'''
+    net_list = [Net('', code=0)] + [Net('N%d' % i, code=i)
+                                    for i in range(1, nets + 1)]
+    layers = [Layer('F.Cu', code=0), Layer('B.Cu', code=31),
+              Layer('F.SilkS', code=37, type='user'),
+              Layer('Edge.Cuts', code=44, type='user')]
+
+    def point():
+        return [round(rng.uniform(0, size), 4), round(rng.uniform(0, size), 4)]
+
+    module_list = []
+    for i in range(modules):
+        module = copy.deepcopy(rng.choice(footprints))
+        module.set_reference('U%d' % (i + 1))
+        module.at = point()
+        for pad in module.pads:
+            pad.net = rng.choice(net_list[1:])
+        module_list.append(module)
+
+    segment_list = [Segment(point(), point(), rng.randint(1, nets),
+                            width=0.25, layer=rng.choice(['F.Cu', 'B.Cu']))
+                    for _ in range(segments)]
+    via_list = [Via(point(), 0.8, 0.4, rng.randint(1, nets))
+                for _ in range(vias)]
+
+    corners = [(0, 0), (size, 0), (size, size), (0, size)]
+    outline = [GrLine(list(start), list(end), width=0.1)
+               for start, end in zip(corners, corners[1:] + corners[:1])]
+
+    zone_list = []
+    if zone_points:
+        fill = [(round(size / 2 + size / 2 * math.cos(a), 4),
+                 round(size / 2 + size / 2 * math.sin(a), 4))
+                for a in [2 * math.pi * i / zone_points
+                          for i in range(zone_points)]]
+        zone_list.append(Zone(net=1, net_name='N1', layer='F.Cu',
+                              tstamp='5A1B2C3D', clearance=0.3,
+                              min_thickness=0.25, polygon=list(corners),
+                              filled_polygon=fill))
+
+    return Pcb(title='Synthetic board', num_nets=len(net_list), layers=layers,
+               nets=net_list, modules=module_list, segments=segment_list,
+               vias=via_list, lines=outline, zones=zone_list)
+
+
+def write_synthetic(directory, seed=0, footprints=10, pads=8, **kwargs):
+    '''Writes a synthetic board to directory/board.kicad_pcb and its
+    footprints to directory/synthetic.pretty.  Returns the paths.'''
+    rng = random.Random(seed)
+    footprint_list = generate_footprints(rng, footprints, pads)
+    library = os.path.join(directory, 'synthetic.pretty')
+    os.makedirs(library, exist_ok=True)
+    for module in footprint_list:
+        path = os.path.join(library, module.name + '.kicad_mod')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(module.to_string()[1:] + '\n')
+    board = os.path.join(directory, 'board.kicad_pcb')
+    generate_pcb(rng, footprint_list, **kwargs).to_file(board)
+    return board, library
+
+
+def timed(fn, repeat, setup=None):
+    '''Returns the times of repeat calls of fn.'''
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def benchmarks(board, library, backends):
+    '''Returns a list of (name, fn, setup) tuples.'''
+    with open(board, 'r', encoding='utf-8') as f:
+        string = f.read()
+    pcb = Pcb.parse(string, 'descent')
+    mod_path = sorted(os.path.join(library, name)
+                      for name in os.listdir(library))[0]
+    references = ['U%d' % (i + 1) for i in range(len(pcb.modules))]
+    codes = [net.code for net in pcb.nets]
+    lib_name = os.path.basename(library)[:-len('.pretty')]
+
+    cases = []
+    for backend in backends:
+        cases.append(('pcb.parse.%s' % backend,
+                      lambda backend=backend: Pcb.parse(string, backend),
+                      None))
+        cases.append(('module.from_file.%s' % backend,
+                      lambda backend=backend:
+                      Module.from_file(mod_path, backend),
+                      Module.clear_cache))
+    cases += [
+        ('pcb.to_string', pcb.to_string, None),
+        ('pcb.deepcopy', lambda: copy.deepcopy(pcb), None),
+        ('module.from_file.cached', lambda: Module.from_file(mod_path), None),
+        ('module.from_file.shared',
+         lambda: Module.from_file(mod_path, shared=True), None),
+        ('pcb.module_by_reference',
+         lambda: [pcb.module_by_reference(ref) for ref in references], None),
+        ('pcb.net_by_code', lambda: [pcb.net_by_code(code) for code in codes],
+         None),
+        ('find_module',
+         lambda: [find_module(lib_name, name)
+                  for name in list_modules(lib_name)],
+         None),
+        ('list_all_modules', list_all_modules, None),
+    ]
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(params, repeat=5, backends=('pyparsing', 'descent'), only=None):
+    '''Generates the synthetic files and returns the results.'''
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        board, library = write_synthetic(directory, **params)
+        env = {MODULE_SEARCH_PATH: directory}
+        with mock.patch.dict(os.environ, env):
+            for name, fn, setup in benchmarks(board, library, backends):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                fn()  # warm up caches of the generated parsers
+                times = timed(fn, repeat, setup)
+                results[name] = {
+                    'min': min(times),
+                    'median': statistics.median(times),
+                    'mean': statistics.mean(times),
+                    'times': times
+                }
+                print('%-28s %10.4fs' % (name, results[name]['min']))
+        board_size = os.path.getsize(board)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(),
+            'repeat': repeat,
+            'params': params,
+            'board_size': board_size
+        },
+        'benchmarks': results
+    }
+
+
+def compare(old, new):
+    '''Prints the ratio of the minimum times of two results.'''
+    if old['meta']['params'] != new['meta']['params']:
+        print('Warning: the results are for different boards')
+    print('%-28s %10s %10s %8s' % ('benchmark', 'old', 'new', 'ratio'))
+    for name, result in new['benchmarks'].items():
+        if name not in old['benchmarks']:
+            continue
+        before, after = old['benchmarks'][name]['min'], result['min']
+        ratio = after / before if before else float('nan')
+        print('%-28s %9.4fs %9.4fs %7.2fx' % (name, before, after, ratio))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modules', type=int, default=50)
+    parser.add_argument('--segments', type=int, default=2000)
+    parser.add_argument('--vias', type=int, default=200)
+    parser.add_argument('--zone-points', type=int, default=2000)
+    parser.add_argument('--nets', type=int, default=50)
+    parser.add_argument('--footprints', type=int, default=10,
+                        help='number of footprints in the library')
+    parser.add_argument('--pads', type=int, default=8,
+                        help='maximum number of pad pairs of a footprint')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backend', action='append', dest='backends',
+                        choices=['pyparsing', 'descent'],
+                        help='parser backends to benchmark, defaults to both')
+    parser.add_argument('--only', action='append',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier result to compare with')
+    parser.add_argument('--write', metavar='DIR',
+                        help='only write the synthetic files to DIR')
+    args = parser.parse_args()
+
+    params = {
+        'seed': args.seed,
+        'modules': args.modules,
+        'segments': args.segments,
+        'vias': args.vias,
+        'zone_points': args.zone_points,
+        'nets': args.nets,
+        'footprints': args.footprints,
+        'pads': args.pads
+    }
+    if args.write:
+        print(*write_synthetic(args.write, **params))
+        sys.exit()
+
+    backends = args.backends or ('pyparsing', 'descent')
+    result = run(params, args.repeat, backends, args.only)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
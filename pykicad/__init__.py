@@ -1,7 +1,14 @@
+import importlib
+
 from .pcb import *
 from .module import *
-from . import sexpr
-
+from .spatial import *
+from .connectivity import *
+from .placement import *
+from .drc import *
 from ._version import get_versions
+
+# The star imports bind the sexpr function, rebind the module
+sexpr = importlib.import_module('.sexpr', __name__)
 __version__ = get_versions()['version']
-del get_versions
+del get_versions, importlib
@@ -0,0 +1,328 @@
+import math
+from pykicad.module import Module, Pad, Net
+from pykicad.pcb import Segment, Via, Zone
+from pykicad.spatial import Shape, SpatialIndex, board_transform, item_layers
+from pykicad.spatial import layer_matches, shape_cells
+
+# Items closer than this touch
+EPSILON = 1e-6
+
+
+def item_net(item):
+    '''Returns the net code of a segment, via, pad or zone.'''
+    if isinstance(item.net, Net):
+        return item.net.code
+    return item.net
+
+
+class _Node(object):
+    __slots__ = ('item', 'module', 'net', 'layers', 'anchors', 'shape')
+
+    def __init__(self, item, module):
+        self.item = item
+        self.module = module
+        self.net = item_net(item)
+        self.layers = [layer for layer in item_layers(item)
+                       if layer.endswith('.Cu')]
+        self.shape = None
+        if isinstance(item, Segment):
+            self.anchors = [(item.start[0], item.start[1], self.layers),
+                            (item.end[0], item.end[1], self.layers)]
+        elif isinstance(item, Via):
+            self.anchors = [(item.at[0], item.at[1], self.layers)]
+        elif isinstance(item, Pad):
+            x, y = board_transform(module)(item.at[0], item.at[1])
+            self.anchors = [(x, y, self.layers)]
+        else:
+            self.anchors = []
+
+    def shares_layer(self, layers):
+        return any(layer_matches(a, b) for a in self.layers for b in layers)
+
+
+class Connectivity(object):
+    '''Connected copper islands of the segments, vias, pads and zones of a
+    board.
+
+    Items connect when an anchor of one, the ends of a segment or the
+    center of a via or pad, lies within the shape of the other on a common
+    layer.  So tracks connect where they meet, at T-junctions and anywhere
+    inside a via or pad.  The shapes holding an anchor are found with a
+    SpatialIndex, the anchors within a shape in a grid of the anchors.
+    Zones only connect items of their own net, since their fill keeps
+    clear of other nets, and follow their connect_pads setting.
+
+    The islands are kept in a union-find structure.  Adding an item only
+    joins the islands it touches, removing an item only rebuilds the
+    island it was part of.  Moved items have to be passed to update.'''
+
+    def __init__(self, pcb=None, cell_size=2.0):
+        self.index = SpatialIndex(cell_size)
+        self.nodes = {}
+        self.parent = {}
+        # Root to the set of nodes of its island
+        self.members = {}
+        # Grid cell to the set of nodes with an anchor in it
+        self.anchor_cells = {}
+        # Pads of the modules
+        self.children = {}
+        if pcb is not None:
+            for items in [pcb.zones, pcb.modules, pcb.vias, pcb.segments]:
+                for item in items:
+                    self.add(item)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, item):
+        return id(item) in self.nodes
+
+    def find(self, key):
+        parent = self.parent
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if len(self.members[a]) < len(self.members[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.members[a] |= self.members.pop(b)
+
+    def add(self, item, module=None):
+        '''Adds a segment, via, zone, module or a pad of module and joins
+        the islands it touches.'''
+        if isinstance(item, Module):
+            self.children[id(item)] = list(item.pads)
+            for pad in item.pads:
+                self.add(pad, item)
+            return
+        key = id(item)
+        if key in self.nodes:
+            raise ValueError('%r was already added' % item)
+        node = _Node(item, module)
+        self.nodes[key] = node
+        self.parent[key] = key
+        self.members[key] = {key}
+        self.index.insert(item, module)
+        if item in self.index:
+            node.shape = self.index.shape(item)
+        for x, y, _ in node.anchors:
+            self.anchor_cells.setdefault(self._cell(x, y), set()).add(key)
+        for other in self.contacts(node):
+            self.union(key, other)
+
+    def remove(self, item):
+        '''Removes an item, or a module with its pads, and splits the
+        island it was part of.'''
+        if isinstance(item, Module):
+            for pad in self.children.pop(id(item), []):
+                self.remove(pad)
+            return
+        key = id(item)
+        node = self.nodes.pop(key, None)
+        if node is None:
+            return
+        self.index.remove(item)
+        for x, y, _ in node.anchors:
+            cell = self._cell(x, y)
+            keys = self.anchor_cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.anchor_cells[cell]
+
+        island = self.members.pop(self.find(key))
+        island.discard(key)
+        del self.parent[key]
+        for member in island:
+            self.parent[member] = member
+            self.members[member] = {member}
+        for member in island:
+            for other in self.contacts(self.nodes[member]):
+                self.union(member, other)
+
+    def update(self, item):
+        '''Updates the islands after item was moved or changed.'''
+        module = None
+        if id(item) in self.nodes:
+            module = self.nodes[id(item)].module
+        self.remove(item)
+        self.add(item, module)
+
+    def _cell(self, x, y):
+        size = self.index.cell_size
+        return int(math.floor(x / size)), int(math.floor(y / size))
+
+    def _touches(self, area, node):
+        '''Returns True if an anchor of node lies within the shape of
+        area.'''
+        # Anchors are on the layers of their node
+        if area.shape is None or not area.shares_layer(node.layers):
+            return False
+        for a, b in [(area, node), (node, area)]:
+            if isinstance(a.item, Zone):
+                if a.net != b.net or not a.net or isinstance(b.item, Zone):
+                    return False
+                if isinstance(b.item, Pad) and (
+                        a.item.connect_pads == 'no' or
+                        a.item.connect_pads == 'thru_hole_only' and
+                        b.item.type != 'thru_hole'):
+                    return False
+        shape = area.shape
+        return any(shape.distance(x, y) <= EPSILON
+                   for x, y, _ in node.anchors)
+
+    def contacts(self, node):
+        '''Returns the keys of the nodes touching node.'''
+        key = id(node.item)
+        found = set()
+        # Items with an anchor of node in their shape
+        for x, y, layers in node.anchors:
+            box = (x - EPSILON, y - EPSILON, x + EPSILON, y + EPSILON)
+            for layer in layers:
+                for item in self.index.query(box, layer, exact=False):
+                    if self._touches(self.nodes[id(item)], node):
+                        found.add(id(item))
+        # Items with an anchor in the shape of node, tracks only look at
+        # the cells along their path
+        if node.shape is not None:
+            shape = node.shape
+            shape = Shape(shape.kind, shape.points, shape.radius + EPSILON,
+                          shape.ring)
+            keys = set()
+            for cell in shape_cells(shape, self.index.cell_size,
+                                    float('inf')):
+                keys.update(self.anchor_cells.get(cell, ()))
+            for other in keys:
+                if self._touches(node, self.nodes[other]):
+                    found.add(other)
+        found.discard(key)
+        return found
+
+    def connected(self, a, b):
+        '''Returns True if the items a and b are part of the same island.'''
+        return self.find(id(a)) == self.find(id(b))
+
+    def island(self, item):
+        '''Returns the items of the island of item.'''
+        return [self.nodes[key].item
+                for key in self.members[self.find(id(item))]]
+
+    def islands(self, net=None):
+        '''Returns a dict mapping net codes to the list of their islands,
+        each a list of the items of that net.  Items without a net are
+        left out.'''
+        islands = {}
+        for members in self.members.values():
+            by_net = {}
+            for key in members:
+                node = self.nodes[key]
+                if node.net and (net is None or node.net == net):
+                    by_net.setdefault(node.net, []).append(node.item)
+            for code, items in by_net.items():
+                islands.setdefault(code, []).append(items)
+        return islands
+
+    def shorts(self):
+        '''Returns a list of (nets, items) tuples of the islands connecting
+        more than one net.'''
+        shorts = []
+        for members in self.members.values():
+            nets = set(self.nodes[key].net for key in members)
+            nets.discard(None)
+            nets.discard(0)
+            if len(nets) > 1:
+                shorts.append((sorted(nets),
+                               [self.nodes[key].item for key in members]))
+        return shorts
+
+    def _nearest_island(self, index, nodes, owner, group):
+        '''Returns the (distance, item, item) of the anchor of nodes nearest
+        to an item of index outside of group.'''
+        best = (float('inf'), None, None)
+
+        def accept(item):
+            return owner[id(item)] != group
+
+        for node in nodes:
+            for x, y, _ in node.anchors:
+                other = index.nearest((x, y), max_distance=best[0],
+                                      accept=accept)
+                if other is not None:
+                    distance = index.shape(other).distance(x, y)
+                    if distance < best[0]:
+                        best = (distance, node.item, other)
+        return best
+
+    def unrouted(self, net=None):
+        '''Returns the ratsnest as a list of (net, item, item, distance)
+        tuples.  The islands of every net are joined by the shortest
+        connections that connect them all.
+
+        The connections are found in rounds like in Boruvka's algorithm.
+        Every group of joined islands but the largest looks up the nearest
+        item of another group from its anchors, in an index of the items
+        of the net.  The shortest of those connections are added until
+        the groups are joined.'''
+        ratsnest = []
+        for code, islands in sorted(self.islands(net).items()):
+            if len(islands) < 2:
+                continue
+            # Cells holding about one item each, the nets are sparse
+            boxes = [self.nodes[id(item)].shape.bounding_box()
+                     for island in islands for item in island
+                     if self.nodes[id(item)].shape is not None]
+            cell_size = self.index.cell_size
+            if boxes:
+                xmin, ymin, xmax, ymax = zip(*boxes)
+                area = (max(xmax) - min(xmin)) * (max(ymax) - min(ymin))
+                cell_size = max(cell_size, math.sqrt(area / len(boxes)))
+            index = SpatialIndex(cell_size)
+            # Island of every item
+            island_of = {}
+            for i, island in enumerate(islands):
+                for item in island:
+                    index.insert(item, self.nodes[id(item)].module)
+                    island_of[id(item)] = i
+            parent = list(range(len(islands)))
+
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]
+                    i = parent[i]
+                return i
+
+            while True:
+                groups = {}
+                for i, island in enumerate(islands):
+                    groups.setdefault(find(i), []).extend(
+                        self.nodes[id(item)] for item in island)
+                if len(groups) < 2:
+                    break
+                owner = dict((key, find(i)) for key, i in island_of.items())
+                # The largest group is reached by the others
+                searching = [group for group, nodes in groups.items()
+                             if any(node.anchors for node in nodes)]
+                if len(searching) > 1:
+                    searching.remove(max(searching, key=lambda group: sum(
+                        len(node.anchors) for node in groups[group])))
+                connections = [self._nearest_island(index, groups[group],
+                                                    owner, group)
+                               for group in searching]
+                joined = False
+                connections = [connection for connection in connections
+                               if connection[1] is not None]
+                for distance, a, b in sorted(connections,
+                                             key=lambda c: c[0]):
+                    i, j = find(island_of[id(a)]), find(island_of[id(b)])
+                    if i != j:
+                        parent[i] = j
+                        ratsnest.append((code, a, b, distance))
+                        joined = True
+                if not joined:
+                    break
+        return ratsnest
@@ -0,0 +1,228 @@
+import math
+from pykicad.module import Pad, Net
+from pykicad.pcb import Segment, Via
+from pykicad.spatial import Shape, item_shape, item_layers, shape_cells
+from pykicad.spatial import layer_matches, shape_distance
+from pykicad.connectivity import EPSILON, item_net
+
+# Clearance of nets when the board has no net classes or setup
+DEFAULT_CLEARANCE = 0.2
+
+# Order of the items of a violation
+KINDS = {Segment: 'segment', Via: 'via', Pad: 'pad'}
+
+
+def describe(item, module=None):
+    '''Returns a short description of a segment, via or pad of module.'''
+    if isinstance(item, Segment):
+        return 'segment (%g, %g)-(%g, %g) on %s' % (
+            item.start[0], item.start[1], item.end[0], item.end[1],
+            item.layer)
+    if isinstance(item, Via):
+        return 'via (%g, %g)' % (item.at[0], item.at[1])
+    if module is not None:
+        return 'pad %s.%s' % (module.name, item.name)
+    return 'pad %s' % item.name
+
+
+class ClearanceRules(object):
+    '''Clearances of the nets of a board.
+
+    A net has the clearance of its net class, or of the Default class if
+    its class has none.  Boards without a Default clearance use
+    Setup.trace_clearance or DEFAULT_CLEARANCE.  Pads and modules with a
+    clearance of their own override the one of their net.  The clearance
+    between two items is the larger of theirs.'''
+
+    def __init__(self, pcb):
+        setup = pcb.setup
+        self.default = DEFAULT_CLEARANCE
+        if setup is not None and setup.trace_clearance is not None:
+            self.default = setup.trace_clearance
+        self.by_name = {}
+        for net_class in pcb.net_classes or []:
+            if net_class.clearance is None:
+                continue
+            if net_class.name == 'Default':
+                self.default = net_class.clearance
+            for name in net_class.nets:
+                self.by_name[name] = net_class.clearance
+        self.names = dict((net.code, net.name) for net in pcb.nets or [])
+
+    def net_name(self, item):
+        '''Returns the name of the net of a segment, via or pad.'''
+        if isinstance(item.net, Net):
+            return item.net.name
+        return self.names.get(item.net)
+
+    def clearance(self, item, module=None):
+        '''Returns the clearance of a segment, via or pad of module.'''
+        if isinstance(item, Pad):
+            if item.clearance is not None:
+                return item.clearance
+            if module is not None and module.clearance is not None:
+                return module.clearance
+        return self.by_name.get(self.net_name(item), self.default)
+
+
+class Violation(object):
+    '''Two items of different nets on layer that are closer than the
+    clearance between them.  kind names the types of the items like
+    segment-via, the items are in that order.'''
+    __slots__ = ('kind', 'layer', 'first', 'second', 'nets', 'clearance',
+                 'distance', 'modules')
+
+    def __init__(self, kind, layer, first, second, nets, clearance,
+                 distance, modules=(None, None)):
+        self.kind = kind
+        self.layer = layer
+        self.first = first
+        self.second = second
+        self.nets = nets
+        self.clearance = clearance
+        self.distance = distance
+        self.modules = modules
+
+    def __repr__(self):
+        return 'Violation(%r, %r, %s, %s, %g < %g)' % (
+            self.kind, self.layer, describe(self.first, self.modules[0]),
+            describe(self.second, self.modules[1]), self.distance,
+            self.clearance)
+
+    def as_dict(self):
+        '''Returns the violation as a dict of plain values, for reports.'''
+        return {
+            'kind': self.kind,
+            'layer': self.layer,
+            'first': describe(self.first, self.modules[0]),
+            'second': describe(self.second, self.modules[1]),
+            'nets': list(self.nets),
+            'clearance': self.clearance,
+            'distance': self.distance
+        }
+
+
+def _copper_layers(entries):
+    '''Returns the sorted names of the copper layers of entries, wildcards
+    like *.Cu are on the layers of the other items and F.Cu and B.Cu.'''
+    names = set()
+    for entry in entries:
+        for layer in entry[3]:
+            if '*' in layer or '&' in layer:
+                names.update(['F.Cu', 'B.Cu'])
+            else:
+                names.add(layer)
+    return sorted(names)
+
+
+def check_clearances(pcb, rules=None, cell_size=2.0, max_cells=16):
+    '''Returns the list of Violations of the clearances between the
+    segments, vias and pads of pcb on the copper layers.
+
+    The items are put in a grid of cell_size mm per layer, each in the
+    cells of its box widened by the largest clearance.  Tracks that would
+    touch more than max_cells cells only go into the cells along their
+    path.  The pairs of items sharing a cell are then measured exactly:
+    segments as capsules, vias and round pads as discs, oval pads as
+    capsules and other pads as (rounded) rectangles.  Items of the same
+    net aren't checked against each other.'''
+    if rules is None:
+        rules = ClearanceRules(pcb)
+    items = [(pad, module) for module in pcb.modules for pad in module.pads]
+    items += [(via, None) for via in pcb.vias]
+    items += [(segment, None) for segment in pcb.segments]
+
+    entries = []
+    for item, module in items:
+        layers = [layer for layer in item_layers(item)
+                  if layer.endswith('.Cu')]
+        shape = item_shape(item, module)
+        if layers and shape is not None:
+            entries.append((item, module, shape, layers, item_net(item),
+                            rules.clearance(item, module),
+                            shape.bounding_box()))
+    if not entries:
+        return []
+    margin = max(entry[5] for entry in entries)
+    names = _copper_layers(entries)
+
+    # Layer, column and row to the indexes of the entries in the cell
+    cells = {}
+    # Sets of the numbers of the layers of the entries
+    on_layers = []
+    # Entries that are in the cells along their path
+    large = set()
+    floor = math.floor
+    for i, entry in enumerate(entries):
+        numbers = frozenset(n for n, name in enumerate(names)
+                            if any(layer_matches(name, layer)
+                                   for layer in entry[3]))
+        on_layers.append(numbers)
+        shape, (xmin, ymin, xmax, ymax) = entry[2], entry[6]
+        x0, x1 = int(floor((xmin - margin) / cell_size)), \
+            int(floor(xmax / cell_size))
+        y0, y1 = int(floor((ymin - margin) / cell_size)), \
+            int(floor(ymax / cell_size))
+        if shape.kind == 'polyline' and \
+                (x1 - x0 + 1) * (y1 - y0 + 1) > max_cells:
+            large.add(i)
+            keys = shape_cells(Shape('polyline', shape.points,
+                                     shape.radius + margin),
+                               cell_size, float('inf'))
+        else:
+            keys = [(ix, iy) for ix in range(x0, x1 + 1)
+                    for iy in range(y0, y1 + 1)]
+        for n in numbers:
+            for ix, iy in keys:
+                cell = cells.get((n, ix, iy))
+                if cell is None:
+                    cell = cells[(n, ix, iy)] = []
+                cell.append(i)
+
+    violations = []
+    seen = set()
+    ranks = list(KINDS)
+    for (n, ix, iy), members in cells.items():
+        for a, i in enumerate(members):
+            item, module, shape, _, net, clearance, box = entries[i]
+            for j in members[a + 1:]:
+                other, other_module, other_shape, _, other_net, \
+                    other_clearance, other_box = entries[j]
+                if net and net == other_net:
+                    continue
+                required = max(clearance, other_clearance)
+                if box[0] > other_box[2] + required or \
+                        other_box[0] > box[2] + required or \
+                        box[1] > other_box[3] + required or \
+                        other_box[1] > box[3] + required:
+                    continue
+                # Every pair is measured once, on its first common layer
+                # and in the cell holding the corner of the overlap of the
+                # widened boxes
+                if len(on_layers[i]) > 1 and len(on_layers[j]) > 1 and \
+                        n != min(on_layers[i] & on_layers[j]):
+                    continue
+                if i in large or j in large:
+                    if (i, j) in seen:
+                        continue
+                    seen.add((i, j))
+                elif floor((max(box[0], other_box[0]) - margin) /
+                           cell_size) != ix or \
+                        floor((max(box[1], other_box[1]) - margin) /
+                              cell_size) != iy:
+                    continue
+                if module is not None and module is other_module and \
+                        item.name == other.name:
+                    continue
+                distance = shape_distance(shape, other_shape)
+                if distance >= required - EPSILON:
+                    continue
+                first, second = (item, module), (other, other_module)
+                nets = (rules.net_name(item), rules.net_name(other))
+                if ranks.index(type(item)) > ranks.index(type(other)):
+                    first, second, nets = second, first, nets[::-1]
+                violations.append(Violation(
+                    '%s-%s' % (KINDS[type(first[0])], KINDS[type(second[0])]),
+                    names[n], first[0], second[0], nets, required, distance,
+                    (first[1], second[1])))
+    return violations
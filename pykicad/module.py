@@ -3,7 +3,13 @@ import os.path
 import re
 import sys
 import copy
+import math
+import sqlite3
 from io import open
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+import pykicad.sexpr
 from pykicad.sexpr import *
 
 # Cache initial module text
@@ -11,11 +17,17 @@ cached_modules = {}
 
 MODULE_SEARCH_PATH = 'KISYSMOD'
 
+# LibraryIndex that answers find_library, find_module and the list functions.
+# If None the directories on the search path are listed on every call.
+LIBRARY_INDEX = None
+
 ###########################
 # Utility methods         #
 ###########################
 def find_library(library):
     '''Returns full path of specified library'''
+    if LIBRARY_INDEX is not None:
+        return LIBRARY_INDEX.find_library(library)
     for path in os.environ.get(MODULE_SEARCH_PATH).split(os.pathsep):
 
         full_path = os.path.join(path, library + '.pretty')
@@ -25,6 +37,8 @@ def find_library(library):
 
 def find_module(library, module):
     '''Returns full path of specified module'''
+    if LIBRARY_INDEX is not None:
+        return LIBRARY_INDEX.find_module(library, module)
     full_name = os.path.join(library + '.pretty', module + '.kicad_mod')
     for path in os.environ.get(MODULE_SEARCH_PATH).split(os.pathsep):
         full_path = os.path.join(path, full_name)
@@ -34,6 +48,8 @@ def find_module(library, module):
 
 def list_libraries():
     '''Returns all footprint libraries'''
+    if LIBRARY_INDEX is not None:
+        return LIBRARY_INDEX.list_libraries()
     libraries = []
     for path in os.environ.get(MODULE_SEARCH_PATH).split(os.pathsep):
         for lib in os.listdir(path):
@@ -44,6 +60,8 @@ def list_libraries():
 
 def list_modules(library):
     '''Returns all modules in specific library'''
+    if LIBRARY_INDEX is not None:
+        return LIBRARY_INDEX.list_modules(library)
     modules = []
     for file in os.listdir(find_library(library)):
         if file.endswith('.kicad_mod'):
@@ -59,12 +77,176 @@ def filter_by_regex(alist, regex):
 
 def list_all_modules():
     '''Returns all modules in all libraries'''
+    if LIBRARY_INDEX is not None:
+        return LIBRARY_INDEX.list_all_modules()
     modules = []
     for lib in list_libraries():
         modules += list_modules(lib)
     return modules
 
 
+def deep_sizeof(obj, seen=None):
+    '''Returns the approximate number of bytes held by obj and everything it
+    references.'''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, AST):
+        obj = list(obj.attributes.values())
+    elif isinstance(obj, dict):
+        obj = list(obj.keys()) + list(obj.values())
+    elif not isinstance(obj, (list, tuple, set)):
+        return size
+    for item in obj:
+        size += deep_sizeof(item, seen)
+    return size
+
+
+class ModuleCache(MutableMapping):
+    '''Least recently used cache of parsed modules keyed by path.
+
+    Holds at most max_entries modules and approximately max_bytes of memory,
+    evicting the least recently used module when either is exceeded. None
+    disables a limit. An entry is dropped when the modification time or size
+    of its file changes.
+
+    The cache is also a mapping of paths to modules like the dict it
+    replaced, cache[path] raises KeyError for missing or stale entries.'''
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        '''Drops all entries and resets the statistics.'''
+        # path -> (stat key, module, approximate size)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __getitem__(self, path):
+        module = self.get(path)
+        if module is None:
+            raise KeyError(path)
+        return module
+
+    def __setitem__(self, path, module):
+        self.put(path, module)
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self.remove(path)
+
+    def get(self, path, default=None):
+        '''Returns the cached module at path or default.'''
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry is not None:
+            if entry[0] == self.stat_key(path):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.remove(path)
+            self.invalidations += 1
+        self.misses += 1
+        return default
+
+    def put(self, path, module, stat_key=None):
+        '''Caches module as parsed from path. stat_key should be taken before
+        the file was read, so that changes made while parsing are noticed.'''
+        path = os.path.abspath(path)
+        if stat_key is None:
+            stat_key = self.stat_key(path)
+        self.remove(path)
+        size = deep_sizeof(module)
+        self.entries[path] = (stat_key, module, size)
+        self.bytes += size
+        self.evict()
+
+    def remove(self, path):
+        '''Drops the module at path if it's cached.'''
+        entry = self.entries.pop(os.path.abspath(path), None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def evict(self):
+        '''Drops the least recently used modules until the cache is within
+        its limits.'''
+        while self.entries and (
+                (self.max_entries is not None and
+                 len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        '''Returns a dict of the hit, miss, eviction and invalidation counts,
+        the number of entries and the approximate bytes held.'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes
+        }
+
+    @staticmethod
+    def stat_key(path):
+        '''Returns the modification time and size of path.'''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+def _load_modules(paths, backend, cache_dir, point_arrays):
+    '''Parses the modules at paths in a worker process of Module.load_many.
+    Returns the module or the exception raised for every path.'''
+    pykicad.sexpr.POINT_ARRAYS = point_arrays
+    results = []
+    for path in paths:
+        try:
+            results.append(Module.parse_file(path, backend,
+                                             cache_dir=cache_dir))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def copy_element(elem):
+    '''Returns a copy of a pad, text or graphic whose lists can be changed
+    without changing elem.'''
+    if isinstance(elem, Pad):
+        return elem.copy()
+    elem = copy.copy(elem)
+    for attr, value in elem.attributes.items():
+        if isinstance(value, list):
+            setattr(elem, attr, list(value))
+    return elem
+
+
 def flip_layer(layer):
     '''
     Flips from front to back layer
@@ -72,7 +254,7 @@ def flip_layer(layer):
     '''
     if filter_by_regex([layer], "^[FB].[a-zA-Z]{1,}$"):
         side, layer = layer.split('.')
-        side = 'B' if side == 'F' else 'B'
+        side = 'B' if side == 'F' else 'F'
         return side + '.' + layer
     print("Warning: Unable to determine side of layer: "+str(layer))
     return layer
@@ -81,14 +263,22 @@ def flip_layer(layer):
 ###########################
 # AST methods             #
 ###########################
+def xy_printer(xy):
+    '''Prints a point or an (N, 2) array of points.'''
+    if getattr(xy, 'ndim', 1) == 2:
+        return ' '.join(['(xy %f %f)'] * len(xy)) % tuple(xy.ravel().tolist())
+    return '(xy %f %f)' % (xy[0], xy[1])
+
+
 def xy_schema(attr):
     return {
         '0': {
             '_attr': attr,
             '_parser': (Suppress('(xy') + number + number + Suppress(')'))
             .setParseAction(lambda xy: tuple(xy)),
-            '_printer': lambda xy: '(xy %f %f)' % (xy[0], xy[1]),
-            '_multiple': True
+            '_printer': xy_printer,
+            '_multiple': True,
+            '_points': True
         }
     }
 
@@ -184,6 +374,15 @@ class Pad(AST):
                                              solder_paste_margin_ratio=solder_paste_margin_ratio,
                                              zone_connect=zone_connect)
 
+    def copy(self):
+        '''Returns a copy of the pad that shares the drill and net.'''
+        pad = copy.copy(self)
+        for attr in ['size', 'at', 'rect_delta', 'layers']:
+            value = getattr(pad, attr)
+            if value is not None:
+                setattr(pad, attr, list(value))
+        return pad
+
     def is_valid(self):
         if self.shape == 'trapezoid' and self.rect_delta is None:
             return False
@@ -470,7 +669,24 @@ class Model(AST):
 
 
 class Module(AST):
-    cached_modules = {}
+    # Names of the attributes that are still shared with the cached module
+    # this one was cloned from
+    # _pending holds the operations on the children set_transform deferred
+    __slots__ = ('_shared', '_pending')
+    cached_modules = ModuleCache()
+    shared_attrs = ['texts', 'lines', 'circles', 'arcs', 'curves',
+                    'polygons', 'model']
+    # Children changed by the operations set_transform, connect and
+    # Footprint.place defer
+    child_attrs = {
+        'copy': ['pads', 'texts', 'lines', 'circles', 'arcs', 'curves',
+                 'polygons'],
+        'rotate': ['pads', 'texts'],
+        'flip': ['pads', 'texts', 'lines', 'circles', 'arcs', 'curves',
+                 'polygons'],
+        'nets': ['pads'],
+        'label': ['texts']
+    }
     tag = 'module'
     schema = {
         '0': {
@@ -532,29 +748,95 @@ class Module(AST):
 
     @classmethod
     def clear_cache(cls):
-        cls.cached_modules = {}
+        cls.cached_modules.clear()
 
     @classmethod
-    def from_file(cls, path):
-        '''Returns parsed module at specified path'''
+    def from_file(cls, path, backend=None, shared=False):
+        '''Returns parsed module at specified path.  With shared the module
+        shares its texts, graphics and models with the cached one, see
+        clone.'''
 
         # Load module if it's not cached
-        if path not in cls.cached_modules:
-            module = open(path, 'r', encoding='utf-8').read()
-            module = cls.parse(module)
-            cls.cached_modules[path] = copy.deepcopy(module)
-        else:
-            module = copy.deepcopy(cls.cached_modules[path])
+        module = cls.cached_modules.get(path)
+        if module is None:
+            stat_key = ModuleCache.stat_key(path)
+            module = cls.parse_file(path, backend)
+            cls.cached_modules.put(path, module, stat_key)
 
-        return module
+        return module.clone(shared)
 
     @classmethod
-    def from_library(cls, lib, name):
+    def load_many(cls, items, workers=None, backend=None, chunk_size=None,
+                  shared=False):
+        '''Returns the modules at a list of paths or (library, name) tuples
+        in the same order.  Modules that aren't cached are parsed by a pool
+        of worker processes and added to the cache.  If loading an item
+        fails the exception takes the place of its module.  workers
+        defaults to the number of CPUs, 1 parses in this process.  shared
+        is passed on to clone.'''
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if backend is None:
+            backend = pykicad.sexpr.PARSER_BACKEND
+
+        results = [None] * len(items)
+        pending = OrderedDict()
+        for i, item in enumerate(items):
+            path = item
+            if isinstance(item, tuple):
+                try:
+                    path = find_module(*item)
+                except Exception as e:
+                    path, results[i] = None, e
+                if path is None:
+                    if results[i] is None:
+                        results[i] = LookupError(
+                            'Footprint {1} in Library {0} Not Found!'
+                            .format(*item))
+                    continue
+            module = cls.cached_modules.get(path)
+            if module is not None:
+                results[i] = module
+            else:
+                pending.setdefault(path, []).append(i)
+
+        paths = list(pending)
+        stat_keys = [ModuleCache.stat_key(path) for path in paths]
+        args = (backend, pykicad.sexpr.PARSE_CACHE_DIR,
+                pykicad.sexpr.POINT_ARRAYS)
+        if workers <= 1 or len(paths) <= 1:
+            parsed = _load_modules(paths, *args)
+        else:
+            if chunk_size is None:
+                chunk_size = max(1, len(paths) // (workers * 4))
+            chunks = [paths[i:i + chunk_size]
+                      for i in range(0, len(paths), chunk_size)]
+            parsed = []
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [executor.submit(_load_modules, chunk, *args)
+                           for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    try:
+                        parsed += future.result()
+                    except Exception as e:
+                        parsed += [e] * len(chunk)
+
+        for path, stat_key, module in zip(paths, stat_keys, parsed):
+            if isinstance(module, Module):
+                cls.cached_modules.put(path, module, stat_key)
+            for i in pending[path]:
+                results[i] = module
+
+        return [module.clone(shared) if isinstance(module, Module) else module
+                for module in results]
+
+    @classmethod
+    def from_library(cls, lib, name, shared=False):
         '''Returns parsed module with specified name from specified library'''
         path = find_module(lib, name)
         assert path is not None, \
         "Footprint {0} in Library {1} Not Found!".format(name, lib)
-        return cls.from_file(find_module(lib, name))
+        return cls.from_file(find_module(lib, name), shared=shared)
 
     def __init__(self, name, version=None, locked=False, placed=False,
                  layer='F.Cu', tedit=None, tstamp=None, at=None,
@@ -590,6 +872,51 @@ class Module(AST):
                                              arcs=arcs, curves=curves, polygons=polygons,
                                              pads=pads, model=model, rotation=rotation)
 
+    def clone(self, shared=False):
+        '''Returns a copy of the module that can be changed without changing
+        this one.
+
+        With shared the copy only gets its own position, pads and lists.
+        The texts, graphics and models in the lists are shared with this
+        module until a method of either module modifies them, and the pads
+        share their drill and net.  Call unshare() before modifying them in
+        place any other way.'''
+        clone = self.__class__(**dict(self.attributes))
+        clone.at = list(self.at)
+        clone.pads = [pad.copy() for pad in self.pads]
+        if shared:
+            for attr in self.shared_attrs:
+                value = getattr(self, attr)
+                if isinstance(value, list):
+                    setattr(clone, attr, list(value))
+            # Both modules have to copy before modifying them from now on
+            self._shared = set(self.shared_attrs)
+            clone._shared = set(self.shared_attrs)
+            return clone
+        for pad in clone.pads:
+            if pad.drill is not None:
+                pad.drill = copy_element(pad.drill)
+            if pad.net is not None:
+                pad.net = copy.copy(pad.net)
+        for attr in self.child_attrs['copy']:
+            if attr != 'pads':
+                setattr(clone, attr, [copy_element(elem)
+                                      for elem in getattr(self, attr)])
+        clone.model = copy.deepcopy(self.model)
+        return clone
+
+    def unshare(self, *attrs):
+        '''Copies the attributes that are shared with the module this one
+        was cloned from, so that they can be modified in place. Copies all
+        shared attributes if none are given.'''
+        shared = getattr(self, '_shared', None)
+        if not shared:
+            return
+        for attr in attrs or list(shared):
+            if attr in shared:
+                shared.discard(attr)
+                setattr(self, attr, copy.deepcopy(getattr(self, attr)))
+
     def pads_by_name(self, name):
         '''Returns a list of pads.
         The pads in the list may be in an arbitrary order, or be
@@ -605,6 +932,7 @@ class Module(AST):
         Aside from changing the name, we also need to update the
         textual elements of type 'reference'.'''
         self.name = name
+        self.unshare('texts')
         for text in self.texts:
             if text.type == 'reference':
                 text.text = name
@@ -612,6 +940,7 @@ class Module(AST):
     def set_value(self, value):
         '''Change the value of a module.
         Updates all textual elements of type 'value'.'''
+        self.unshare('texts')
         for text in self.texts:
             if text.type == 'value':
                 text.text = value
@@ -622,6 +951,47 @@ class Module(AST):
             for elem in element_list:
                 yield elem
 
+    def bounding_box(self):
+        '''Returns the (xmin, ymin, xmax, ymax) bounding box of the pads and
+        graphics relative to the origin of the module, or None if there are
+        none.  Arcs are bounded by their full circle.'''
+        points = []
+        for pad in self.pads:
+            if pad.size is None:
+                continue
+            w, h = pad.size[0] / 2, pad.size[1] / 2
+            angle = math.radians(pad.at[2]) if len(pad.at) > 2 else 0
+            dx = abs(w * math.cos(angle)) + abs(h * math.sin(angle))
+            dy = abs(w * math.sin(angle)) + abs(h * math.cos(angle))
+            points.append((pad.at[0] - dx, pad.at[1] - dy))
+            points.append((pad.at[0] + dx, pad.at[1] + dy))
+
+        for elem in self.geometry():
+            r = (elem.width or 0) / 2
+            if isinstance(elem, (Circle, Arc)):
+                # The start of an arc is its center
+                if isinstance(elem, Circle):
+                    center = elem.center
+                else:
+                    center = elem.start
+                r += math.hypot(elem.end[0] - center[0],
+                                elem.end[1] - center[1])
+                pts = [center]
+            elif isinstance(elem, Curve):
+                pts = [elem.start, elem.bezier1, elem.bezier2, elem.end]
+            elif isinstance(elem, Polygon):
+                pts = elem.pts
+            else:
+                pts = [elem.start, elem.end]
+            for x, y in pts:
+                points.append((x - r, y - r))
+                points.append((x + r, y + r))
+
+        if not points:
+            return None
+        xs, ys = zip(*points)
+        return (min(xs), min(ys), max(xs), max(ys))
+
     def elements_by_layer(self, layer):
         '''Returns a iterator of elements on layer.'''
         for elem in self.geometry():
@@ -640,6 +1010,12 @@ class Module(AST):
     def rotate(self, angle):
         '''Rotates the module by an angle.
         Also applies rotation to all text elements and pads.'''
+        self._rotate(angle)
+        self._rotate_children(self.rotation if 'B.Cu' not in self.layer
+                              else -self.rotation)
+
+    def _rotate(self, angle):
+        '''Rotates the module but not its children.'''
 
         # Update component rotation
         self.rotation = angle
@@ -653,23 +1029,374 @@ class Module(AST):
         else:
             self.at.append(angle)
 
+    def _rotate_children(self, angle):
         for pad in self.pads:
             pad.rotate(angle)
 
+        self.unshare('texts')
         for text in self.texts:
             text.rotate(angle)
 
     def connect(self, pad, net):
         '''Sets the net on all pads called :data:pad.'''
+        if self._pending is not None:
+            self._defer('nets', {pad: net})
+            return
         for pad in self.pads_by_name(pad):
             pad.net = net
 
     def flip(self):
-        self.rotate(-2 * self.rotation)
+        self.rotate(-2 * (self.rotation or 0))
         self.layer = flip_layer(self.layer)
+        self._flip_children()
+
+    def _flip_children(self):
+        self.unshare()
         for pad in self.pads:
             pad.flip()
         for text in self.texts:
             text.flip()
         for elem in self.geometry():
             elem.flip()
+
+    def set_transform(self, x, y, angle=None, side=None):
+        '''Moves the module to x, y, turns it to the angle in degrees and
+        flips it to side, 'F' or 'B', like place, rotate and flip would.
+        The pads, texts and graphics are only rotated and flipped the first
+        time they are read through the module, so references to them that
+        were taken before are stale until then.'''
+        if side is not None and self.layer.split('.')[0] != side[0]:
+            self._rotate(-2 * (self.rotation or 0))
+            self._defer('rotate', -self.rotation
+                        if 'B.Cu' in self.layer else self.rotation)
+            self.layer = flip_layer(self.layer)
+            self._defer('flip')
+        if angle is not None:
+            current = self.at[2] if len(self.at) > 2 else 0
+            delta = angle - current
+            if delta or len(self.at) < 3:
+                self._rotate(-delta if 'B.Cu' in self.layer else delta)
+            if delta:
+                self._defer('rotate', delta)
+        self.at[0] = x
+        self.at[1] = y
+
+    def _defer(self, op, arg=None):
+        '''Queues an operation on the children and takes them out of their
+        slots until it's applied.'''
+        pending = self._pending
+        if pending is None:
+            pending = ([], {})
+            object.__setattr__(self, '_pending', pending)
+        ops, children = pending
+        if ops and op == ops[-1][0] == 'rotate':
+            ops[-1] = (op, ops[-1][1] + arg)
+        elif ops and op == ops[-1][0] == 'nets':
+            ops[-1][1].update(arg)
+        else:
+            ops.append((op, arg))
+        for attr in self.child_attrs[op]:
+            if attr not in children:
+                children[attr] = getattr(self, attr)
+                object.__delattr__(self, attr)
+
+    def resolve(self):
+        '''Applies the operations that set_transform, connect and
+        Footprint.place deferred to the children.'''
+        pending = self._pending
+        if pending is None:
+            return
+        object.__setattr__(self, '_pending', None)
+        ops, children = pending
+        for attr, value in children.items():
+            object.__setattr__(self, attr, value)
+        for op, arg in ops:
+            if op == 'copy':
+                for attr in self.child_attrs['copy']:
+                    setattr(self, attr, [copy_element(elem)
+                                         for elem in getattr(self, attr)])
+            elif op == 'rotate':
+                self._rotate_children(arg)
+            elif op == 'flip':
+                self._flip_children()
+            elif op == 'nets':
+                for pad in self.pads:
+                    if pad.name in arg:
+                        pad.net = arg[pad.name]
+            elif op == 'label':
+                for text in self.texts:
+                    if text.type == 'reference':
+                        text.text = self.name
+                    elif text.type == 'value' and arg is not None:
+                        text.text = arg
+
+    def tree(self, attributes=None, deferred=False):
+        # Modules placed from a Footprint are printed from copies of the
+        # shared children that aren't kept
+        pending = self._pending
+        if attributes is None and pending is not None and \
+                pending[0][0][0] == 'copy':
+            module = Module.__new__(Module)
+            for slot in ('_source',) + self._fields:
+                try:
+                    value = object.__getattribute__(self, slot)
+                except AttributeError:
+                    continue
+                object.__setattr__(module, slot, value)
+            object.__setattr__(module, '_shared', set(self._shared or ()))
+            object.__setattr__(module, '_pending',
+                               (list(pending[0]), dict(pending[1])))
+            module.resolve()
+            return module.tree(None, deferred)
+        return super(Module, self).tree(attributes, deferred)
+
+    def __getattr__(self, attr):
+        if attr == '_pending':
+            return None
+        # Children taken out of their slots by _defer
+        if attr[0] != '_' and self._pending is not None:
+            self.resolve()
+            return getattr(self, attr)
+        return super(Module, self).__getattr__(attr)
+
+    @property
+    def attributes(self):
+        '''Mapping of the attribute names to values.'''
+        if self._pending is not None:
+            self.resolve()
+        return AST.attributes.fget(self)
+
+    @attributes.setter
+    def attributes(self, attributes):
+        object.__setattr__(self, '_pending', None)
+        AST.attributes.fset(self, attributes)
+
+
+class Footprint(object):
+    '''Footprint definition shared by the modules placed from it.
+
+    The modules returned by place only hold their position, side,
+    reference, value and pad nets.  Their pads, texts and graphics are the
+    ones of the definition until they are first read through the module,
+    then the module gets its own copies.  Printing a module, like
+    Pcb.to_string does, works on copies that aren't kept.  The definition
+    must not be changed once modules are placed from it.'''
+    __slots__ = ('module', 'children')
+
+    def __init__(self, module):
+        self.module = module
+        self.children = dict((attr, getattr(module, attr))
+                             for attr in Module.child_attrs['copy'])
+
+    @classmethod
+    def from_file(cls, path, backend=None):
+        return cls(Module.from_file(path, backend))
+
+    @classmethod
+    def from_library(cls, lib, name):
+        return cls(Module.from_library(lib, name))
+
+    def place(self, reference, x=0, y=0, angle=None, side=None, value=None,
+              nets=None):
+        '''Returns a module of this footprint called reference at x, y,
+        turned to angle and on side, 'F' or 'B'.  nets maps pad names to
+        their Net.'''
+        definition = self.module
+        module = Module.__new__(Module)
+        object.__setattr__(module, '_source', None)
+        for field in Module._fields:
+            if field not in self.children:
+                object.__setattr__(module, field, getattr(definition, field))
+        object.__setattr__(module, '_shared', {'model'})
+        # _defer and resolve work on the dict of the module
+        object.__setattr__(module, '_pending', ([('copy', None)],
+                                                dict(self.children)))
+        module.name = reference
+        module.at = list(definition.at)
+        module._defer('label', value)
+        if nets:
+            module._defer('nets', dict(nets))
+        module.set_transform(x, y, angle, side)
+        return module
+
+
+class LibraryIndex(object):
+    '''SQLite index of the footprints in the libraries on the module search
+    path.
+
+    Records the library, name, path and modification time of every
+    footprint together with its descr, tags, number of pads, layer and
+    bounding box.  refresh() only scans the libraries whose directory
+    changed since the last refresh and only parses the footprints that
+    changed.  Files edited in place don't change the directory, use
+    refresh(full=True) to find them.'''
+    schema = '''
+    CREATE TABLE IF NOT EXISTS libraries (
+        path TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        mtime INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS libraries_name ON libraries (name, position);
+    CREATE TABLE IF NOT EXISTS footprints (
+        path TEXT PRIMARY KEY,
+        directory TEXT NOT NULL,
+        library TEXT NOT NULL,
+        name TEXT NOT NULL,
+        mtime INTEGER NOT NULL,
+        descr TEXT,
+        tags TEXT,
+        pads INTEGER,
+        layer TEXT,
+        xmin REAL,
+        ymin REAL,
+        xmax REAL,
+        ymax REAL
+    );
+    CREATE INDEX IF NOT EXISTS footprints_directory
+        ON footprints (directory, name);
+    CREATE INDEX IF NOT EXISTS footprints_library
+        ON footprints (library, name);
+    '''
+    columns = ['library', 'name', 'path', 'mtime', 'descr', 'tags', 'pads',
+               'layer', 'xmin', 'ymin', 'xmax', 'ymax']
+
+    def __init__(self, database=':memory:', search_path=None):
+        '''Opens the index stored in database.  search_path is a list of
+        directories and defaults to the MODULE_SEARCH_PATH variable.'''
+        self.search_path = search_path
+        self.db = sqlite3.connect(database)
+        self.db.executescript(self.schema)
+
+    def roots(self):
+        '''Returns the directories the libraries are searched in.'''
+        if self.search_path is not None:
+            return list(self.search_path)
+        paths = os.environ.get(MODULE_SEARCH_PATH, '').split(os.pathsep)
+        return [path for path in paths if path]
+
+    def refresh(self, full=False):
+        '''Brings the index up to date with the search path.  Libraries are
+        rescanned if their directory changed or if full is True.'''
+        seen = set()
+        with self.db:
+            for position, root in enumerate(self.roots()):
+                try:
+                    entries = sorted(os.listdir(root))
+                except OSError:
+                    continue
+                for entry in entries:
+                    path = os.path.join(root, entry)
+                    if not entry.endswith('.pretty') or path in seen or \
+                       not os.path.isdir(path):
+                        continue
+                    seen.add(path)
+                    name = '.'.join(entry.split('.')[0:-1])
+                    mtime = os.stat(path).st_mtime_ns
+                    row = self.db.execute(
+                        'SELECT mtime FROM libraries WHERE path = ?',
+                        (path,)).fetchone()
+                    if full or row is None or row[0] != mtime:
+                        self.scan(path, name)
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO libraries VALUES (?, ?, ?, ?)',
+                        (path, name, position, mtime))
+
+            rows = self.db.execute('SELECT path FROM libraries').fetchall()
+            for path, in rows:
+                if path not in seen:
+                    self.db.execute(
+                        'DELETE FROM footprints WHERE directory = ?', (path,))
+                    self.db.execute('DELETE FROM libraries WHERE path = ?',
+                                    (path,))
+
+    def scan(self, directory, library):
+        '''Updates the footprints of the library in directory.'''
+        known = dict(self.db.execute(
+            'SELECT path, mtime FROM footprints WHERE directory = ?',
+            (directory,)))
+        for entry in os.listdir(directory):
+            if not entry.endswith('.kicad_mod'):
+                continue
+            path = os.path.join(directory, entry)
+            mtime = os.stat(path).st_mtime_ns
+            if known.pop(path, None) == mtime:
+                continue
+            name = '.'.join(entry.split('.')[0:-1])
+            self.db.execute(
+                'INSERT OR REPLACE INTO footprints VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, directory, library, name, mtime) + self.describe(path))
+        for path in known:
+            self.db.execute('DELETE FROM footprints WHERE path = ?', (path,))
+
+    @staticmethod
+    def describe(path):
+        '''Returns the descr, tags, number of pads, layer and bounding box
+        of the footprint at path.  Footprints that can't be parsed are
+        described by None.'''
+        try:
+            module = Module.parse_file(path, 'descent')
+        except (ParseException, UnicodeDecodeError):
+            return (None,) * 8
+        box = module.bounding_box() or (None,) * 4
+        return (module.descr, module.tags, len(module.pads),
+                module.layer) + tuple(box)
+
+    def find_library(self, library):
+        '''Returns full path of specified library'''
+        row = self.db.execute(
+            'SELECT path FROM libraries WHERE name = ? '
+            'ORDER BY position LIMIT 1', (library,)).fetchone()
+        return row and row[0]
+
+    def find_module(self, library, module):
+        '''Returns full path of specified module'''
+        row = self.db.execute(
+            'SELECT f.path FROM footprints f '
+            'JOIN libraries l ON f.directory = l.path '
+            'WHERE l.name = ? AND f.name = ? '
+            'ORDER BY l.position LIMIT 1', (library, module)).fetchone()
+        return row and row[0]
+
+    def list_libraries(self):
+        '''Returns all footprint libraries'''
+        return [name for name, in self.db.execute(
+            'SELECT name FROM libraries ORDER BY position, name')]
+
+    def list_modules(self, library):
+        '''Returns all modules in specific library'''
+        return [name for name, in self.db.execute(
+            'SELECT name FROM footprints WHERE directory = ? ORDER BY name',
+            (self.find_library(library),))]
+
+    def list_all_modules(self):
+        '''Returns all modules in all libraries'''
+        return [name for name, in self.db.execute(
+            'SELECT f.name FROM footprints f '
+            'JOIN libraries l ON f.directory = l.path '
+            'ORDER BY l.position, l.name, f.name')]
+
+    def footprint(self, library, module):
+        '''Returns a dict of the indexed columns of specified module or None
+        if it isn't in the index.'''
+        row = self.db.execute(
+            'SELECT %s FROM footprints f '
+            'JOIN libraries l ON f.directory = l.path '
+            'WHERE l.name = ? AND f.name = ? '
+            'ORDER BY l.position LIMIT 1' %
+            ', '.join('f.' + column for column in self.columns),
+            (library, module)).fetchone()
+        return row and dict(zip(self.columns, row))
+
+    def search(self, text):
+        '''Returns the (library, name) of the footprints whose name, descr
+        or tags contain text.'''
+        pattern = '%' + text + '%'
+        return self.db.execute(
+            'SELECT library, name FROM footprints '
+            'WHERE name LIKE ? OR descr LIKE ? OR tags LIKE ? '
+            'ORDER BY library, name', (pattern,) * 3).fetchall()
+
+    def close(self):
+        self.db.close()
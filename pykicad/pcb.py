@@ -626,6 +626,113 @@ def comment(number):
     }
 
 
+class ItemList(list):
+    '''List of AST items with lazily built indexes for find.  Indexes are
+    updated by append and extend and dropped by other changes of the list.
+    Items whose indexed attribute changed in place are found by scanning
+    the list, which rebuilds the index.'''
+    __slots__ = ('_indexes',)
+
+    def __init__(self, *args):
+        super(ItemList, self).__init__(*args)
+        self._indexes = {}
+
+    def __reduce__(self):
+        # The indexes are rebuilt on demand
+        return self.__class__, (list(self),)
+
+    def index_by(self, attr):
+        '''Returns a dict mapping the values of attr to the first item with
+        that value.'''
+        index = self._indexes.get(attr)
+        if index is None:
+            index = self._indexes[attr] = {}
+            for item in self:
+                self._add(index, attr, item)
+        return index
+
+    @staticmethod
+    def _add(index, attr, item):
+        key = getattr(item, attr)
+        if key is not None and key not in index:
+            index[key] = item
+
+    def find(self, attr, value):
+        '''Returns the first item whose attr equals value or None.'''
+        item = self.index_by(attr).get(value)
+        if item is not None and getattr(item, attr) == value:
+            return item
+        # Missing from the index or changed in place since it was built
+        stale = item is not None
+        for item in self:
+            if getattr(item, attr) == value:
+                self.reindex()
+                return item
+        if stale:
+            self.reindex()
+        return None
+
+    def reindex(self):
+        self._indexes = {}
+
+    def append(self, item):
+        super(ItemList, self).append(item)
+        for attr, index in self._indexes.items():
+            self._add(index, attr, item)
+
+    def extend(self, items):
+        start = len(self)
+        super(ItemList, self).extend(items)
+        for attr, index in self._indexes.items():
+            for item in self[start:]:
+                self._add(index, attr, item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def _changes(method):
+        def change(self, *args):
+            self._indexes = {}
+            return method(self, *args)
+        change.__name__ = method.__name__
+        return change
+
+    insert = _changes(list.insert)
+    remove = _changes(list.remove)
+    pop = _changes(list.pop)
+    clear = _changes(list.clear)
+    sort = _changes(list.sort)
+    reverse = _changes(list.reverse)
+    __setitem__ = _changes(list.__setitem__)
+    __delitem__ = _changes(list.__delitem__)
+    __imul__ = _changes(list.__imul__)
+    del _changes
+
+
+class _ItemListSlot(object):
+    '''Slot of an AST that holds an ItemList.  Lists stored in the slot,
+    by the constructor, the parsers or an assignment, are wrapped in an
+    ItemList.'''
+    __slots__ = ('slot',)
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return self.slot.__get__(instance, owner)
+
+    def __set__(self, instance, value):
+        if isinstance(value, list) and not isinstance(value, ItemList):
+            value = ItemList(value)
+        self.slot.__set__(instance, value)
+
+    def __delete__(self, instance):
+        self.slot.__delete__(instance)
+
+
 class Pcb(AST):
     tag = 'kicad_pcb'
     schema = {
@@ -783,6 +890,14 @@ class Pcb(AST):
         }
     }
 
+    # Lists of top level items that from_file(lazy=True) parses on first
+    # access
+    lazy_attrs = ['net_classes', 'modules', 'segments', 'vias', 'texts',
+                  'lines', 'arcs', 'circles', 'polygons', 'curves', 'zones',
+                  'targets', 'dimensions']
+    # Lists of items that are looked up with ItemList.find
+    indexed_attrs = ['nets'] + lazy_attrs
+
     def __init__(self, version=1, host=['pykicad', 'x.x.x'],
                  board_thickness=None, board_area=None,
                  num_nets=None, num_no_connects=None, num_tracks=None,
@@ -841,11 +956,23 @@ class Pcb(AST):
         '''Returns the outline of a pcb.'''
         return list(self.elements_by_layer('Edge.Cuts'))
 
+    def indexed(self, attr):
+        '''Returns the ItemList attr, an empty one if attr isn't set.'''
+        items = getattr(self, attr)
+        if items is None:
+            return ItemList()
+        return items
+
     def module_by_reference(self, name):
         '''Returns a module called name.'''
-        for module in self.modules:
-            if module.name == name:
-                return module
+        return self.indexed('modules').find('name', name)
+
+    def item_by_tstamp(self, tstamp):
+        '''Returns the top level item with tstamp.'''
+        for attr in self.lazy_attrs:
+            item = self.indexed(attr).find('tstamp', tstamp)
+            if item is not None:
+                return item
 
     def extent(self, padding=5):
         min_pos = 1e8, 1e8
@@ -871,22 +998,28 @@ class Pcb(AST):
 
     def net_by_code(self, code):
         '''Returns a net with code.'''
-        for net in self.nets:
-            if net.code == code:
-                return net
+        return self.indexed('nets').find('code', code)
 
     def net_by_name(self, name):
         '''Returns a net with label.'''
-        for net in self.nets:
-            if net.name == name:
-                return net
+        return self.indexed('nets').find('name', name)
 
-    def to_file(self, path):
+    def to_file(self, path, streaming=False):
+        '''Writes the pcb to path.  With streaming the file is written one
+        top level item at a time instead of building the whole string.'''
         if not path.endswith('.kicad_pcb'):
             path += '.kicad_pcb'
         with open(path, 'w+', encoding='utf-8') as f:
-            f.write(self.to_string())
+            if streaming:
+                self.write(f)
+            else:
+                f.write(self.to_string())
 
     @classmethod
-    def from_file(cls, path):
-        return Pcb.parse(open(path, encoding='utf-8').read())
+    def from_file(cls, path, backend=None, lazy=False):
+        return Pcb.parse_file(path, backend, Pcb.lazy_attrs if lazy else None)
+
+
+for attr in Pcb.indexed_attrs:
+    setattr(Pcb, attr, _ItemListSlot(Pcb.__dict__[attr]))
+del attr
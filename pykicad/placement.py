@@ -0,0 +1,151 @@
+from pykicad.spatial import layer_matches
+
+
+def _column(values, count, name):
+    if values is None:
+        return [None] * count
+    # Plain floats, numpy scalars would end up in the at lists
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    if len(values) != count:
+        raise ValueError('Expected %d values of %s, got %d' %
+                         (count, name, len(values)))
+    return values
+
+
+def place_modules(modules, x, y, angle=None, side=None):
+    '''Moves the i-th module to x[i], y[i], turns it to angle[i] degrees
+    and flips it to side[i], 'F' or 'B'.  The arguments can be lists or
+    numpy arrays.  Only the positions of the modules are set, their pads,
+    texts and graphics are rotated and flipped the first time they are
+    read, see Module.set_transform.'''
+    count = len(modules)
+    columns = zip(modules, _column(x, count, 'x'), _column(y, count, 'y'),
+                  _column(angle, count, 'angle'), _column(side, count, 'side'))
+    for module, x, y, angle, side in columns:
+        module.set_transform(x, y, angle, side)
+
+
+def module_transforms(modules):
+    '''Returns the (M, 3) array of the x, y and angle in degrees of every
+    module.'''
+    import numpy
+    return numpy.array([(at[0], at[1], at[2] if len(at) > 2 else 0)
+                        for at in [module.at for module in modules]],
+                       float).reshape(-1, 3)
+
+
+def module_sides(modules):
+    '''Returns the array of flags that are True for the modules on the
+    back.'''
+    import numpy
+    return numpy.array([module.layer is not None and
+                        module.layer.split('.')[0] == 'B'
+                        for module in modules], bool)
+
+
+class PadArrays(object):
+    '''Board coordinates of the pads of a list of modules, one row per pad
+    in the order of modules and their pads.
+
+    The pads are read once, update() then computes the position and angle
+    of every pad from the current position of the modules in one pass:
+
+        x, y       board coordinates of the pad centers
+        angle      absolute angle of the pads in degrees
+        module     index of the module of every pad
+        front      True for pads on F.Cu
+        back       True for pads on B.Cu
+        width      size of the pads
+        height
+        circle     True for round pads
+
+    Angles are counterclockwise like in pcbnew, the y axis points down.
+    Pads of modules on the back are mirrored already, they are only
+    rotated and moved like the pads on the front.  Modules that were
+    flipped since the pads were read are mirrored by update like
+    Module.flip mirrors their pads: the local y is negated and F.Cu and
+    B.Cu are swapped.'''
+
+    def __init__(self, modules):
+        import numpy
+        self.modules = list(modules)
+        self.pads = [pad for module in self.modules for pad in module.pads]
+        counts = [len(module.pads) for module in self.modules]
+        self.module = numpy.repeat(numpy.arange(len(self.modules)), counts)
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+        local, size, sides = [], [], []
+        # Most pads share their layers
+        layer_sides = {}
+        for pad in self.pads:
+            at = pad.at
+            local.append((at[0], at[1], at[2] if len(at) > 2 else 0))
+            size.append(pad.size[:2] if pad.size is not None else (0, 0))
+            layers = tuple(pad.layers)
+            if layers not in layer_sides:
+                layer_sides[layers] = [
+                    any(layer_matches(layer, side) for layer in layers)
+                    for side in ['F.Cu', 'B.Cu']]
+            sides.append(layer_sides[layers])
+        local = numpy.array(local, float).reshape(-1, 3)
+        size = numpy.array(size, float).reshape(-1, 2)
+        sides = numpy.array(sides, bool).reshape(-1, 2)
+        circle = numpy.array([pad.shape == 'circle' for pad in self.pads],
+                             bool)
+        # Pad angles on a board include the rotation of the module, keep
+        # them relative to it
+        transforms = module_transforms(self.modules)
+        local[:, 2] -= transforms[self.module, 2]
+        self.local = local
+        self.width, self.height = size[:, 0], size[:, 1]
+        # Sides of the pads and modules when the pads were read
+        self.pad_sides = sides
+        self.module_back = module_sides(self.modules)
+        self.circle = circle
+        self.update(transforms)
+
+    def __len__(self):
+        return len(self.pads)
+
+    def update(self, transforms=None):
+        '''Computes the board coordinates from the positions of the
+        modules, or from the (M, 3) array of their x, y and angle.  The
+        sides are always read from the modules.'''
+        import numpy
+        if transforms is None:
+            transforms = module_transforms(self.modules)
+        t = transforms[self.module]
+        flipped = module_sides(self.modules) != self.module_back
+        flipped = flipped[self.module]
+        sides = numpy.where(flipped[:, None], self.pad_sides[:, ::-1],
+                            self.pad_sides)
+        self.front, self.back = sides[:, 0], sides[:, 1]
+        radians = numpy.radians(t[:, 2])
+        c, s = numpy.cos(radians), numpy.sin(radians)
+        x = self.local[:, 0]
+        y = numpy.where(flipped, -self.local[:, 1], self.local[:, 1])
+        self.x = t[:, 0] + x * c + y * s
+        self.y = t[:, 1] - x * s + y * c
+        self.angle = self.local[:, 2] + t[:, 2]
+
+    @property
+    def positions(self):
+        '''The (N, 2) array of the pad centers.'''
+        import numpy
+        return numpy.column_stack([self.x, self.y])
+
+    def rows(self, i):
+        '''Returns the slice of the rows of the pads of the i-th module.'''
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def bounding_boxes(self):
+        '''Returns the (N, 4) array of the (xmin, ymin, xmax, ymax) boxes of
+        the rotated pads.  Trapezoids are bounded by their rectangle.'''
+        import numpy
+        radians = numpy.radians(self.angle)
+        c, s = numpy.abs(numpy.cos(radians)), numpy.abs(numpy.sin(radians))
+        w, h = self.width / 2, self.height / 2
+        dx = numpy.where(self.circle, w, w * c + h * s)
+        dy = numpy.where(self.circle, w, w * s + h * c)
+        return numpy.column_stack([self.x - dx, self.y - dy,
+                                   self.x + dx, self.y + dy])
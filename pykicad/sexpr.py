@@ -1,9 +1,40 @@
 from pyparsing import *
 from functools import reduce
-
+from collections.abc import MutableMapping
+
+import os
+import re
+import sys
+import time
+import atexit
+import hashlib
+import inspect
+import itertools
+import json
+import mmap
+import pickle
+import tempfile
+import weakref
 import pyparsing
 pyparsing.ParserElement.enablePackrat()
 
+# Parser backend used by AST.parse. 'pyparsing' uses the grammar built by
+# generate_parser, 'descent' tokenizes the input and walks the schema with a
+# recursive descent parser.
+PARSER_BACKEND = 'pyparsing'
+
+# When True the descent backend parses runs of (xy x y) marked with _points
+# in a schema into (N, 2) float64 numpy arrays instead of lists of tuples.
+POINT_ARRAYS = False
+
+# Directory in which AST.parse_file keeps the parsed files, so that they
+# don't have to be parsed again by later runs. None disables the cache.
+PARSE_CACHE_DIR = None
+
+# The Profiler that is recording, see Profiler.  Set PYKICAD_PROFILE in the
+# environment to profile the whole process.
+PROFILER = None
+
 text = dblQuotedString | Word(printables + alphas8bit, excludeChars=')')
 # text = pyparsing.quotedString.addParseAction(pyparsing.removeQuotes)
 # number = Combine(Optional('-') + Word(nums) + Optional(Word('.') + Word(nums)))
@@ -87,14 +118,100 @@ def reduce_parser_list(parsers, func):
         return reduce(func, parsers)
     return Empty()
 
-def sexpr(name, positional=None, single=None, multiple=None):
+
+_peek_re = re.compile(r'\s*(\(?)\s*([^\s()]*)')
+
+
+class UnorderedChildren(ParserElement):
+    '''Matches the children of an sexpr that can appear in any order.
+    Instead of trying every child parser at every position like Each does,
+    the tag following the '(' is used to look up the parsers that can match
+    in a dict.  Children without a tag (flags) are tried when the next
+    token isn't a '('.
+
+    children is a list of (tag, parser, multiple) tuples, where parser
+    matches a single instance of the child.  Like with Each, children
+    without multiple set can only be matched once.  When tag is given the
+    children are followed by the closing ')' of an sexpr called tag and an
+    unknown tag raises a ParseFatalException.'''
+
+    def __init__(self, children, tag=None):
+        super(UnorderedChildren, self).__init__()
+        self.children = children
+        self.tag = tag
+        self.tagged, self.bare, self.anytag = {}, [], []
+        for n, (tag, parser, multiple) in enumerate(children):
+            child = parser, 0 if multiple else 1 << n
+            if tag is False:
+                self.bare.append(child)
+            elif tag == '':
+                self.anytag.append(child)
+            else:
+                self.tagged.setdefault(tag, []).append(child)
+        for tag in self.tagged:
+            self.tagged[tag] += self.anytag
+        self.mayReturnEmpty = True
+        self.mayIndexError = False
+
+    def _generateDefaultName(self):
+        return '{%s}' % ' '.join(str(tag) for tag, _, _ in self.children)
+
+    def parseImpl(self, instring, loc, doActions=True):
+        results = ParseResults([])
+        matched = 0
+        while True:
+            paren, tag = _peek_re.match(instring, loc).groups()
+            if paren:
+                candidates = self.tagged.get(tag, self.anytag)
+            elif tag:
+                candidates = self.bare
+            else:
+                break
+
+            for parser, bit in candidates:
+                if matched & bit:
+                    continue
+                try:
+                    next_loc, tokens = parser._parse(instring, loc, doActions)
+                except ParseException:
+                    continue
+                if next_loc > loc:
+                    matched |= bit
+                    break
+            else:
+                if self.tag is not None:
+                    self.unexpected(instring, loc, paren, tag)
+                break
+
+            loc = next_loc
+            results += tokens
+
+        return loc, results
+
+    def unexpected(self, instring, loc, paren, tag):
+        loc = _peek_re.match(instring, loc).start(1)
+        if not paren:
+            msg = 'Unexpected %s' % tag
+        elif tag in self.tagged or self.anytag:
+            msg = 'Invalid (%s' % tag
+        else:
+            msg = 'Unknown tag (%s' % tag
+        raise ParseFatalException(instring, loc, '%s in (%s' % (msg, self.tag))
+
+
+def sexpr(name, positional=None, single=None, multiple=None, children=None):
     if isinstance(positional, ParserElement):
         parser = positional
     else:
         positional = reduce_parser_list(positional, lambda x, y: x + y)
-        single = reduce_parser_list(single, lambda x, y: x & y)
-        multiple = reduce_parser_list(multiple, lambda x, y: x & y)
-        parser = positional + single + multiple
+        if children:
+            unordered = UnorderedChildren(children,
+                                          None if name is False else name)
+        else:
+            single = reduce_parser_list(single, lambda x, y: x & y)
+            multiple = reduce_parser_list(multiple, lambda x, y: x & y)
+            unordered = single + multiple
+        parser = positional + unordered
 
     if name == False:
         return parser
@@ -112,7 +229,14 @@ def generate_parser(tag, schema, attr=None, optional=False):
         return Group(parser).setParseAction(leaf_parse_action(attr))
 
     def ast(ast, attr):
-        return Group(ast.parser()).setParseAction(ast_parse_action(attr, ast))
+        parser = Group(ast.parser())
+        parser.setParseAction(ast_parse_action(attr, ast))
+        # Reported to the profiler by the debug actions of pyparsing
+        parser.ast_class = ast
+        _ast_elements.add(parser)
+        if PROFILER is not None:
+            PROFILER.watch(parser)
+        return parser
 
     # Case 1: schema is a ParserElement
     if isinstance(schema, ParserElement):
@@ -140,7 +264,7 @@ def generate_parser(tag, schema, attr=None, optional=False):
         return parser
 
     # Case 2: schema is a subclass of AST
-    if type(schema) == type and issubclass(schema, AST):
+    if isinstance(schema, type) and issubclass(schema, AST):
 
         if attr is None:
             attr = tag
@@ -181,22 +305,24 @@ def generate_parser(tag, schema, attr=None, optional=False):
             i += 1
 
         # Determine the rest of the arguments. Here the position doesn't matter
-        # within the sexpr. These default to being optional.
-        single = []
-        multiple = []
+        # within the sexpr. These are dispatched on the tag they start with
+        # and are optional.
+        children = []
         for key, value in schema.items():
             # A key is either a number representing a positional argument a
             # special key starting with an underscore or a subschema.
             if not (key.isdigit() or key[0] == '_'):
-                # Tags that have _multiple set need to go after those that don't
-                if isinstance(value, dict) and '_multiple' in value:
-                    children = multiple
-                else:
-                    children = single
-                children.append(generate_parser(tag=key, schema=value,
-                                                attr=None, optional=True))
-
-        parser = sexpr(tag, positional, single, multiple)
+                multiple = isinstance(value, dict) and '_multiple' in value
+                # The parser matches a single child, UnorderedChildren
+                # takes care of repetitions.
+                if isinstance(value, dict):
+                    value = dict(value, _multiple=False, _optional=False)
+                children.append((_start_tag(key, value),
+                                 generate_parser(tag=key, schema=value,
+                                                 attr=None, optional=False),
+                                 multiple))
+
+        parser = sexpr(tag, positional, children=children)
 
     if schema.get('_multiple', False):
         parser = ZeroOrMore(parser)
@@ -206,60 +332,67 @@ def generate_parser(tag, schema, attr=None, optional=False):
     return parser
 
 
-def find_attr(attr, value, schema):
-    '''
-
-    '''
-    def is_leaf_node(schema):
-        if not isinstance(schema, dict):
-            return True
-        if '_parser' in schema:
-            return True
+def _is_leaf_node(schema):
+    if not isinstance(schema, dict):
+        return True
+    if '_parser' in schema:
+        return True
+    return False
+
+
+def _schema_printer(schema):
+    '''Returns the function printing the values of a leaf schema or False
+    if the values are printed by tree_to_string.'''
+    def closure(printer):
+        def print_values(value):
+            if isinstance(value, list):
+                return ' '.join(map(printer, value))
+            return printer(value)
+        # Used by _Deferred to print one value at a time
+        print_values.printer = printer
+        return print_values
+
+    if isinstance(schema, type):
+        return schema.to_string
+
+    if not isinstance(schema, dict):
         return False
 
-    def printer(schema):
-        def closure(printer):
-            return (lambda value: ' '.join(map(printer, value))
-                    if isinstance(value, list) else printer(value))
+    printer = False
+    parser = schema.get('_parser', False)
+    if isinstance(parser, type) and issubclass(parser, AST):
+        printer = parser.to_string
 
-        if type(schema) == type:
-            return schema.to_string
+    printer = schema.get('_printer', printer)
 
-        if not isinstance(schema, dict):
-            return False
-
-        printer = False
-        parser = schema.get('_parser', False)
-        if type(parser) == type and issubclass(parser, AST):
-            printer = parser.to_string
-
-        printer = schema.get('_printer', printer)
+    if schema.get('_multiple', False):
+        printer = closure(printer)
 
-        if schema.get('_multiple', False):
-            printer = closure(printer)
+    return printer
 
-        return printer
 
+def attr_plan(attr, schema):
+    '''Returns how find_attr places a value of attr in a tree: a tuple of
+    the path of keys leading to the value, the printer applied to the value
+    and whether the printed value is wrapped in a ('_', str) tuple.  Returns
+    None if attr is not in schema.'''
     # Case 1: Schema is a leaf node
-    if is_leaf_node(schema):
+    if _is_leaf_node(schema):
         if not isinstance(schema, dict):
             return None
 
         if schema.get('_attr', schema.get('_tag', False)) == attr:
-            printer = printer(schema)
-            if printer:
-                value = ('_', printer(value))
-
+            printer = _schema_printer(schema)
+            path = ()
             if schema.get('_tag', False):
-                value = {schema['_tag']: value}
-
-            return value
+                path = (schema['_tag'],)
+            return path, printer, bool(printer)
 
         return None
 
     # Case 2: Subschema is a leaf node and the schema does not
     # overwrite the _attr.
-    if attr in schema and is_leaf_node(schema[attr]) and \
+    if attr in schema and _is_leaf_node(schema[attr]) and \
        (not isinstance(schema[attr], dict) or
             (schema[attr].get('_attr', attr) == attr)):
 
@@ -269,25 +402,75 @@ def find_attr(attr, value, schema):
         if isinstance(subschema, dict):
             tag = subschema.get('_tag', tag)
 
-        printer = printer(subschema)
+        printer = _schema_printer(subschema)
         if printer:
-            value = printer(value)
             tag = '_' + attr
 
-        return {tag: value}
+        return (tag,), printer, False
 
     # Default: Search in subschemas
     for key, subschema in schema.items():
         if key[0] == '_':
             continue
 
-        found = find_attr(attr, value, subschema)
-        if not found is None:
-            return {key: found}
+        plan = attr_plan(attr, subschema)
+        if not plan is None:
+            path, printer, wrap = plan
+            return (key,) + path, printer, wrap
 
     return None
 
 
+def attr_plans(cls):
+    '''Returns the table mapping attributes of cls to their attr_plan.
+    The table is filled on first use of an attribute and cached on the
+    class.'''
+    if '_attr_plans' not in cls.__dict__:
+        cls._attr_plans = {}
+    return cls._attr_plans
+
+
+class _Deferred(object):
+    '''Value of an attribute that is printed while streaming.  The values
+    of a multiple attribute are printed one at a time.'''
+
+    def __init__(self, printer, value):
+        self.printer = printer
+        self.value = value
+
+    def __iter__(self):
+        printer = getattr(self.printer, 'printer', None)
+        if printer is None or not isinstance(self.value, list):
+            yield self.printer(self.value)
+            return
+        for n, value in enumerate(self.value):
+            if n:
+                yield ' '
+            yield printer(value)
+
+
+def _plan_value(plan, value, deferred=False):
+    path, printer, wrap = plan
+    if printer and deferred:
+        value = _Deferred(printer, value)
+    elif printer:
+        value = printer(value)
+    if wrap:
+        value = ('_', value)
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def find_attr(attr, value, schema):
+    '''Returns the tree printing value as attr of schema or None if attr is
+    not in schema.'''
+    plan = attr_plan(attr, schema)
+    if plan is None:
+        return None
+    return _plan_value(plan, value)
+
+
 def tree_to_string(tree, level=0):
     if isinstance(tree, basestring):
         if tree == '':
@@ -329,6 +512,69 @@ def tree_to_string(tree, level=0):
 
     return ' '.join(pos + single + multiple)
 
+
+def _nonempty(chunks):
+    '''Returns an iterator over chunks or None if all chunks are empty.'''
+    chunks = iter(chunks)
+    for chunk in chunks:
+        if chunk:
+            return itertools.chain([chunk], chunks)
+    return None
+
+
+def iter_tree_string(tree, level=0):
+    '''Yields tree_to_string(tree, level) in pieces.  Values deferred by
+    to_string are printed one item at a time, nested dicts are streamed
+    and everything else is printed by tree_to_string.'''
+    if isinstance(tree, tuple) and tree[0] == '_' and \
+            isinstance(tree[1], _Deferred):
+        for chunk in tree[1]:
+            yield chunk
+        return
+    if not isinstance(tree, dict):
+        yield tree_to_string(tree, level)
+        return
+
+    keys = [key for key in tree.keys() if key.isdigit()]
+    keys.sort()
+    first = True
+    for key in keys:
+        if not first:
+            yield ' '
+        first = False
+        for chunk in iter_tree_string(tree[key], level):
+            yield chunk
+
+    multiple = []
+    for key, value in tree.items():
+        if len(key) > 0 and key[0] == '_':
+            multiple.append(value)
+        elif not key.isdigit():
+            chunks = _nonempty(iter_tree_string(value, level + 1))
+            if chunks is None:
+                continue
+            if not first:
+                yield ' '
+            first = False
+            yield '\n%s(%s ' % (level * '    ', key)
+            for chunk in chunks:
+                yield chunk
+            yield ')'
+
+    for value in multiple:
+        if isinstance(value, _Deferred):
+            chunks = _nonempty(value)
+        else:
+            chunks = _nonempty([value])
+        if chunks is None:
+            continue
+        if not first:
+            yield ' '
+        first = False
+        for chunk in chunks:
+            yield chunk
+
+
 def merge_dict(d1, d2):
     for key, value in d2.items():
         if key in d1:
@@ -341,35 +587,1160 @@ def merge_dict(d1, d2):
         else:
             d1[key] = value
 
-class AST(object):
+
+###########################
+# Recursive descent       #
+###########################
+_string_pattern = r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"'
+_token_re = re.compile(_string_pattern + r'|[()]|[^\s()]+')
+_string_re = re.compile(_string_pattern)
+_number_re = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$',
+                        re.ASCII)
+_integer_re = re.compile(r'\d+$', re.ASCII)
+_hex_re = re.compile(r'[0-9a-fA-F]+$')
+
+# Same as above for tokenizing bytes, mmaps and memoryviews
+_bytes_token_re = re.compile(_token_re.pattern.encode())
+_bytes_number_re = re.compile(_number_re.pattern.encode())
+_bytes_integer_re = re.compile(_integer_re.pattern.encode())
+_bytes_hex_re = re.compile(_hex_re.pattern.encode())
+
+
+def tokenize(string):
+    '''Splits string into a list of '(', ')', quoted string and atom
+    tokens.  Quoted strings keep their quotes.  If string is bytes, an mmap
+    or a memoryview the tokens are bytes.'''
+    if isinstance(string, basestring):
+        return _token_re.findall(string)
+    return _bytes_token_re.findall(string)
+
+
+class _DecodedTokens(object):
+    '''Read only view of a list of bytes tokens that decodes the tokens
+    on access.'''
+
+    def __init__(self, toks):
+        self.toks = toks
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [tok.decode('utf-8') for tok in self.toks[index]]
+        return self.toks[index].decode('utf-8')
+
+
+_paren_re = re.compile(_string_pattern + r'|[()]')
+_tag_re = re.compile(r'\(\s*([^\s()"]+)')
+
+
+def _shallow_pattern(depth):
+    '''Returns a pattern matching an sexpr nested at most depth levels deep.
+    Runs of plain characters alternate with strings and nested sexprs, so
+    a failing match doesn't backtrack.'''
+    item = _string_pattern
+    if depth > 1:
+        item += '|' + _shallow_pattern(depth - 1)
+    return r'\([^()"]*(?:(?:%s)[^()"]*)*\)' % item
+
+
+_shallow_re = re.compile(_shallow_pattern(3))
+_bytes_paren_re = re.compile(_paren_re.pattern.encode())
+_bytes_tag_re = re.compile(_tag_re.pattern.encode())
+_bytes_shallow_re = re.compile(_shallow_re.pattern.encode())
+
+
+def child_spans(string):
+    '''Yields the start, end and tag of every child of the root sexpr in
+    string.  Only parens and quoted strings are looked at.  If string is
+    bytes, an mmap or a memoryview the tags are bytes.'''
+    if isinstance(string, basestring):
+        paren_re, tag_re, shallow_re = _paren_re, _tag_re, _shallow_re
+        open_paren, close_paren = '(', ')'
+    else:
+        paren_re, tag_re = _bytes_paren_re, _bytes_tag_re
+        shallow_re = _bytes_shallow_re
+        open_paren, close_paren = b'(', b')'
+    depth, pos = 0, 0
+    while True:
+        match = paren_re.search(string, pos)
+        if match is None:
+            return
+        pos = match.end()
+        if match.group() == open_paren:
+            depth += 1
+            if depth == 2:
+                start = match.start()
+                tag = tag_re.match(string, start)
+                tag = tag.group(1) if tag else None
+                shallow = shallow_re.match(string, start)
+                if shallow:
+                    depth, pos = 1, shallow.end()
+                    yield start, pos, tag
+        elif match.group() == close_paren:
+            depth -= 1
+            if depth == 1:
+                yield start, pos, tag
+
+
+def tokenize_file(fp, chunk_size=2 ** 16):
+    '''Tokenizes the file object fp reading chunk_size characters at a time
+    and yields a list of tokens per chunk.  Tokens never span a newline, so
+    each chunk is split after its last newline and the rest is carried over
+    to the next one.  Chunks without a newline, like those of minified
+    files, are split after their last whitespace or parenthesis outside of
+    a quoted string.'''
+    rest = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        end = chunk.rfind('\n') + 1
+        if end:
+            rest = chunk[end:]
+            yield _token_re.findall(chunk, 0, end)
+            continue
+        end = max(chunk.rfind(' '), chunk.rfind('\t'), chunk.rfind('('),
+                  chunk.rfind(')')) + 1
+        matches = list(_token_re.finditer(chunk, 0, end))
+        # A quote that isn't closed yet starts a string in the next chunk
+        for match in matches:
+            if match.group()[0] == '"' and \
+                    not _string_re.fullmatch(match.group()):
+                end = match.start()
+                break
+        tokens = [match.group() for match in matches if match.end() <= end]
+        rest = chunk[end:]
+        if tokens:
+            yield tokens
+    if rest:
+        yield _token_re.findall(rest)
+
+
+class _Mismatch(Exception):
+    def __init__(self, index, msg):
+        super(_Mismatch, self).__init__(index, msg)
+        self.index = index
+        self.msg = msg
+
+
+def _unexpected(toks, i, tag, dispatch):
+    '''Returns the _Mismatch for an sexpr called tag that isn't closed at
+    index i.'''
+    if not isinstance(toks[i], basestring):
+        dispatch = dict((key.decode('utf-8'), value)
+                        for key, value in dispatch.items())
+        toks = _DecodedTokens(toks)
+    tok = toks[i]
+    if tok != '(':
+        msg = 'Unexpected %s' % tok
+    elif toks[i + 1] in dispatch:
+        msg = 'Invalid (%s' % toks[i + 1]
+    else:
+        msg = 'Unknown tag (%s' % toks[i + 1]
+    return _Mismatch(i, '%s in (%s' % (msg, tag))
+
+
+def _parse_exception(string, error):
+    '''Turns a _Mismatch at a token index into a ParseException at the
+    corresponding location in string.'''
+    if isinstance(string, basestring):
+        token_re = _token_re
+    else:
+        token_re = _bytes_token_re
+    loc = len(string)
+    for i, match in enumerate(token_re.finditer(string)):
+        if i == error.index:
+            loc = match.start()
+            break
+    if isinstance(string, basestring):
+        return ParseException(string, loc, error.msg)
+
+    # Only decode the surroundings of the error
+    start = max(0, loc - 80)
+    context = bytes(string[start:loc + 80]).decode('utf-8', 'replace')
+    return ParseException(context, loc - start,
+                          '%s (at byte %d)' % (error.msg, loc))
+
+
+def _match_empty(toks, i):
+    return i, []
+
+
+def _match_number(toks, i):
+    tok = toks[i]
+    if _number_re.match(tok):
+        return i + 1, [float(tok)]
+
+
+def _match_integer(toks, i):
+    tok = toks[i]
+    if _integer_re.match(tok):
+        return i + 1, [int(tok)]
+
+
+def _match_hex(toks, i):
+    tok = toks[i]
+    if _hex_re.match(tok):
+        return i + 1, [tok]
+
+
+def _match_text(toks, i):
+    tok = toks[i]
+    if tok == '(' or tok == ')':
+        return None
+    if len(tok) > 1 and tok[0] == '"' and tok[-1] == '"':
+        return i + 1, [tok[1:-1]]
+    return i + 1, [tok]
+
+
+def _literal_matcher(string):
+    expected = tokenize(string)
+    n = len(expected)
+
+    def match(toks, i):
+        if toks[i:i + n] == expected:
+            return i + n, [string]
+    return match
+
+
+def _regex_matcher(regex):
+    def match(toks, i):
+        tok = toks[i]
+        if tok != '(' and tok != ')' and regex.match(tok):
+            return i + 1, [tok]
+    return match
+
+
+def _sequence_matcher(matchers):
+    def match(toks, i):
+        values = []
+        for matcher in matchers:
+            res = matcher(toks, i)
+            if res is None:
+                return None
+            i, vals = res
+            values += vals
+        return i, values
+    return match
+
+
+def _first_matcher(matchers):
+    def match(toks, i):
+        for matcher in matchers:
+            res = matcher(toks, i)
+            if res is not None:
+                return res
+    return match
+
+
+def _longest_matcher(matchers):
+    def match(toks, i):
+        best = None
+        for matcher in matchers:
+            res = matcher(toks, i)
+            if res is not None and (best is None or res[0] > best[0]):
+                best = res
+        return best
+    return match
+
+
+def _optional_matcher(matcher):
+    def match(toks, i):
+        res = matcher(toks, i)
+        if res is None:
+            return i, []
+        return res
+    return match
+
+
+def _repeat_matcher(matcher, minimum):
+    def match(toks, i):
+        values, count = [], 0
+        while True:
+            res = matcher(toks, i)
+            if res is None or res[0] == i:
+                break
+            i, vals = res
+            values += vals
+            count += 1
+        if count < minimum:
+            return None
+        return i, values
+    return match
+
+
+def _group_matcher(matcher):
+    def match(toks, i):
+        res = matcher(toks, i)
+        if res is not None:
+            return res[0], [res[1]]
+    return match
+
+
+def _suppress_matcher(matcher):
+    def match(toks, i):
+        res = matcher(toks, i)
+        if res is not None:
+            return res[0], []
+    return match
+
+
+def _action_matcher(matcher, actions):
+    def match(toks, i):
+        res = matcher(toks, i)
+        if res is None:
+            return None
+        i, values = res
+        for action in actions:
+            ret = action('', i, values)
+            if ret is None:
+                continue
+            if isinstance(ret, (list, ParseResults)):
+                values = list(ret)
+            else:
+                values = [ret]
+        return i, values
+    return match
+
+
+_element_matchers = {}
+
+
+def element_matcher(elem):
+    '''Translates a pyparsing ParserElement into a function operating on a
+    list of tokens.  The function takes the token list and an index and
+    returns a tuple of the next index and the list of parsed values or None
+    if the element doesn't match.'''
+    key = id(elem)
+    if key in _element_matchers:
+        return _element_matchers[key][1]
+
+    actions = elem.parseAction
+    if elem is number:
+        matcher, actions = _match_number, []
+    elif elem is integer:
+        matcher, actions = _match_integer, []
+    elif elem is hex:
+        matcher, actions = _match_hex, []
+    elif elem is text or elem is dblQuotedString:
+        matcher, actions = _match_text, []
+    elif isinstance(elem, Empty):
+        matcher = _match_empty
+    elif isinstance(elem, (Keyword, Literal)):
+        matcher = _literal_matcher(elem.match)
+    elif isinstance(elem, (Word, Regex)):
+        matcher = _regex_matcher(re.compile('(?:%s)$' % elem.reString))
+    elif isinstance(elem, And):
+        matcher = _sequence_matcher(list(map(element_matcher, elem.exprs)))
+    elif isinstance(elem, MatchFirst):
+        matcher = _first_matcher(list(map(element_matcher, elem.exprs)))
+    elif isinstance(elem, Or):
+        matcher = _longest_matcher(list(map(element_matcher, elem.exprs)))
+    elif isinstance(elem, Optional):
+        matcher = _optional_matcher(element_matcher(elem.expr))
+    elif isinstance(elem, OneOrMore):
+        matcher = _repeat_matcher(element_matcher(elem.expr), 1)
+    elif isinstance(elem, ZeroOrMore):
+        matcher = _repeat_matcher(element_matcher(elem.expr), 0)
+    elif isinstance(elem, Group):
+        matcher = _group_matcher(element_matcher(elem.expr))
+    elif isinstance(elem, Suppress):
+        matcher = _suppress_matcher(element_matcher(elem.expr))
+    elif isinstance(elem, ParseElementEnhance):
+        matcher = element_matcher(elem.expr)
+    else:
+        raise TypeError('Unsupported parser element %s' % repr(elem))
+
+    if actions:
+        matcher = _action_matcher(matcher, actions)
+
+    # Keep a reference to elem so that its id is not reused.
+    _element_matchers[key] = (elem, matcher)
+    return matcher
+
+
+def _add_value(kwargs, attr, value):
+    '''Same as merge_dict(kwargs, {attr: value}).'''
+    if attr in kwargs:
+        current = kwargs[attr]
+        if isinstance(current, list):
+            current.append(value)
+        else:
+            kwargs[attr] = [current, value]
+    else:
+        kwargs[attr] = value
+
+
+def _scan_points(toks, i, kwargs, attr, leaf):
+    '''Parses the run of (xy x y) starting at index i into an (N, 2) numpy
+    array if POINT_ARRAYS is set, otherwise falls back to the leaf function
+    parsing a single point.'''
+    if not POINT_ARRAYS:
+        return leaf(toks, i, kwargs)
+
+    import numpy
+    if isinstance(toks[i], basestring):
+        open_paren, tag, close_paren = '(', 'xy', ')'
+    else:
+        open_paren, tag, close_paren = b'(', b'xy', b')'
+    j = i
+    while toks[j] == open_paren and toks[j + 1] == tag and \
+            toks[j + 4] == close_paren:
+        j += 5
+    if j == i:
+        return None
+
+    points = numpy.empty(((j - i) // 5, 2))
+    try:
+        points[:, 0] = numpy.array(toks[i + 2:j:5], numpy.float64)
+        points[:, 1] = numpy.array(toks[i + 3:j:5], numpy.float64)
+    except ValueError:
+        raise _Mismatch(i, 'Invalid point in (xy')
+
+    if attr in kwargs:
+        points = numpy.concatenate([kwargs[attr], points])
+    kwargs[attr] = points
+    return j
+
+
+def _start_tag(key, schema):
+    '''Returns the tag a child of an unordered set starts with.  False
+    means the child is not wrapped in an sexpr, '' that any sexpr can
+    start the child.'''
+    if isinstance(schema, type) and issubclass(schema, AST):
+        return schema.tag
+    if isinstance(schema, dict) and '_parser' in schema:
+        parser = schema['_parser']
+        if isinstance(parser, type) and issubclass(parser, AST):
+            return parser.tag
+        return schema.get('_tag', key)
+    return key
+
+
+def _schema_layout(schema):
+    '''Splits a non leaf schema into its positional children, its
+    unordered children keyed by tag, bare unordered children and unordered
+    children that can start with any tag.'''
+    i, positional = 0, []
+    while str(i) in schema:
+        positional.append(schema[str(i)])
+        i += 1
+
+    # Like with pyparsing's Each, children without _multiple can only be
+    # matched once.
+    tagged, bare, anytag = {}, [], []
+    for key, value in schema.items():
+        if key.isdigit() or key[0] == '_':
+            continue
+        child = key, value, isinstance(value, dict) and '_multiple' in value
+        tag = _start_tag(key, value)
+        if tag is False:
+            bare.append(child)
+        elif tag == '':
+            anytag.append(child)
+        else:
+            tagged.setdefault(tag, []).append(child)
+
+    return positional, tagged, bare, anytag
+
+
+def _unquote(tok):
+    if len(tok) > 1 and tok[0] == '"' and tok[-1] == '"':
+        return tok[1:-1]
+    return tok
+
+
+def _unquote_bytes(tok):
+    if len(tok) > 1 and tok[:1] == b'"' and tok[-1:] == b'"':
+        tok = tok[1:-1]
+    return tok.decode('utf-8')
+
+
+# Condition and conversion of the token t for leaf parsers that are
+# specialized by the schema compiler.
+_leaf_kinds = {
+    'number': ('_num(%s)', 'float(%s)'),
+    'integer': ('_int(%s)', 'int(%s)'),
+    'hex': ('_hex(%s)', '%s'),
+    'text': ("%s != '(' and %s != ')'", '_unquote(%s)')
+}
+
+# Numbers are converted straight from bytes tokens, only hex and text are
+# decoded.
+_bytes_leaf_kinds = {
+    'number': ('_num(%s)', 'float(%s)'),
+    'integer': ('_int(%s)', 'int(%s)'),
+    'hex': ('_hex(%s)', "%s.decode('ascii')"),
+    'text': ("%s != b'(' and %s != b')'", '_unquote(%s)')
+}
+
+
+def _leaf_kind(elem):
+    if elem is number:
+        return 'number'
+    if elem is integer:
+        return 'integer'
+    if elem is hex:
+        return 'hex'
+    if elem is text:
+        return 'text'
+
+
+def _leaf_plan(parser):
+    '''Returns the kinds of the required tokens and of an optional trailing
+    token of a leaf parser or None if the parser can't be specialized.'''
+    kind = _leaf_kind(parser)
+    if kind is not None:
+        return [kind], None
+    if not isinstance(parser, And) or parser.parseAction:
+        return None
+
+    # Flatten nested sequences without parse actions
+    exprs = []
+    for elem in parser.exprs:
+        if isinstance(elem, And) and not elem.parseAction:
+            exprs += elem.exprs
+        else:
+            exprs.append(elem)
+
+    required, optional = [], None
+    for n, elem in enumerate(exprs):
+        kind = _leaf_kind(elem)
+        if kind is not None:
+            required.append(kind)
+        elif n == len(exprs) - 1 and isinstance(elem, Optional) and \
+                not elem.parseAction and _leaf_kind(elem.expr) is not None:
+            optional = _leaf_kind(elem.expr)
+        else:
+            return None
+    return required, optional
+
+
+def _index(offset):
+    return 'i + %d' % offset if offset else 'i'
+
+
+class SchemaCompiler(object):
+    '''Compiles the schema of an AST subclass into the source of a python
+    function parsing a list of tokens.  Every non leaf schema becomes a
+    function with a dict dispatching on the tags of its unordered
+    children, leaves parsing numbers, integers, hex and text are inlined.
+
+    The generated functions take the token list, an index and the kwargs
+    dict of the AST under construction.  They return the next index or None
+    if the schema doesn't start at the index and raise _Mismatch if the
+    sexpr is malformed.  If binary is True they take a list of bytes
+    tokens.'''
+
+    def __init__(self, cls, binary=False, profile=False):
+        self.cls = cls
+        self.binary = binary
+        self.profile = profile
+        self.lines = []
+        self.tables = []
+        self.namespace = {
+            '_add_value': _add_value,
+            '_Mismatch': _Mismatch,
+            '_unexpected': _unexpected,
+            '_DecodedTokens': _DecodedTokens,
+            '_scan_points': _scan_points,
+            '_profile_start': _profile_start,
+            '_profile_abort': _profile_abort,
+            '_profile_stop': _profile_stop,
+        }
+        if binary:
+            self.kinds = _bytes_leaf_kinds
+            self.namespace.update(_unquote=_unquote_bytes,
+                                  _num=_bytes_number_re.match,
+                                  _int=_bytes_integer_re.match,
+                                  _hex=_bytes_hex_re.match)
+        else:
+            self.kinds = _leaf_kinds
+            self.namespace.update(_unquote=_unquote,
+                                  _num=_number_re.match,
+                                  _int=_integer_re.match,
+                                  _hex=_hex_re.match)
+        self.open, self.close = self.token('('), self.token(')')
+        self.counter = 0
+
+    def token(self, string):
+        '''Returns the source of the token string.'''
+        if self.binary:
+            return repr(string.encode('utf-8'))
+        return repr(string)
+
+    def name(self, prefix, value=None):
+        self.counter += 1
+        name = '%s%d' % (prefix, self.counter)
+        if value is not None:
+            self.namespace[name] = value
+        return name
+
+    def emit(self, *lines):
+        self.lines += lines
+
+    def compile(self):
+        root = self.one(self.cls.tag, self.cls.schema, None)
+        if self.profile:
+            self.emit('def parse(toks, i):',
+                      '    start = _profile_start()',
+                      '    kwargs = {}',
+                      '    j = %s(toks, i, kwargs)' % root,
+                      '    if j is None:',
+                      '        _profile_abort()',
+                      '        return None',
+                      '    if not kwargs:',
+                      '        raise _Mismatch(i, %r)' %
+                      ('Empty (%s' % self.cls.tag),
+                      '    v = _cls(**kwargs)',
+                      '    _profile_stop(_cls, start, i, j)',
+                      '    return j, v')
+            self.namespace['_cls'] = self.cls
+            return self.load('parse')
+        self.emit('def parse(toks, i):',
+                  '    kwargs = {}',
+                  '    j = %s(toks, i, kwargs)' % root,
+                  '    if j is None:',
+                  '        return None',
+                  '    if not kwargs:',
+                  '        raise _Mismatch(i, %r)' %
+                  ('Empty (%s' % self.cls.tag),
+                  '    return j, _cls(**kwargs)')
+        self.namespace['_cls'] = self.cls
+        return self.load('parse')
+
+    def compile_children(self):
+        '''Compiles a function parsing a single child of the root sexpr
+        into the kwargs of the root.  Returns the next index or None if no
+        child of the schema starts at the index.'''
+        positional, tagged, bare, anytag = _schema_layout(self.cls.schema)
+        positional = [self.one(False, subschema, None)
+                      for subschema in positional]
+        tagged = dict((tag, [self.one(key, subschema, None)
+                             for key, subschema, _ in children])
+                      for tag, children in tagged.items())
+        bare = [self.one(key, subschema, None) for key, subschema, _ in bare]
+        anytag = [self.one(key, subschema, None)
+                  for key, subschema, _ in anytag]
+        self.load()
+
+        def resolve(names):
+            return tuple(self.namespace[name] for name in names)
+
+        positional, bare, anytag = map(resolve, (positional, bare, anytag))
+        tagged = dict((tag.encode('utf-8') if self.binary else tag,
+                       resolve(names) + anytag)
+                      for tag, names in tagged.items())
+        open_paren = b'(' if self.binary else '('
+
+        def parse_child(toks, i, kwargs):
+            # Positional children that are transparent groups of optional
+            # children match zero tokens when the child isn't theirs.
+            for function in positional:
+                j = function(toks, i, kwargs)
+                if j is not None and j != i:
+                    return j
+            if toks[i] == open_paren:
+                candidates = tagged.get(toks[i + 1], anytag)
+            else:
+                candidates = bare
+            for function in candidates:
+                j = function(toks, i, kwargs)
+                if j is not None:
+                    return j
+            return None
+
+        return parse_child
+
+    def load(self, name=None):
+        '''Executes the emitted source and returns the function called
+        name.'''
+        source = '\n'.join(self.lines + self.tables) + '\n'
+        exec(compile(source, '<schema %s>' % self.cls.__name__, 'exec'),
+             self.namespace)
+        if name is not None:
+            function = self.namespace[name]
+            function.source = source
+            return function
+
+    def one(self, tag, schema, attr):
+        '''Emits a function matching a single instance of schema and
+        returns its name.'''
+        if isinstance(schema, ParserElement):
+            return self.leaf(tag, schema, tag if attr is None else attr)
+
+        if isinstance(schema, type) and issubclass(schema, AST):
+            return self.ast(schema, tag if attr is None else attr)
+
+        if '_parser' in schema:
+            tag = schema.get('_tag', tag)
+            attr = schema.get('_attr', tag)
+            name = self.one(tag, schema['_parser'], attr)
+            if schema.get('_points', False):
+                name = self.points(name, attr)
+            return name
+
+        return self.node(tag, schema)
+
+    def points(self, leaf, attr):
+        '''Emits a function parsing a run of points with _scan_points.'''
+        name = self.name('_points')
+        self.emit('def %s(toks, i, kwargs):' % name,
+                  '    return _scan_points(toks, i, kwargs, %r, %s)' %
+                  (attr, leaf), '')
+        return name
+
+    def add_value(self, attr, indent='    '):
+        self.emit(indent + 'if %r in kwargs:' % attr,
+                  indent + '    _add_value(kwargs, %r, v)' % attr,
+                  indent + 'else:',
+                  indent + '    kwargs[%r] = v' % attr)
+
+    def open_tag(self, tag, indent='    '):
+        '''Emits the check for '(tag' and returns the offset of the first
+        token following it.'''
+        if not isinstance(tag, basestring):
+            return 0
+        if tag == '':
+            self.emit(indent + 'if toks[i] != %s:' % self.open,
+                      indent + '    return None')
+            return 1
+        self.emit(indent + 'if toks[i] != %s or toks[i + 1] != %s:' %
+                  (self.open, self.token(tag)),
+                  indent + '    return None')
+        return 2
+
+    def leaf(self, tag, parser, attr):
+        name = self.name('_leaf')
+        self.emit('def %s(toks, i, kwargs):' % name)
+        offset = self.open_tag(tag)
+        close = isinstance(tag, basestring)
+
+        plan = _leaf_plan(parser)
+        if plan is None:
+            matcher = self.name('_match', element_matcher(parser))
+            # Element matchers compare decoded tokens
+            toks = '_DecodedTokens(toks)' if self.binary else 'toks'
+            self.emit('    res = %s(%s, %s)' % (matcher, toks, _index(offset)),
+                      '    if res is None:',
+                      '        return None',
+                      '    j, v = res')
+            if close:
+                self.emit('    if toks[j] != %s:' % self.close,
+                          '        return None',
+                          '    j += 1')
+            self.emit('    if not v:',
+                      '        return None',
+                      '    v = v[0] if len(v) < 2 else v')
+        else:
+            required, optional = plan
+            tokens = []
+            for n, kind in enumerate(required):
+                tok = 't%d' % n
+                self.emit('    %s = toks[%s]' % (tok, _index(offset + n)))
+                tokens.append((tok, kind))
+            conds = ' and '.join(self.kinds[kind][0].replace('%s', tok)
+                                 for tok, kind in tokens)
+            self.emit('    if not (%s):' % conds,
+                      '        return None')
+
+            def value(tokens):
+                values = [self.kinds[kind][1] % tok for tok, kind in tokens]
+                if len(values) == 1:
+                    return values[0]
+                return '[%s]' % ', '.join(values)
+
+            n = offset + len(required)
+            if optional is None:
+                if close:
+                    self.emit('    if toks[i + %d] != %s:' % (n, self.close),
+                              '        return None')
+                    n += 1
+                self.emit('    v = %s' % value(tokens),
+                          '    j = i + %d' % n)
+            else:
+                tok = 't%d' % len(required)
+                cond = self.kinds[optional][0].replace('%s', tok)
+                self.emit('    %s = toks[%s]' % (tok, _index(n)))
+                if close:
+                    self.emit('    if %s == %s:' % (tok, self.close),
+                              '        v = %s' % value(tokens),
+                              '        j = i + %d' % (n + 1),
+                              '    elif %s and toks[i + %d] == %s:' %
+                              (cond, n + 1, self.close),
+                              '        v = %s' %
+                              value(tokens + [(tok, optional)]),
+                              '        j = i + %d' % (n + 2),
+                              '    else:',
+                              '        return None')
+                else:
+                    self.emit('    if %s:' % cond,
+                              '        v = %s' %
+                              value(tokens + [(tok, optional)]),
+                              '        j = i + %d' % (n + 1),
+                              '    else:',
+                              '        v = %s' % value(tokens),
+                              '        j = i + %d' % n)
+
+        self.add_value(attr)
+        self.emit('    return j', '')
+        return name
+
+    def ast(self, cls, attr):
+        name = self.name('_ast')
+        if cls is self.cls:
+            parse = 'parse'
+        else:
+            parse = self.name('_parse', compiled_parser(cls, self.binary,
+                                                        self.profile))
+        self.emit('def %s(toks, i, kwargs):' % name,
+                  '    res = %s(toks, i)' % parse,
+                  '    if res is None:',
+                  '        return None',
+                  '    j, v = res')
+        self.add_value(attr)
+        self.emit('    return j', '')
+        return name
+
+    def node(self, tag, schema):
+        positional, tagged, bare, anytag = _schema_layout(schema)
+
+        positional = [(self.one(False, subschema, None), subschema)
+                      for subschema in positional]
+
+        # Children without _multiple get a bit in the matched mask
+        children = {}
+        for n, child in enumerate(sum(tagged.values(), []) + bare + anytag):
+            key, subschema, multiple = child
+            children[id(child)] = '(%s, %d)' % (
+                self.one(key, subschema, None), 0 if multiple else 1 << n)
+
+        def candidates(tag_children):
+            return ''.join(children[id(child)] + ', '
+                           for child in tag_children)
+
+        name = self.name('_node')
+        self.emit('def %s(toks, i, kwargs):' % name)
+        offset = self.open_tag(tag)
+        if offset:
+            self.emit('    i += %d' % offset)
+
+        for n, (function, subschema) in enumerate(positional):
+            multiple = isinstance(subschema, dict) and \
+                subschema.get('_multiple', False)
+            optional = isinstance(subschema, dict) and \
+                subschema.get('_optional', False)
+            if multiple:
+                self.emit('    while True:',
+                          '        j = %s(toks, i, kwargs)' % function,
+                          '        if j is None or j == i:',
+                          '            break',
+                          '        i = j')
+            elif optional:
+                self.emit('    j = %s(toks, i, kwargs)' % function,
+                          '    if j is not None:',
+                          '        i = j')
+            else:
+                self.emit('    j = %s(toks, i, kwargs)' % function,
+                          '    if j is None:')
+                if tag is False and n == 0:
+                    self.emit('        return None')
+                else:
+                    self.emit('        raise _Mismatch(i, %r)' %
+                              ('Expected positional argument %d of (%s' %
+                               (n, tag or '')))
+                self.emit('    i = j')
+
+        if children:
+            dispatch = self.name('_dispatch')
+            anytag_candidates = self.name('_anytag')
+            bare_candidates = self.name('_bare')
+            self.tables.append('%s = (%s)' % (anytag_candidates,
+                                              candidates(anytag)))
+            self.tables.append('%s = (%s)' % (bare_candidates,
+                                              candidates(bare)))
+            self.tables.append('%s = {' % dispatch)
+            for child_tag, tag_children in tagged.items():
+                self.tables.append('    %s: (%s) + %s,' % (
+                    self.token(child_tag), candidates(tag_children),
+                    anytag_candidates))
+            self.tables.append('}')
+
+            self.emit('    matched = 0',
+                      '    while True:',
+                      '        tok = toks[i]',
+                      '        if tok == %s:' % self.close,
+                      '            break',
+                      '        if tok == %s:' % self.open,
+                      '            candidates = %s.get(toks[i + 1], %s)' %
+                      (dispatch, anytag_candidates),
+                      '        else:',
+                      '            candidates = %s' % bare_candidates,
+                      '        for function, bit in candidates:',
+                      '            if not matched & bit:',
+                      '                j = function(toks, i, kwargs)',
+                      '                if j is not None:',
+                      '                    matched |= bit',
+                      '                    break',
+                      '        else:',
+                      '            break',
+                      '        i = j')
+
+        if tag is False:
+            self.emit('    return i', '')
+            return name
+
+        self.emit('    if toks[i] != %s:' % self.close,
+                  '        raise _unexpected(toks, i, %r, %s)' %
+                  (tag, dispatch if children else '{}'),
+                  '    return i + 1', '')
+        return name
+
+
+def compiled_parser(cls, binary=False, profile=False):
+    '''Returns the parse function generated from the schema of cls.  The
+    function is compiled on first use and cached on the class.  If binary
+    is True the function parses a list of bytes tokens.  If profile is True
+    the function reports to the PROFILER.'''
+    cache = '_compiled%s%s_parser' % ('_bytes' if binary else '',
+                                      '_profiled' if profile else '')
+    if cache not in cls.__dict__:
+        setattr(cls, cache, SchemaCompiler(cls, binary, profile).compile())
+    return cls.__dict__[cache]
+
+
+def descent_parse(cls, toks, i=0):
+    '''Parses an instance of cls from the token list toks starting at
+    index i.  Returns a tuple of the next index and the instance or None
+    if toks[i] doesn't start an instance of cls.'''
+    binary = i < len(toks) and not isinstance(toks[i], basestring)
+    if PROFILER is not None:
+        return PROFILER.descent_parse(cls, toks, i, binary)
+    return compiled_parser(cls, binary)(toks, i)
+
+
+def children_parser(cls):
+    '''Returns the function parsing a single child of the root sexpr of
+    cls.  The function is compiled on first use and cached on the class.'''
+    if '_children_parser' not in cls.__dict__:
+        cls._children_parser = SchemaCompiler(cls).compile_children()
+    return cls._children_parser
+
+
+def iter_children(cls, fp, chunk_size=2 ** 16):
+    '''Reads an instance of cls from the file object fp chunk_size
+    characters at a time.  Every child of the root sexpr is parsed as soon
+    as its closing paren is read and the AST instances among its values are
+    yielded.  Only the tokens of the current child are held in memory.'''
+    parse_child = children_parser(cls)
+    depth, child, root = 0, None, []
+    for toks in tokenize_file(fp, chunk_size):
+        for tok in toks:
+            if child is not None:
+                child.append(tok)
+                if tok == '(':
+                    depth += 1
+                elif tok == ')':
+                    depth -= 1
+                    if depth == 1:
+                        for value in _parse_child(parse_child, child, cls.tag):
+                            yield value
+                        child = None
+            elif tok == '(':
+                depth += 1
+                if depth == 2:
+                    child = ['(']
+            elif tok == ')':
+                depth -= 1
+                if depth == 0:
+                    return
+            elif depth == 1 and not root:
+                root.append(tok)
+                if tok != cls.tag:
+                    raise ParseException(tok, 0, 'Expected (%s' % cls.tag)
+
+    raise ParseException('', 0, 'Unexpected end of input')
+
+
+def _parse_child(parse_child, child, tag):
+    '''Parses the tokens of a single child and returns the AST instances
+    among the parsed values.'''
+    kwargs = {}
+    # The closing paren of the root ends transparent groups
+    toks = child + [')']
+    try:
+        j = parse_child(toks, 0, kwargs)
+        if j is None:
+            raise _unexpected(toks, 0, tag, {})
+        if j != len(child):
+            raise _unexpected(toks, j, child[1], {})
+    except _Mismatch as e:
+        raise _parse_exception(' '.join(child), e)
+
+    values = []
+    for value in kwargs.values():
+        if not isinstance(value, list):
+            value = [value]
+        values += [item for item in value if isinstance(item, AST)]
+    return values
+
+
+class AttributesView(MutableMapping):
+    '''Mapping view of the attributes of an AST that are stored in slots.
+    Iterates in the order the attributes were passed to AST.__init__.'''
+    __slots__ = ('ast',)
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def __getitem__(self, attr):
+        if attr not in type(self.ast)._fields:
+            raise KeyError(attr)
+        return object.__getattribute__(self.ast, attr)
+
+    def __setitem__(self, attr, value):
+        if attr not in type(self.ast)._fields:
+            raise KeyError(attr)
+        object.__setattr__(self.ast, attr, value)
+
+    def __delitem__(self, attr):
+        self[attr] = None
+
+    def __iter__(self):
+        return iter(_field_order(type(self.ast)))
+
+    def __len__(self):
+        return len(type(self.ast)._fields)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _field_order(cls):
+    '''Returns the fields of cls in the order of the kwargs passed to
+    AST.__init__, which is the order attributes are printed in.'''
+    return cls.__dict__.get('_order', cls._fields)
+
+
+class _ASTMeta(type):
+    '''Lays out AST subclasses that define a constructor with a slot per
+    constructor argument instead of an attributes dict.  Slots declared by
+    the class itself are added for state that isn't an attribute.'''
+
+    def __new__(mcs, name, bases, namespace):
+        init = namespace.get('__init__')
+        if init is not None:
+            params = list(inspect.signature(init).parameters.values())[1:]
+            fields = tuple(param.name for param in params
+                           if param.kind in (param.POSITIONAL_OR_KEYWORD,
+                                             param.KEYWORD_ONLY))
+            if fields:
+                namespace['__slots__'] = \
+                    fields + tuple(namespace.get('__slots__', ()))
+                namespace['_fields'] = fields
+        return super(_ASTMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+class AST(object, metaclass=_ASTMeta):
     '''
     Abstract Syntax Tree (AST)
     Extraordinarily undocumented AST class
     '''
+    # _extra is a dict of the attributes set outside the schema, created
+    # when the first one is set
+    __slots__ = ('_attributes', '_source', '_extra')
     tag = 'sexpr'
     schema = text
+    # Names of the slots holding the attributes, empty if they're stored
+    # in a dict
+    _fields = ()
 
     def __init__(self, **kwargs):
         '''Set attributes as kwargs passed to AST initializer'''
-        self.attributes = kwargs
+        object.__setattr__(self, '_source', None)
+        cls = self.__class__
+        if not cls._fields:
+            object.__setattr__(self, '_attributes', kwargs)
+            return
+        if '_order' not in cls.__dict__:
+            cls._order = tuple(kwargs) + tuple(field for field in cls._fields
+                                               if field not in kwargs)
+        for field in cls._fields:
+            object.__setattr__(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError('Unknown attributes %s of (%s' %
+                            (', '.join(kwargs), cls.tag))
+
+    @property
+    def attributes(self):
+        '''Mapping of the attribute names to values.'''
+        if self._source is not None:
+            self.load()
+        if self._fields:
+            return AttributesView(self)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        if not self._fields:
+            object.__setattr__(self, '_attributes', attributes)
+            return
+        for field in self._fields:
+            object.__setattr__(self, field, attributes.get(field))
 
     def __getattr__(self, attr):
         '''Checks to see if attr is in attributes otherwise raise AttrError'''
-        try:
-            return self.attributes.get(attr)
-        except KeyError as e:
-            raise AttributeError(e)
+        # Only called for unset slots and names that aren't slots
+        if attr[:2] == '__' or attr in ('_source', '_attributes', '_extra'):
+            raise AttributeError(attr)
+        if self._source is not None:
+            self.load()
+            return getattr(self, attr)
+        extra = getattr(self, '_extra', None)
+        if extra is not None and attr in extra:
+            return extra[attr]
+        if self._fields:
+            return None
+        return self.attributes.get(attr)
 
     def __setattr__(self, attr, value):
         '''If attr in attributes then set otherwise set attr regularly'''
-        if not attr == 'attributes' and attr in self.attributes:
-            self.attributes[attr] = value
-        else:
+        # _source isn't set yet while unpickling
+        if getattr(self, '_source', None) is not None:
+            self.load()
+        if not self._fields and attr[0] != '_' and attr in self._attributes:
+            self._attributes[attr] = value
+        elif hasattr(type(self), attr):
             super(AST, self).__setattr__(attr, value)
+        else:
+            extra = getattr(self, '_extra', None)
+            if extra is None:
+                extra = {}
+                object.__setattr__(self, '_extra', extra)
+            extra[attr] = value
 
     def __eq__(self, other):
         '''Check to see that attributes are equivalent'''
-        return self.attributes == other.attributes
+        attributes = dict(self.attributes)
+        other_attributes = dict(other.attributes)
+        try:
+            return attributes == other_attributes
+        except ValueError:
+            pass
+
+        # Point arrays don't compare to a single bool
+        import numpy
+        if set(attributes) != set(other_attributes):
+            return False
+        for attr, value in attributes.items():
+            other_value = other_attributes[attr]
+            if isinstance(value, numpy.ndarray) or \
+                    isinstance(other_value, numpy.ndarray):
+                if not numpy.array_equal(value, other_value):
+                    return False
+            elif value != other_value:
+                return False
+        return True
 
     def __repr__(self):
         attrs = {}
@@ -378,29 +1749,145 @@ class AST(object):
                 attrs[key] = value
         return '(%s %s)' % (self.tag, repr(attrs))
 
+    def __copy__(self):
+        if self._source is not None:
+            return self.lazy(*self._source)
+        cls = self.__class__
+        instance = cls.__new__(cls)
+        object.__setattr__(instance, '_source', None)
+        if not cls._fields:
+            object.__setattr__(instance, '_attributes', dict(self._attributes))
+        for field in cls._fields:
+            object.__setattr__(instance, field, getattr(self, field))
+        extra = getattr(self, '_extra', None)
+        if extra is not None:
+            object.__setattr__(instance, '_extra', dict(extra))
+        return instance
+
+    def __getstate__(self):
+        extra = getattr(self, '_extra', None)
+        if self._source is not None:
+            return (self._source, None, extra, None)
+        if not self._fields:
+            return (None, self._attributes, extra, None)
+        # The print order is only known once an instance was constructed,
+        # processes that just unpickle take it from the pickle
+        values = tuple([getattr(self, field) for field in self._fields])
+        return (None, values, extra, self.__class__.__dict__.get('_order'))
+
+    def __setstate__(self, state):
+        source, values, extra, order = state
+        cls = self.__class__
+        if order is not None and '_order' not in cls.__dict__:
+            cls._order = order
+        object.__setattr__(self, '_source', source)
+        if extra is not None:
+            object.__setattr__(self, '_extra', extra)
+        if values is None:
+            return
+        if not self._fields:
+            object.__setattr__(self, '_attributes', values)
+            return
+        for field, value in zip(self._fields, values):
+            object.__setattr__(self, field, value)
+
     def __deepcopy__(self, memo):
         import copy
-        return self.__class__(**copy.deepcopy(self.__dict__['attributes']))
+        if self._source is not None:
+            return self.lazy(*self._source)
+        instance = self.__class__(**copy.deepcopy(dict(self.attributes)))
+        extra = getattr(self, '_extra', None)
+        if extra is not None:
+            object.__setattr__(instance, '_extra', copy.deepcopy(extra))
+        return instance
 
     def __str__(self):
         return self.to_string()[1:]
 
+    @classmethod
+    def lazy(cls, string, backend=None):
+        '''Returns an instance of cls that is parsed from string the first
+        time its attributes are accessed.'''
+        instance = cls.__new__(cls)
+        object.__setattr__(instance, '_source', (string, backend))
+        return instance
+
+    def load(self):
+        '''Parses a lazy instance.'''
+        if self._source is None:
+            return
+        string, backend = self._source
+        parsed = self.parse(string, backend)
+        for slot in self._fields or ['_attributes']:
+            value = object.__getattribute__(parsed, slot)
+            object.__setattr__(self, slot, value)
+        object.__setattr__(self, '_source', None)
+
     def to_string(self, attributes=None):
-        if attributes is None:
+        if PROFILER is None:
+            return self._to_string(attributes)
+        start = PROFILER.start()
+        try:
+            string = self._to_string(attributes)
+        except BaseException:
+            PROFILER.abort()
+            raise
+        PROFILER.stop(self.__class__, 'to_string', start, len(string))
+        return string
+
+    def _to_string(self, attributes=None):
+        if attributes is None and self._source is not None:
+            # Untouched lazy instances are written back verbatim
+            source = self._source[0]
+            if not isinstance(source, basestring):
+                source = source.decode('utf-8')
+            return '\n' + source
+        return tree_to_string(self.tree(attributes))
+
+    def tree(self, attributes=None, deferred=False):
+        '''Returns the tree printed by to_string.  If deferred is True the
+        values with printers are wrapped to be printed while streaming.'''
+        if attributes is None and self._fields and self._source is None:
+            attributes = [(attr, getattr(self, attr))
+                          for attr in _field_order(self.__class__)]
+        elif attributes is None:
             attributes = self.attributes.items()
+        plans = attr_plans(self.__class__)
         tree = {}
         for attr, value in attributes:
             if value is None:
                 continue
-            found = find_attr(attr, value, self.schema)
-            if found is None:
+            if attr in plans:
+                plan = plans[attr]
+            else:
+                plan = plans[attr] = attr_plan(attr, self.schema)
+            if plan is None:
                 continue
-            merge_dict(tree, found)
+            merge_dict(tree, _plan_value(plan, value, deferred))
         if tree == {}:
-            tree = self.attributes
-        else:
-            tree = {self.tag: tree}
-        return tree_to_string(tree)
+            return dict(self.attributes)
+        return {self.tag: tree}
+
+    def iter_string(self):
+        '''Yields to_string() in pieces.  At most one child of a multiple
+        attribute is printed at a time.'''
+        if self._source is not None:
+            yield self.to_string()
+            return
+        for chunk in iter_tree_string(self.tree(deferred=True)):
+            yield chunk
+
+    def write(self, fp, buffer_size=2 ** 16):
+        '''Writes to_string() to the file object fp without building the
+        whole string.  Pieces are joined up to buffer_size characters.'''
+        chunks, size = [], 0
+        for chunk in self.iter_string():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                fp.write(''.join(chunks))
+                chunks, size = [], 0
+        fp.write(''.join(chunks))
 
     def init_list(self, arg, default):
         '''Helper to initialize lists. Since default arguments are initialized
@@ -417,11 +1904,28 @@ class AST(object):
         return generate_parser(cls.tag, cls.schema)
 
     @classmethod
-    def parse(cls, string):
+    def parse(cls, string, backend=None):
         '''Parses str and returns instance of class passed into func'''
-        if not hasattr(cls, '_parser'):
+        if backend is None:
+            backend = PARSER_BACKEND
+        if backend == 'descent' or not isinstance(string, basestring):
+            return cls.descent_parse(string)
+        assert backend == 'pyparsing', 'Unknown parser backend %s' % backend
+
+        if '_parser' not in cls.__dict__:
             cls._parser = cls.parser()
-        parse_result = cls._parser.parseString(string)
+        # The root isn't one of the elements watched by the profiler
+        profiler = PROFILER
+        if profiler is not None:
+            start = profiler.start()
+        try:
+            parse_result = cls._parser.parseString(string)
+        except BaseException as e:
+            if profiler is not None:
+                profiler.abort()
+            if isinstance(e, ParseFatalException):
+                raise ParseException(e.pstr, e.loc, e.msg)
+            raise
         result = {}
         for res in parse_result:
             if len(list(res.keys())) < 1:
@@ -433,7 +1937,100 @@ class AST(object):
                 if not isinstance(result[key], list):
                     result[key] = [result[key]]
                 result[key].append(res[key])
-        return cls(**result)
+        instance = cls(**result)
+        if profiler is not None:
+            profiler.stop(cls, 'parse', start, len(string))
+        return instance
+
+    @classmethod
+    def parse_lazy(cls, string, attrs, backend=None):
+        '''Parses str like parse but keeps the children of the root sexpr
+        that are values of attrs as lazy instances.  Those children are
+        only located by a scan of the parens and parsed on first access.'''
+        lazy_tags = {}
+        for attr in attrs:
+            lazy_tags[_start_tag(attr, cls.schema[attr])] = \
+                attr, cls.schema[attr]['_parser']
+
+        if not isinstance(string, basestring):
+            lazy_tags = dict((tag.encode('utf-8'), value)
+                             for tag, value in lazy_tags.items())
+
+        values = dict((attr, []) for attr in attrs)
+        rest, end = [], 0
+        for start, stop, tag in child_spans(string):
+            if tag in lazy_tags:
+                attr, parser = lazy_tags[tag]
+                values[attr].append(parser.lazy(string[start:stop], backend))
+                rest.append(string[end:start])
+                end = stop
+        rest.append(string[end:])
+
+        instance = cls.parse(rest[0][:0].join(rest), backend)
+        instance.attributes.update(values)
+        return instance
+
+    @classmethod
+    def descent_parse(cls, string):
+        '''Parses str with the recursive descent backend.  str can also be
+        bytes, an mmap or a memoryview of utf-8 encoded text.  Then only
+        the kept text atoms are decoded.'''
+        toks = tokenize(string)
+        try:
+            res = descent_parse(cls, toks)
+        except _Mismatch as e:
+            raise _parse_exception(string, e)
+        except IndexError:
+            if isinstance(string, basestring):
+                raise ParseException(string, len(string),
+                                     'Unexpected end of input')
+            raise ParseException('', 0, 'Unexpected end of input')
+        if res is None:
+            raise ParseException('', 0, 'Expected (%s' % cls.tag)
+        return res[1]
+
+    @classmethod
+    def parse_file(cls, path, backend=None, lazy_attrs=None, cache_dir=None):
+        '''Parses the file at path.  The descent backend parses a memory
+        map of the file, so the file is never decoded as a whole.  If
+        lazy_attrs is given the file is parsed with parse_lazy.  Unless
+        the file is parsed lazily the result is kept in the ParseCache in
+        cache_dir, which defaults to PARSE_CACHE_DIR.'''
+        if cache_dir is None:
+            cache_dir = PARSE_CACHE_DIR
+        if cache_dir is not None and lazy_attrs is None:
+            return ParseCache(cache_dir).parse_file(cls, path, backend)
+        return cls._parse_file(path, backend, lazy_attrs)
+
+    @classmethod
+    def _parse_file(cls, path, backend=None, lazy_attrs=None):
+        if backend is None:
+            backend = PARSER_BACKEND
+        if backend != 'descent' or os.path.getsize(path) == 0:
+            with open(path, encoding='utf-8') as fp:
+                string = fp.read()
+            if lazy_attrs is not None:
+                return cls.parse_lazy(string, lazy_attrs, backend)
+            return cls.parse(string, backend)
+
+        with open(path, 'rb') as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if lazy_attrs is not None:
+                    return cls.parse_lazy(data, lazy_attrs, backend)
+                return cls.parse(data, backend)
+            finally:
+                data.close()
+
+    @classmethod
+    def iterparse(cls, path, chunk_size=2 ** 16):
+        '''Parses the file at path incrementally and yields the AST
+        instances among the children of the root sexpr as soon as they
+        have been read.  The file is read chunk_size characters at a time,
+        so memory use doesn't grow with the size of the file.'''
+        with open(path, encoding='utf-8') as fp:
+            for value in iter_children(cls, fp, chunk_size):
+                yield value
 
     @classmethod
     def from_schema(cls, tag, schema):
@@ -441,4 +2038,275 @@ class AST(object):
         cls.tag = tag
         cls.schema = schema
         cls._parser = generate_parser(tag, schema)
+        cls._compiled_parser = SchemaCompiler(cls).compile()
+        for cache in ['_children_parser', '_compiled_bytes_parser',
+                      '_compiled_profiled_parser',
+                      '_compiled_bytes_profiled_parser', '_attr_plans']:
+            if cache in cls.__dict__:
+                delattr(cls, cache)
         return cls
+
+
+# Grammar elements parsing AST subclasses, see generate_parser
+_ast_elements = weakref.WeakSet()
+
+
+class Profiler(object):
+    '''Records the calls, the time and the size of the input or output of
+    the parsers and serializers of every AST subclass.
+
+    Time is recorded twice, the total time includes the time spent on
+    nested ASTs, the self time doesn't.  Bytes are the length of the
+    parsed text, the descent backend doesn't count the whitespace between
+    tokens.  Parses answered by the packrat cache of pyparsing aren't
+    counted.
+
+    Profiling is switched on with the profiler as a context manager or
+    with enable and disable.  When it's off the parsers and serializers
+    only check that PROFILER is None.  The callback is called with the
+    stats when profiling is switched off.'''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stats = {}
+        self._stack = []
+        self._previous = None
+        self._offsets = None
+
+    def reset(self):
+        self.stats = {}
+
+    def enable(self):
+        global PROFILER
+        if PROFILER is self:
+            return
+        self._previous = PROFILER
+        PROFILER = self
+        for element in list(_ast_elements):
+            self.watch(element)
+
+    def disable(self):
+        global PROFILER
+        if PROFILER is not self:
+            return
+        PROFILER = self._previous
+        self._previous = None
+        for element in list(_ast_elements):
+            if PROFILER is None:
+                element.set_debug(False)
+            else:
+                PROFILER.watch(element)
+        if self.callback is not None:
+            self.callback(self.stats)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def watch(self, element):
+        '''Reports the matches of the pyparsing element to the profiler.'''
+        element.set_debug_actions(self._try, self._match, self._fail)
+
+    def _try(self, string, loc, element, cache_hit=False):
+        if not cache_hit:
+            self.start()
+
+    def _match(self, string, start, end, element, tokens, cache_hit=False):
+        if not cache_hit:
+            self.stop(element.ast_class, 'parse', self._stack[-1][0],
+                      end - start)
+
+    def _fail(self, string, loc, element, exc, cache_hit=False):
+        if not cache_hit:
+            self.abort()
+
+    def start(self):
+        '''Starts timing a call and returns its start time.'''
+        now = time.perf_counter()
+        self._stack.append([now, 0.0])
+        return now
+
+    def stop(self, cls, operation, start, size):
+        '''Records the call of operation on cls that started at start and
+        parsed or printed size characters.'''
+        elapsed = time.perf_counter() - start
+        _, nested = self._stack.pop()
+        if self._stack:
+            self._stack[-1][1] += elapsed
+        key = (cls, operation)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = {'calls': 0, 'time': 0.0,
+                                       'self_time': 0.0, 'bytes': 0}
+        stats['calls'] += 1
+        stats['time'] += elapsed
+        stats['self_time'] += elapsed - nested
+        stats['bytes'] += size
+
+    def abort(self):
+        '''Drops the call that was started last.'''
+        self._stack.pop()
+
+    def descent_parse(self, cls, toks, i, binary):
+        '''Parses cls from toks with the profiled descent parser.'''
+        depth, offsets = len(self._stack), self._offsets
+        if offsets is None or offsets[0] is not toks:
+            # Character offsets of the tokens, shared by the nested ASTs
+            self._offsets = (toks, [0] + list(itertools.accumulate(
+                len(tok) for tok in toks)))
+        try:
+            return compiled_parser(cls, binary, True)(toks, i)
+        finally:
+            # Calls that were interrupted by an exception
+            del self._stack[depth:]
+            self._offsets = offsets
+
+    def span(self, i, j):
+        '''Returns the length of the tokens i to j of the parsed list.'''
+        offsets = self._offsets[1]
+        return offsets[j] - offsets[i]
+
+    def rows(self):
+        '''Returns the stats as a list of dicts sorted by self time.'''
+        rows = [dict(stats, cls=cls.__name__, operation=operation)
+                for (cls, operation), stats in self.stats.items()]
+        rows.sort(key=lambda row: row['self_time'], reverse=True)
+        return rows
+
+    def summary(self, limit=None):
+        '''Returns the stats as a table sorted by self time.'''
+        lines = ['%-16s %-10s %9s %10s %10s %12s' %
+                 ('class', 'operation', 'calls', 'time', 'self', 'bytes')]
+        for row in self.rows()[:limit]:
+            lines.append('%-16s %-10s %9d %9.4fs %9.4fs %12d' %
+                         (row['cls'], row['operation'], row['calls'],
+                          row['time'], row['self_time'], row['bytes']))
+        return '\n'.join(lines)
+
+
+def _profile_start():
+    return PROFILER.start()
+
+
+def _profile_abort():
+    PROFILER.abort()
+
+
+def _profile_stop(cls, start, i, j):
+    PROFILER.stop(cls, 'parse', start, PROFILER.span(i, j))
+
+
+def _profile_process(target):
+    '''Profiles the whole process and writes the summary to stderr, or
+    the stats to target if it ends with .json.'''
+    def report(stats):
+        if target.endswith('.json'):
+            with open(target, 'w') as fp:
+                json.dump(profiler.rows(), fp, indent=2)
+        else:
+            sys.stderr.write(profiler.summary() + '\n')
+
+    profiler = Profiler(report)
+    profiler.enable()
+    atexit.register(profiler.disable)
+
+
+class ParseCache(object):
+    '''Cache of parsed files on disk.
+
+    Every entry is a pickled header followed by the pickled AST.  The header
+    records the size, modification time and SHA-1 of the file the AST was
+    parsed from.  An entry is used if the size and modification time are
+    unchanged, or if the content still has the same hash, otherwise the
+    file is parsed again and the entry replaced.'''
+    # Bump when the schemas or the layout of the pickled ASTs change
+    version = 3
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+
+    def entry_path(self, cls, path):
+        '''Returns the path of the entry of cls parsed from path.'''
+        key = '%s.%s:%s' % (cls.__module__, cls.__name__,
+                            os.path.abspath(path))
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.pickle')
+
+    def header(self, cls, path, stat, digest):
+        return {
+            'version': self.version,
+            'fields': cls._fields,
+            'point_arrays': POINT_ARRAYS,
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha1': digest
+        }
+
+    @staticmethod
+    def digest(path):
+        '''Returns the SHA-1 of the content of the file at path.'''
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(2 ** 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def load(self, cls, path):
+        '''Returns the cached AST of cls parsed from path, or None if
+        there is no valid entry.'''
+        stat = os.stat(path)
+        try:
+            with open(self.entry_path(cls, path), 'rb') as fp:
+                header = pickle.load(fp)
+                expected = self.header(cls, path, stat, header.get('sha1'))
+                if header == expected:
+                    return pickle.load(fp)
+                # Touched or copied without changing the content
+                del header['mtime'], expected['mtime']
+                if header == expected and header['sha1'] == self.digest(path):
+                    value = pickle.load(fp)
+                    self.store(cls, path, value, stat, header['sha1'])
+                    return value
+        except FileNotFoundError:
+            pass
+        except (OSError, EOFError, AttributeError, ImportError,
+                pickle.UnpicklingError, TypeError, ValueError, KeyError):
+            # Unreadable entries are replaced
+            pass
+        return None
+
+    def store(self, cls, path, value, stat, digest):
+        '''Stores the AST value of cls parsed from path.  stat and digest
+        have to be taken before the file was read.'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, so that concurrent readers
+        # never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(self.header(cls, path, stat, digest), fp,
+                            pickle.HIGHEST_PROTOCOL)
+                pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.entry_path(cls, path))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def parse_file(self, cls, path, backend=None):
+        '''Returns the cached AST of cls parsed from path, parsing and
+        caching it if necessary.'''
+        value = self.load(cls, path)
+        if value is None:
+            stat, digest = os.stat(path), self.digest(path)
+            value = cls._parse_file(path, backend)
+            self.store(cls, path, value, stat, digest)
+        return value
+
+
+if os.environ.get('PYKICAD_PROFILE'):
+    _profile_process(os.environ['PYKICAD_PROFILE'])
@@ -0,0 +1,678 @@
+import math
+from pykicad.module import Module, Pad, Line, Circle, Arc, Polygon, Curve
+from pykicad.pcb import Segment, Via, GrLine, GrCircle, GrArc, GrPolygon
+from pykicad.pcb import GrCurve, Zone
+
+
+def layer_matches(a, b):
+    '''Returns True if the layer names a and b overlap.  Either can be a
+    wildcard like *.Cu or F&B.Cu.'''
+    if a == b:
+        return True
+    prefix_a, _, suffix_a = a.partition('.')
+    prefix_b, _, suffix_b = b.partition('.')
+    if suffix_a != suffix_b:
+        return False
+    if prefix_a == '*' or prefix_b == '*':
+        return True
+    return bool(set(prefix_a.split('&')) & set(prefix_b.split('&')))
+
+
+def board_transform(module):
+    '''Returns a function mapping the coordinates of module to board
+    coordinates.  Angles are counterclockwise like in pcbnew, the y axis
+    points down.'''
+    if module is None:
+        return lambda x, y: (x, y)
+    at = module.at
+    ox, oy = at[0], at[1]
+    angle = math.radians(at[2]) if len(at) > 2 else 0
+    c, s = math.cos(angle), math.sin(angle)
+    return lambda x, y: (ox + x * c + y * s, oy - x * s + y * c)
+
+
+def _rotate(x, y, angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return x * c + y * s, -x * s + y * c
+
+
+def _segment_distance(px, py, x1, y1, x2, y2):
+    '''Returns the distance of the point (px, py) to the segment from
+    (x1, y1) to (x2, y2).'''
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(px - x1, py - y1)
+    t = max(0, min(1, ((px - x1) * dx + (py - y1) * dy) / length))
+    return math.hypot(px - x1 - t * dx, py - y1 - t * dy)
+
+
+def _segments_cross(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Returns True if the segments from a to b and from c to d
+    intersect.'''
+    def side(px, py, qx, qy, rx, ry):
+        v = (qx - px) * (ry - py) - (qy - py) * (rx - px)
+        return (v > 0) - (v < 0)
+
+    s1, s2 = side(ax, ay, bx, by, cx, cy), side(ax, ay, bx, by, dx, dy)
+    s3, s4 = side(cx, cy, dx, dy, ax, ay), side(cx, cy, dx, dy, bx, by)
+    if s1 != s2 and s3 != s4:
+        return True
+    # Collinear and overlapping
+    return s1 == s2 == 0 and min(ax, bx) <= max(cx, dx) and \
+        min(cx, dx) <= max(ax, bx) and min(ay, by) <= max(cy, dy) and \
+        min(cy, dy) <= max(ay, by)
+
+
+def _segments_distance(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Returns the distance between the segments from a to b and from c
+    to d.'''
+    if _segments_cross(ax, ay, bx, by, cx, cy, dx, dy):
+        return 0
+    return min(_segment_distance(ax, ay, cx, cy, dx, dy),
+               _segment_distance(bx, by, cx, cy, dx, dy),
+               _segment_distance(cx, cy, ax, ay, bx, by),
+               _segment_distance(dx, dy, ax, ay, bx, by))
+
+
+def _box_segment_distance(box, x1, y1, x2, y2):
+    '''Returns the distance of the segment from (x1, y1) to (x2, y2) to the
+    (xmin, ymin, xmax, ymax) box, 0 if they intersect.'''
+    xmin, ymin, xmax, ymax = box
+    corners = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+    for x, y in [(x1, y1), (x2, y2)]:
+        if xmin <= x <= xmax and ymin <= y <= ymax:
+            return 0
+    for (ax, ay), (bx, by) in zip(corners, corners[1:] + corners[:1]):
+        if _segments_cross(x1, y1, x2, y2, ax, ay, bx, by):
+            return 0
+    return min([math.hypot(max(xmin - x, 0, x - xmax),
+                           max(ymin - y, 0, y - ymax))
+                for x, y in [(x1, y1), (x2, y2)]] +
+               [_segment_distance(x, y, x1, y1, x2, y2) for x, y in corners])
+
+
+def _inside(px, py, points):
+    '''Returns True if (px, py) is inside the polygon points.'''
+    inside = False
+    x1, y1 = points[-1]
+    for x2, y2 in points:
+        if (y1 > py) != (y2 > py) and \
+                px < x1 + (py - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class Shape(object):
+    '''Outline of an item in board coordinates.
+
+    A circle is the ring of radius ring around points[0], a polyline the
+    path through points and a polygon the area enclosed by points, all of
+    them widened by radius.  A circle with a ring of 0 is a disc.'''
+    __slots__ = ('kind', 'points', 'radius', 'ring')
+
+    def __init__(self, kind, points, radius=0, ring=0):
+        self.kind = kind
+        self.points = points
+        self.radius = radius
+        self.ring = ring
+
+    def __repr__(self):
+        return 'Shape(%r, %r, %r, %r)' % (self.kind, self.points,
+                                          self.radius, self.ring)
+
+    def bounding_box(self):
+        '''Returns the (xmin, ymin, xmax, ymax) bounding box.'''
+        r = self.radius + self.ring
+        xs = [x for x, _ in self.points]
+        ys = [y for _, y in self.points]
+        return (min(xs) - r, min(ys) - r, max(xs) + r, max(ys) + r)
+
+    def intersects(self, bbox):
+        '''Returns True if the shape intersects the (xmin, ymin, xmax, ymax)
+        box bbox.'''
+        xmin, ymin, xmax, ymax = bbox
+        r = self.radius
+        if self.kind == 'circle':
+            cx, cy = self.points[0]
+            near = math.hypot(max(xmin - cx, 0, cx - xmax),
+                              max(ymin - cy, 0, cy - ymax))
+            far = max(math.hypot(x - cx, y - cy)
+                      for x in (xmin, xmax) for y in (ymin, ymax))
+            return near <= self.ring + r and far >= self.ring - r
+        points = self.points
+        if self.kind == 'polygon':
+            if _inside(xmin, ymin, points):
+                return True
+            points = points + points[:1]
+        if len(points) == 1:
+            points = points * 2
+        return any(_box_segment_distance(bbox, x1, y1, x2, y2) <= r
+                   for (x1, y1), (x2, y2) in zip(points, points[1:]))
+
+    def distance(self, x, y):
+        '''Returns the distance of the point (x, y) to the shape, 0 if the
+        point is inside.'''
+        if self.kind == 'circle':
+            cx, cy = self.points[0]
+            d = abs(math.hypot(x - cx, y - cy) - self.ring)
+        elif self.kind == 'polygon' and _inside(x, y, self.points):
+            return 0
+        else:
+            points = self.points
+            if self.kind == 'polygon':
+                points = points + points[:1]
+            if len(points) == 1:
+                d = math.hypot(x - points[0][0], y - points[0][1])
+            else:
+                d = min(_segment_distance(x, y, x1, y1, x2, y2)
+                        for (x1, y1), (x2, y2) in zip(points, points[1:]))
+        return max(0, d - self.radius)
+
+
+def _outline(shape):
+    '''Returns the segments of the path of a polyline, the outline of a
+    polygon, the ring of a circle or the center of a disc.'''
+    points = shape.points
+    if shape.kind == 'circle' and shape.ring:
+        cx, cy = points[0]
+        points = [(cx + shape.ring * math.cos(math.radians(a)),
+                   cy + shape.ring * math.sin(math.radians(a)))
+                  for a in range(0, 361, 10)]
+    elif shape.kind == 'polygon':
+        points = points + points[:1]
+    if len(points) == 1:
+        points = points * 2
+    return list(zip(points, points[1:]))
+
+
+def shape_distance(a, b):
+    '''Returns the distance between the shapes a and b, 0 if they overlap.
+    Rings are approximated by points 10 degrees apart.'''
+    if a.kind == b.kind == 'polyline' and len(a.points) == len(b.points) == 2:
+        # Two capsules like tracks
+        (ax, ay), (bx, by) = a.points
+        (cx, cy), (dx, dy) = b.points
+        return max(0, _segments_distance(ax, ay, bx, by, cx, cy, dx, dy) -
+                   a.radius - b.radius)
+    for first, second in [(a, b), (b, a)]:
+        if first.kind == 'circle' and not first.ring:
+            x, y = first.points[0]
+            return max(0, second.distance(x, y) - first.radius)
+        if first.kind == 'polygon' and \
+                _inside(second.points[0][0], second.points[0][1],
+                        first.points):
+            return 0
+    d = min(_segments_distance(ax, ay, bx, by, cx, cy, dx, dy)
+            for (ax, ay), (bx, by) in _outline(a)
+            for (cx, cy), (dx, dy) in _outline(b))
+    return max(0, d - a.radius - b.radius)
+
+
+def _arc_points(center, start, angle, to_board):
+    '''Returns points along the arc around center that starts at start and
+    spans angle degrees, at most 10 degrees apart.'''
+    steps = max(1, int(math.ceil(abs(angle) / 10)))
+    points = []
+    for i in range(steps + 1):
+        x, y = _rotate(start[0] - center[0], start[1] - center[1],
+                       -math.radians(angle * i / steps))
+        points.append(to_board(center[0] + x, center[1] + y))
+    return points
+
+
+def _bezier_points(points, to_board, steps=16):
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = points
+    result = []
+    for i in range(steps + 1):
+        t = i / steps
+        a, b, c, d = (1 - t) ** 3, 3 * t * (1 - t) ** 2, \
+            3 * t ** 2 * (1 - t), t ** 3
+        result.append(to_board(a * x0 + b * x1 + c * x2 + d * x3,
+                               a * y0 + b * y1 + c * y2 + d * y3))
+    return result
+
+
+def pad_shape(pad, module=None):
+    '''Returns the Shape of pad, which is part of module, or None if it has
+    no size.  Trapezoids are approximated by their rectangle.'''
+    if pad.size is None:
+        return None
+    x, y = board_transform(module)(pad.at[0], pad.at[1])
+    w, h = pad.size[0] / 2, pad.size[1] / 2
+    # Pad angles on a board include the rotation of the module
+    angle = math.radians(pad.at[2]) if len(pad.at) > 2 else 0
+    if pad.shape == 'circle':
+        return Shape('circle', [(x, y)], w)
+    if pad.shape == 'oval':
+        if w >= h:
+            dx, dy = _rotate(w - h, 0, angle)
+        else:
+            dx, dy = _rotate(0, h - w, angle)
+        return Shape('polyline', [(x - dx, y - dy), (x + dx, y + dy)],
+                     min(w, h))
+    # Rounded rectangles are their inner rectangle widened by the radius
+    r = 0
+    if pad.shape == 'roundrect' and pad.roundrect_rratio:
+        r = min(pad.roundrect_rratio, 0.5) * 2 * min(w, h)
+    corners = [_rotate(cx, cy, angle) for cx, cy in
+               [(r - w, r - h), (w - r, r - h),
+                (w - r, h - r), (r - w, h - r)]]
+    return Shape('polygon', [(x + cx, y + cy) for cx, cy in corners], r)
+
+
+def graphic_shape(elem, module=None):
+    '''Returns the Shape of a line, circle, arc, curve or polygon of the
+    board or of module.'''
+    to_board = board_transform(module)
+    r = (elem.width or 0) / 2
+    if isinstance(elem, (Circle, GrCircle)):
+        center = to_board(*elem.center[:2])
+        ring = math.hypot(elem.end[0] - elem.center[0],
+                          elem.end[1] - elem.center[1])
+        return Shape('circle', [center], r, ring)
+    if isinstance(elem, (Arc, GrArc)):
+        # The start of an arc is its center
+        return Shape('polyline', _arc_points(elem.start, elem.end,
+                                             elem.angle, to_board), r)
+    if isinstance(elem, (Curve, GrCurve)):
+        return Shape('polyline', _bezier_points(
+            [elem.start, elem.bezier1, elem.bezier2, elem.end], to_board), r)
+    if isinstance(elem, (Polygon, GrPolygon)):
+        if elem.pts is None or len(elem.pts) == 0:
+            return None
+        return Shape('polygon', [to_board(x, y) for x, y in elem.pts], r)
+    return Shape('polyline', [to_board(*elem.start[:2]),
+                              to_board(*elem.end[:2])], r)
+
+
+def courtyard_shape(module):
+    '''Returns the rectangle around the courtyard of module, or around its
+    pads and graphics if it has no courtyard, or None if it's empty.'''
+    shapes = [graphic_shape(elem) for elem in module.courtyard()]
+    shapes = [shape for shape in shapes if shape is not None]
+    if shapes:
+        boxes = [shape.bounding_box() for shape in shapes]
+        box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+               max(b[2] for b in boxes), max(b[3] for b in boxes))
+    else:
+        box = module.bounding_box()
+        if box is None:
+            return None
+    to_board = board_transform(module)
+    xmin, ymin, xmax, ymax = box
+    return Shape('polygon', [to_board(x, y) for x, y in
+                             [(xmin, ymin), (xmax, ymin), (xmax, ymax),
+                              (xmin, ymax)]])
+
+
+def zone_shape(zone):
+    '''Returns the Shape of the filled polygon of zone, or of its outline if
+    it isn't filled, or None if it has neither.'''
+    if zone.filled_polygon is not None and len(zone.filled_polygon):
+        # Filled polygons are outlines drawn with min_thickness
+        points, radius = zone.filled_polygon, (zone.min_thickness or 0) / 2
+    elif zone.polygon is not None and len(zone.polygon):
+        points, radius = zone.polygon, 0
+    else:
+        return None
+    return Shape('polygon', [(float(x), float(y)) for x, y in points], radius)
+
+
+def item_shape(item, module=None):
+    '''Returns the Shape of a board item, or of a pad or graphic of
+    module.  The shape of a module is its courtyard.'''
+    if isinstance(item, Segment):
+        return Shape('polyline', [tuple(item.start[:2]), tuple(item.end[:2])],
+                     (item.width or 0) / 2)
+    if isinstance(item, Via):
+        return Shape('circle', [tuple(item.at[:2])], item.size / 2)
+    if isinstance(item, Pad):
+        return pad_shape(item, module)
+    if isinstance(item, Module):
+        return courtyard_shape(item)
+    if isinstance(item, Zone):
+        return zone_shape(item)
+    return graphic_shape(item, module)
+
+
+def item_layers(item):
+    '''Returns the layers of a board item.  Through vias are on *.Cu.'''
+    if isinstance(item, Via):
+        if item.micro or item.blind:
+            return list(item.layers)
+        return ['*.Cu']
+    if isinstance(item, Pad):
+        return list(item.layers)
+    if isinstance(item, Module):
+        return [item.layer.split('.')[0] + '.CrtYd']
+    return [item.layer] if item.layer is not None else []
+
+
+def _overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class _Entry(object):
+    __slots__ = ('item', 'module', 'shape', 'bbox', 'layers', 'level',
+                 'cells')
+
+    def __init__(self, item, module, shape, layers):
+        self.item = item
+        self.module = module
+        self.shape = shape
+        self.bbox = shape.bounding_box()
+        self.layers = layers
+        self.level = None
+        self.cells = None
+
+
+def shape_cells(shape, size, limit):
+    '''Returns the set of grid cells of size mm touched by shape, or None
+    if there are more than limit.  Polylines only touch the cells along
+    their path, other shapes every cell of their bounding box.'''
+    if shape.kind != 'polyline':
+        bbox = shape.bounding_box()
+        x0, y0, x1, y1 = [int(math.floor(v / size)) for v in bbox]
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > limit:
+            return None
+        return set((ix, iy) for ix in range(x0, x1 + 1)
+                   for iy in range(y0, y1 + 1))
+    cells = set()
+    r = shape.radius
+    points = shape.points
+    if len(points) == 1:
+        points = points * 2
+    floor = math.floor
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        if x1 > x2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        slope = (y2 - y1) / (x2 - x1) if x2 > x1 else 0
+        # The part of the widened segment in a column lies between the
+        # ends of the part of the segment within r of the column
+        for ix in range(int(floor((x1 - r) / size)),
+                        int(floor((x2 + r) / size)) + 1):
+            ya = y1 + slope * (max(x1, ix * size - r) - x1)
+            yb = y1 + slope * (min(x2, (ix + 1) * size + r) - x1) \
+                if x2 > x1 else y2
+            if ya > yb:
+                ya, yb = yb, ya
+            for iy in range(int(floor((ya - r) / size)),
+                            int(floor((yb + r) / size)) + 1):
+                cells.add((ix, iy))
+            if len(cells) > limit:
+                return None
+    return cells
+
+
+class _Grid(object):
+    '''Grids of the entries on one layer.  The cells of level k are
+    cell_size * 2 ** k mm wide, an entry is put on the finest level on
+    which it touches at most max_cells cells.'''
+
+    def __init__(self, cell_size, max_cells):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        # Level to dict of cell to dict of entries
+        self.levels = {}
+        # Level to range of cells that were ever occupied
+        self.extents = {}
+
+    def first_level(self, shape):
+        '''Returns the finest level on which shape might touch at most
+        max_cells cells.'''
+        if shape.kind == 'polyline':
+            points = shape.points
+            extent = 2 * sum(abs(x2 - x1) + abs(y2 - y1) for (x1, y1), (x2, y2)
+                             in zip(points, points[1:])) / self.max_cells
+        else:
+            xmin, ymin, xmax, ymax = shape.bounding_box()
+            extent = max(xmax - xmin, ymax - ymin) / math.sqrt(self.max_cells)
+        if extent <= self.cell_size:
+            return 0
+        return int(math.log2(extent / self.cell_size))
+
+    def add(self, entry):
+        if entry.cells is None:
+            level = self.first_level(entry.shape)
+            while True:
+                cells = shape_cells(entry.shape, self.cell_size * 2 ** level,
+                                    self.max_cells)
+                if cells is not None:
+                    break
+                level += 1
+            entry.level, entry.cells = level, list(cells)
+        level, key = entry.level, id(entry.item)
+        grid = self.levels.get(level)
+        if grid is None:
+            grid = self.levels[level] = {}
+        for cell_key in entry.cells:
+            cell = grid.get(cell_key)
+            if cell is None:
+                cell = grid[cell_key] = {}
+            cell[key] = entry
+        xs = [ix for ix, _ in entry.cells]
+        ys = [iy for _, iy in entry.cells]
+        e = self.extents.get(level)
+        if e is None:
+            e = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            e = (min(e[0], min(xs)), min(e[1], min(ys)),
+                 max(e[2], max(xs)), max(e[3], max(ys)))
+        self.extents[level] = e
+
+    def discard(self, entry):
+        grid, key = self.levels[entry.level], id(entry.item)
+        for cell_key in entry.cells:
+            cell = grid.get(cell_key)
+            if cell is not None:
+                cell.pop(key, None)
+                if not cell:
+                    del grid[cell_key]
+
+    def candidates(self, bbox):
+        '''Yields the entries in the cells touching bbox, possibly more
+        than once.'''
+        for level, grid in self.levels.items():
+            size = self.cell_size * 2 ** level
+            x0, y0 = int(math.floor(bbox[0] / size)), \
+                int(math.floor(bbox[1] / size))
+            x1, y1 = int(math.floor(bbox[2] / size)), \
+                int(math.floor(bbox[3] / size))
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > len(grid):
+                for (ix, iy), cell in grid.items():
+                    if x0 <= ix <= x1 and y0 <= iy <= y1:
+                        for entry in cell.values():
+                            yield entry
+                continue
+            for ix in range(x0, x1 + 1):
+                for iy in range(y0, y1 + 1):
+                    cell = grid.get((ix, iy))
+                    if cell is not None:
+                        for entry in cell.values():
+                            yield entry
+
+    def nearest(self, x, y, best, best_distance, accept=None):
+        '''Returns the entry nearest to (x, y) if it's nearer than
+        best_distance, otherwise best, and its distance.  Only entries
+        whose item passes accept are considered.'''
+        for level, grid in self.levels.items():
+            size = self.cell_size * 2 ** level
+            cx, cy = int(math.floor(x / size)), int(math.floor(y / size))
+            # Rings that have to be searched to cover every cell
+            e = self.extents[level]
+            last = max(abs(cx - e[0]), abs(cx - e[2]),
+                       abs(cy - e[1]), abs(cy - e[3]))
+            r = 0
+            while r <= last:
+                # Entries in further rings are at least this far away
+                bound = min(x - (cx - r) * size, (cx + r + 1) * size - x,
+                            y - (cy - r) * size, (cy + r + 1) * size - y)
+                for entry in self.ring(grid, cx, cy, r):
+                    if accept is not None and not accept(entry.item):
+                        continue
+                    distance = entry.shape.distance(x, y)
+                    if distance < best_distance or best is None and \
+                            distance <= best_distance:
+                        best, best_distance = entry, distance
+                if best_distance <= bound:
+                    break
+                r += 1
+        return best, best_distance
+
+    @staticmethod
+    def ring(grid, cx, cy, r):
+        '''Yields the entries in the cells at chebyshev distance r from
+        the cell (cx, cy).'''
+        if r == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(ix, iy) for ix in range(cx - r, cx + r + 1)
+                     for iy in (cy - r, cy + r)]
+            cells += [(ix, iy) for iy in range(cy - r + 1, cy + r)
+                      for ix in (cx - r, cx + r)]
+        for cell_key in cells:
+            cell = grid.get(cell_key)
+            if cell is not None:
+                for entry in cell.values():
+                    yield entry
+
+
+class SpatialIndex(object):
+    '''Index of board items by position, partitioned by layer.
+
+    Indexes segments, vias, zones, graphics, pads in board coordinates and
+    module courtyards.  Every layer is a stack of uniform grids with cells of
+    cell_size, 2 * cell_size, 4 * cell_size ... mm.  An item is registered
+    in the cells it touches on the finest grid on which those are at most
+    max_cells, so that long tracks don't crowd the cells they only pass
+    near.
+
+    Items on wildcard layers like *.Cu are found by queries of any
+    matching layer.  Moved items have to be passed to update.'''
+
+    def __init__(self, cell_size=2.0, max_cells=16):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.grids = {}
+        self.entries = {}
+        # Pads of the indexed modules
+        self.children = {}
+
+    @classmethod
+    def from_pcb(cls, pcb, cell_size=2.0, max_cells=16):
+        '''Returns an index of the segments, vias, zones, modules and
+        graphics of pcb.'''
+        index = cls(cell_size, max_cells)
+        for items in [pcb.segments, pcb.vias, pcb.zones, pcb.modules,
+                      pcb.lines, pcb.arcs, pcb.circles, pcb.polygons,
+                      pcb.curves]:
+            for item in items:
+                index.insert(item)
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, item):
+        return id(item) in self.entries
+
+    def __iter__(self):
+        for entry in self.entries.values():
+            yield entry.item
+
+    def insert(self, item, module=None):
+        '''Adds item to the index.  Pads and graphics of a module need the
+        module, inserting a module inserts its pads.'''
+        if id(item) in self.entries:
+            raise ValueError('%r is already indexed' % item)
+        shape = item_shape(item, module)
+        if shape is not None:
+            entry = _Entry(item, module, shape, item_layers(item))
+            self.entries[id(item)] = entry
+            for layer in entry.layers:
+                grid = self.grids.get(layer)
+                if grid is None:
+                    grid = self.grids[layer] = _Grid(self.cell_size,
+                                                     self.max_cells)
+                grid.add(entry)
+        if isinstance(item, Module):
+            self.children[id(item)] = list(item.pads)
+            for pad in item.pads:
+                self.insert(pad, item)
+
+    def remove(self, item):
+        '''Removes item and the pads of a module from the index.'''
+        entry = self.entries.pop(id(item), None)
+        if entry is not None:
+            for layer in entry.layers:
+                self.grids[layer].discard(entry)
+        for pad in self.children.pop(id(item), []):
+            self.remove(pad)
+
+    def update(self, item):
+        '''Updates the index after item was moved or changed.'''
+        entry = self.entries.get(id(item))
+        module = entry.module if entry is not None else None
+        self.remove(item)
+        self.insert(item, module)
+
+    def shape(self, item):
+        '''Returns the indexed Shape of item.'''
+        return self.entries[id(item)].shape
+
+    def module(self, item):
+        '''Returns the module of an indexed pad.'''
+        return self.entries[id(item)].module
+
+    def _grids(self, layer):
+        if layer is None:
+            return list(self.grids.values())
+        return [grid for name, grid in self.grids.items()
+                if layer_matches(name, layer)]
+
+    def query(self, bbox, layer=None, exact=True):
+        '''Returns the items on layer that intersect the (xmin, ymin, xmax,
+        ymax) box bbox.  If exact is False the items whose bounding box
+        intersects bbox are returned, which is cheaper for callers that
+        test the shapes themselves.'''
+        result, seen = [], set()
+        for grid in self._grids(layer):
+            for entry in grid.candidates(bbox):
+                key = id(entry.item)
+                if key in seen or not _overlaps(entry.bbox, bbox):
+                    continue
+                seen.add(key)
+                if not exact or entry.shape.intersects(bbox):
+                    result.append(entry.item)
+        return result
+
+    def within(self, point, radius, layer=None):
+        '''Returns the items on layer within radius of point, nearest
+        first.'''
+        x, y = point
+        bbox = (x - radius, y - radius, x + radius, y + radius)
+        found, seen = [], set()
+        for grid in self._grids(layer):
+            for entry in grid.candidates(bbox):
+                key = id(entry.item)
+                if key in seen or not _overlaps(entry.bbox, bbox):
+                    continue
+                seen.add(key)
+                distance = entry.shape.distance(x, y)
+                if distance <= radius:
+                    found.append((distance, len(found), entry.item))
+        found.sort()
+        return [item for _, _, item in found]
+
+    def nearest(self, point, layer=None, max_distance=float('inf'),
+                accept=None):
+        '''Returns the item on layer nearest to point, or None if there is
+        none within max_distance.  If accept is given only the items for
+        which it returns True are considered.'''
+        best, distance = None, max_distance
+        for grid in self._grids(layer):
+            best, distance = grid.nearest(point[0], point[1], best, distance,
+                                          accept)
+        return best.item if best is not None else None
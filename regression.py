@@ -1,10 +1,33 @@
+import argparse
+import csv
 import difflib
+import json
+import multiprocessing.util
+import os
 import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pykicad.pcb import *
 from pykicad.module import *
 from pykicad.sexpr import *
 
 
+REPORT_FIELDS = ['library', 'module', 'path', 'file_size', 'parse_time',
+                 'serialize_time', 'roundtrip', 'pcbnew', 'error']
+
+# Script that loads a board with pcbnew and exits with 0 if it succeeds
+PCBNEW_SCRIPT = './pcbnew-loadboard.py'
+
+# Temporary directory of the worker process, boards written for pcbnew
+# are put there so that workers don't overwrite each other's files
+worker_dir = None
+
+
 class PcbnewException(Exception):
     pass
 
@@ -14,105 +37,214 @@ def debug_print(text):
         sys.stdout.buffer.write(("%4d: %s\n" % (i + 1, line)).encode('utf-8'))
 
 
-def randomize_attribute_order(self):
-    return AST.to_string(self, sorted(self.attributes.items(),
-                                      key=lambda x: random.random()))
+def randomize_attribute_order(module):
+    return AST.to_string(module, sorted(module.attributes.items(),
+                                        key=lambda x: random.random()))
 
 
-Module.to_string = randomize_attribute_order
+def diff_ast(a1, a2):
+    for line in difflib.context_diff(repr(a1), repr(a2)):
+        sys.stdout.write(line)
 
 
-def test_parse_module(module_path):
-    module_text = open(module_path, 'r', encoding='utf-8').read()
+def init_worker():
+    global worker_dir
+    worker_dir = tempfile.mkdtemp(prefix='pykicad-regression-')
+    # Pool workers don't run atexit handlers
+    multiprocessing.util.Finalize(None, shutil.rmtree, (worker_dir, True),
+                                  exitpriority=10)
 
-    try:
-        module = Module.parse(module_text)
-    except:
-        debug_print(module_text)
-        raise
 
-    try:
-        module2 = Module.parse(module.to_string())
-    except:
-        debug_print(module.to_string())
-        raise
+def test_parse_module(module_path, backend=None, pcbnew=None, debug=False):
+    '''Parses, serializes and reparses the module at module_path and
+    returns the timings.  Loads the module with the pcbnew script if one
+    is given.'''
+    result = {'file_size': os.path.getsize(module_path)}
+    with open(module_path, 'r', encoding='utf-8') as f:
+        module_text = f.read()
 
+    start = time.perf_counter()
     try:
-        assert module == module2
+        module = Module.parse(module_text, backend)
     except:
-        diff_ast(module, module2)
+        if debug:
+            debug_print(module_text)
         raise
+    result['parse_time'] = time.perf_counter() - start
 
-    try:
-        pcb = Pcb(modules=[module])
+    start = time.perf_counter()
+    module_string = module.to_string()
+    result['serialize_time'] = time.perf_counter() - start
 
-        with open('test.kicad_pcb', 'w+') as f:
-            f.write(str(pcb))
-
-        code = os.system('./pcbnew-loadboard.py test.kicad_pcb')
-        assert code == 0
+    # Reparse with the attributes in random order to catch order
+    # dependencies of the parser
+    shuffled = randomize_attribute_order(module)
+    try:
+        module2 = Module.parse(shuffled, backend)
     except:
-        debug_print(module.to_string())
-        raise PcbnewException()
-
+        if debug:
+            debug_print(shuffled)
+        raise
+    result['roundtrip'] = module == module2 and \
+        Module.parse(module_string, backend) == module
+    if not result['roundtrip'] and debug:
+        diff_ast(module, module2)
 
-def diff_ast(a1, a2):
-    for line in difflib.context_diff(repr(a1), repr(a2)):
-        sys.stdout.write(line)
+    if pcbnew is not None:
+        board = os.path.join(worker_dir or tempfile.gettempdir(),
+                             'test.kicad_pcb')
+        with open(board, 'w+') as f:
+            f.write(str(Pcb(modules=[module])))
+        result['pcbnew'] = subprocess.call([pcbnew, board]) == 0
+        if not result['pcbnew'] and debug:
+            debug_print(module_string)
 
+    return result
 
-def regression_test(libs, debug=False, blacklist=[]):
-    num_modules = len(list_all_modules())
-    num_tested_modules = 0
-    failed_modules = []
 
+def run_test(lib, module, path, backend=None, pcbnew=None, debug=False):
+    '''Runs test_parse_module and returns a report row.'''
+    row = dict.fromkeys(REPORT_FIELDS)
+    row.update(library=lib, module=module, path=path)
+    try:
+        row.update(test_parse_module(path, backend, pcbnew, debug))
+    except Exception as e:
+        if debug:
+            traceback.print_exc()
+        row['error'] = '%s: %s' % (type(e).__name__, str(e).split('\n')[0])
+    return row
+
+
+def passed(row):
+    return row['error'] is None and row['roundtrip'] and \
+        row['pcbnew'] is not False
+
+
+def load_checkpoint(path):
+    '''Returns the rows of the footprints tested by an earlier run.'''
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted run
+                continue
+            rows[row['path']] = row
+    return rows
+
+
+def write_report(rows, path):
+    '''Writes the rows as csv or json depending on the extension of path.'''
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(f, REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, indent=2)
+
+
+def regression_test(libs, debug=False, blacklist=[], workers=None,
+                    backend=None, pcbnew=PCBNEW_SCRIPT,
+                    checkpoint='regression.checkpoint',
+                    report='regression.json'):
+    '''Tests every module in libs using workers processes.  Boards of the
+    modules are loaded with the pcbnew script unless it's None.  Tested
+    modules are appended to the checkpoint file, a run that is interrupted
+    skips them when it's started again.'''
+    footprints = []
     for lib in libs:
         for module in list_modules(lib):
-            for (blib, bmodule) in blacklist:
-                if lib == blib and module == bmodule:
-                    print('Skipping', blib, bmodule)
-                    break
-            else:
-                path = find_module(lib, module)
-
-                try:
-                    test_parse_module(path)
-                except:
-                    print('Failed at %s %s' % (lib, module))
-                    failed_modules.append((lib, module))
-
-                    if debug:
-                        raise
-
-                    continue
-
-            num_tested_modules += 1
-
-            print('Tested %d out of %d modules' %
-                  (num_tested_modules, num_modules))
-
+            if (lib, module) in blacklist:
+                print('Skipping', lib, module)
+                continue
+            footprints.append((lib, module, find_module(lib, module)))
+
+    done = load_checkpoint(checkpoint) if checkpoint else {}
+    todo = [fp for fp in footprints if fp[2] not in done]
+    print('Testing %d out of %d modules, %d done by an earlier run' %
+          (len(todo), len(footprints), len(footprints) - len(todo)))
+
+    checkpoint_file = open(checkpoint, 'a', encoding='utf-8') \
+        if checkpoint else None
+    num_tested_modules = 0
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker) as executor:
+            futures = [executor.submit(run_test, lib, module, path, backend,
+                                       pcbnew, debug)
+                       for lib, module, path in todo]
+            for future in as_completed(futures):
+                row = future.result()
+                done[row['path']] = row
+                if checkpoint_file:
+                    checkpoint_file.write(json.dumps(row) + '\n')
+                    checkpoint_file.flush()
+                num_tested_modules += 1
+                if not passed(row):
+                    print('Failed at %s %s: %s' % (row['library'],
+                                                   row['module'],
+                                                   row['error']))
+                print('Tested %d out of %d modules' %
+                      (num_tested_modules, len(todo)))
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    rows = [done[path] for _, _, path in footprints if path in done]
+    if report:
+        write_report(rows, report)
+
+    failed_modules = [(row['library'], row['module'])
+                      for row in rows if not passed(row)]
     print('====================================')
     print('Failed to parse %d out of %d modules' %
-          (len(failed_modules), num_modules))
+          (len(failed_modules), len(rows)))
     print('====================================')
     print(failed_modules)
 
+    timed = [row for row in rows if row['parse_time'] is not None]
+    timed.sort(key=lambda row: row['parse_time'] + row['serialize_time'],
+               reverse=True)
+    print('Slowest modules:')
+    for row in timed[:10]:
+        print('  %s %s: parse %.3fs, serialize %.3fs, %d bytes' %
+              (row['library'], row['module'], row['parse_time'],
+               row['serialize_time'], row['file_size']))
 
-if __name__ == '__main__':
-    blacklist = []
-    test_modules = []
-    test_libraries = []
-
-    # for lib, mod in test_modules:
-    #    test_parse_module(find_module(lib, mod))
+    return rows
 
-    regression_test(list_libraries())
 
-    # try:
-    #    regression_test(test_libraries, debug=True, blacklist=blacklist)
-    # except PcbnewException:
-    #    os.system('pcbnew test.kicad_pcb')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Parses and serializes every footprint in the libraries '
+                    'on KISYSMOD.')
+    parser.add_argument('libraries', nargs='*',
+                        help='libraries to test, defaults to all')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--backend', choices=['pyparsing', 'descent'])
+    parser.add_argument('--pcbnew', default=PCBNEW_SCRIPT,
+                        help='script that loads a board with pcbnew, '
+                             'defaults to %s' % PCBNEW_SCRIPT)
+    parser.add_argument('--no-pcbnew', dest='pcbnew', action='store_const',
+                        const=None, help="don't load the boards with pcbnew")
+    parser.add_argument('--checkpoint', default='regression.checkpoint',
+                        help='file recording tested footprints')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint of an earlier run')
+    parser.add_argument('--report', default='regression.json',
+                        help='report file, .json or .csv')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
 
-    #pcb = Pcb.from_file('project.kicad_pcb')
-    #assert Pcb.parse(str(pcb)) == pcb
-    # pcb.to_file('project2')
+    blacklist = []
+    regression_test(args.libraries or list_libraries(), debug=args.debug,
+                    blacklist=blacklist, workers=args.workers,
+                    backend=args.backend, pcbnew=args.pcbnew,
+                    checkpoint=args.checkpoint, report=args.report)
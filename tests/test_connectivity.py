@@ -0,0 +1,111 @@
+import unittest
+from pytest import *
+from pykicad.pcb import *
+from pykicad.connectivity import *
+
+
+class ConnectivityTests(unittest.TestCase):
+    def setUp(self):
+        self.gnd, self.vcc = Net('GND', code=1), Net('VCC', code=2)
+        self.r1 = self.resistor('R1', [0, 0])
+        self.r2 = self.resistor('R2', [10, 0])
+        self.pcb = Pcb(nets=[self.gnd, self.vcc], modules=[self.r1, self.r2])
+
+    def resistor(self, name, at):
+        module = Module(name, at=at, pads=[
+            Pad('1', size=[1, 1], at=[-1, 0], layers=['F.Cu']),
+            Pad('2', size=[1, 1], at=[1, 0], layers=['F.Cu'])
+        ])
+        module.connect('1', self.vcc)
+        module.connect('2', self.gnd)
+        return module
+
+    def test_islands(self):
+        conn = Connectivity(self.pcb)
+        assert len(conn.islands()[1]) == 2
+        assert len(conn.unrouted()) == 2
+        assert conn.unrouted(2) == [(2, self.r1.pads[0], self.r2.pads[0], 9.5)]
+
+        # Routed with tracks ending inside the pads and two vias
+        tracks = [Segment([-1.2, 0], [-1.2, 3], 2, layer='F.Cu'),
+                  Segment([-1.2, 3], [4, 3], 2, layer='F.Cu'),
+                  Segment([4, 3], [9, 3], 2, layer='B.Cu'),
+                  Segment([9, 3], [9, 0.2], 2, layer='F.Cu')]
+        vias = [Via([4, 3], 0.8, 0.4, 2), Via([9, 3], 0.8, 0.4, 2)]
+        for item in tracks + vias[:1]:
+            conn.add(item)
+        assert len(conn.islands(2)[2]) == 2
+        conn.add(vias[1])
+        assert conn.unrouted(2) == []
+        assert conn.connected(self.r1.pads[0], self.r2.pads[0])
+        assert len(conn.island(vias[0])) == 8
+
+        conn.remove(vias[0])
+        assert not conn.connected(self.r1.pads[0], self.r2.pads[0])
+        assert conn.connected(tracks[0], self.r1.pads[0])
+        assert conn.connected(tracks[2], self.r2.pads[0])
+        assert not conn.connected(tracks[1], tracks[2])
+
+        # Moving a module breaks the connection to its pads
+        conn.add(vias[0])
+        self.r2.place(20, 0)
+        conn.update(self.r2)
+        assert not conn.connected(self.r1.pads[0], self.r2.pads[0])
+        assert conn.shorts() == []
+
+    def test_zones(self):
+        zone = Zone(net=1, net_name='GND', layer='F.Cu',
+                    polygon=[(0, -1), (12, -1), (12, 1), (0, 1)])
+        self.pcb.zones.append(zone)
+        conn = Connectivity(self.pcb)
+        assert conn.connected(self.r1.pads[1], self.r2.pads[1])
+        assert conn.unrouted(1) == []
+        # Pads of other nets aren't connected by the zone
+        assert not conn.connected(zone, self.r2.pads[0])
+        zone.connect_pads = 'no'
+        conn.update(zone)
+        assert len(conn.islands(1)[1]) == 3
+
+    def test_shorts(self):
+        conn = Connectivity(self.pcb)
+        track = Segment([-1, 0], [1, 0], 2)
+        conn.add(track)
+        assert conn.shorts() == [([1, 2], conn.island(track))]
+        conn.remove(track)
+        assert conn.shorts() == []
+        assert len(conn) == 4
+
+    def test_unrouted(self):
+        conn = Connectivity()
+        for x in [11, 0, 10, 3]:
+            conn.add(Via([x, 5], 0.8, 0.4, 3))
+        ratsnest = conn.unrouted()
+        assert set(net for net, _, _, _ in ratsnest) == {3}
+        edges = sorted((min(a.at[0], b.at[0]), max(a.at[0], b.at[0]),
+                        round(distance, 6)) for _, a, b, distance in ratsnest)
+        assert edges == [(0, 3, 2.6), (3, 10, 6.6), (10, 11, 0.6)]
+
+    def test_junctions(self):
+        conn = Connectivity()
+        track = Segment([0, 0], [10, 0], 1, width=0.25, layer='F.Cu')
+        # Ending in the middle of the track
+        branch = Segment([5, 0.1], [5, 5], 1, width=0.25, layer='F.Cu')
+        other_layer = Segment([8, 0], [8, 5], 1, width=0.25, layer='B.Cu')
+        for item in [track, branch, other_layer]:
+            conn.add(item)
+        assert conn.connected(track, branch)
+        assert not conn.connected(track, other_layer)
+
+        # Ending off the center of a via, and a via on the track
+        via = Via([20, 0], 0.8, 0.4, 1)
+        inside = Segment([20.3, 0.1], [25, 0], 1, width=0.25, layer='B.Cu')
+        outside = Segment([20.5, 0], [20.5, 5], 1, width=0.25, layer='F.Cu')
+        on_track = Via([8, 3], 0.8, 0.4, 1)
+        for item in [via, inside, outside, on_track]:
+            conn.add(item)
+        assert conn.connected(via, inside)
+        assert not conn.connected(via, outside)
+        assert conn.connected(other_layer, on_track)
+        conn.remove(on_track)
+        assert conn.connected(track, branch)
+        assert len(conn.island(other_layer)) == 1
@@ -0,0 +1,83 @@
+import random
+import unittest
+from pytest import *
+from pykicad.pcb import *
+from pykicad.drc import *
+from pykicad.spatial import item_shape, shape_distance
+
+
+class DrcTests(unittest.TestCase):
+    def setUp(self):
+        self.nets = [Net('', 0), Net('GND', 1), Net('VCC', 2), Net('SIG', 3)]
+        module = Module('R1', at=[0, 0], pads=[
+            Pad('1', shape='rect', size=[1, 1], at=[-1, 0], net=self.nets[1]),
+            Pad('2', shape='roundrect', size=[1, 1], at=[1, 0],
+                roundrect_rratio=0.25, net=self.nets[2])
+        ])
+        self.pcb = Pcb(nets=self.nets, modules=[module], net_classes=[
+            NetClass('Default', clearance=0.2, nets=['GND', 'VCC']),
+            NetClass('Power', clearance=0.5, nets=['SIG'])
+        ], segments=[
+            Segment([3, 0], [6, 0], 1, width=0.2),
+            Segment([3, 0.35], [6, 0.35], 2, width=0.2),
+            Segment([3, -0.3], [6, -0.3], 1, width=0.2),
+            Segment([3, 2], [6, 2], 3, width=0.2, layer='B.Cu')
+        ], vias=[Via([4, 1.7], 0.6, 0.3, 1)])
+
+    def test_clearances(self):
+        rules = ClearanceRules(self.pcb)
+        assert rules.clearance(self.pcb.segments[3]) == 0.5
+        assert rules.clearance(self.pcb.vias[0]) == 0.2
+        violations = check_clearances(self.pcb, rules)
+        found = sorted((v.kind, v.layer, v.nets) for v in violations)
+        assert found == [('segment-segment', 'F.Cu', ('GND', 'VCC')),
+                         ('segment-via', 'B.Cu', ('SIG', 'GND'))]
+        via = [v for v in violations if v.kind == 'segment-via'][0]
+        assert approx(via.distance) == 0
+        assert via.clearance == 0.5 and via.second is self.pcb.vias[0]
+        assert via.as_dict()['first'] == 'segment (3, 2)-(6, 2) on B.Cu'
+
+        # Pads 2mm apart, the rounded corners are further apart
+        self.pcb.modules[0].pads[0].at = [0.15, 0]
+        self.pcb.modules[0].pads[0].size = [0.5, 0.5]
+        self.pcb.modules[0].pads[0].clearance = 0.3
+        violations = check_clearances(self.pcb)
+        pads = [v for v in violations if v.kind == 'pad-pad']
+        assert len(pads) == 1 and approx(pads[0].distance) == 0.1
+        assert pads[0].as_dict()['second'] == 'pad R1.2'
+
+    def test_random(self):
+        rng = random.Random(1)
+        segments = []
+        for _ in range(200):
+            x, y = rng.uniform(0, 20), rng.uniform(0, 20)
+            segments.append(Segment([x, y], [x + rng.uniform(-2, 2),
+                                             y + rng.uniform(-2, 2)],
+                                    rng.randint(1, 3), width=0.2,
+                                    layer=rng.choice(['F.Cu', 'B.Cu'])))
+        vias = [Via([rng.uniform(0, 20), rng.uniform(0, 20)], 0.6, 0.3,
+                    rng.randint(1, 3)) for _ in range(50)]
+        pcb = Pcb(nets=self.nets, segments=segments, vias=vias,
+                  net_classes=self.pcb.net_classes)
+        rules = ClearanceRules(pcb)
+        violations = check_clearances(pcb, rules)
+        found = set((id(v.first), id(v.second)) for v in violations)
+        assert len(found) == len(violations)
+        # Tracks that touch many cells are only put in the cells on their path
+        small = check_clearances(pcb, rules, cell_size=0.3)
+        assert set((id(v.first), id(v.second)) for v in small) == found
+        assert len(small) == len(violations)
+
+        expected = set()
+        items = segments + vias
+        for i, a in enumerate(items):
+            for b in items[i + 1:]:
+                if a.net == b.net or isinstance(a, Segment) and \
+                        isinstance(b, Segment) and a.layer != b.layer:
+                    continue
+                required = max(rules.clearance(a), rules.clearance(b))
+                if shape_distance(item_shape(a), item_shape(b)) < required:
+                    if isinstance(a, Via) and isinstance(b, Segment):
+                        a, b = b, a
+                    expected.add((id(a), id(b)))
+        assert found == expected and len(found) > 10
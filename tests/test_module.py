@@ -1,6 +1,22 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
 from pytest import *
 from pykicad.module import *
+from pykicad.pcb import Pcb
+
+
+def run_in_new_process(code, *args):
+    '''Returns the output of code run by a fresh interpreter, which has no
+    items constructed yet.'''
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    return subprocess.check_output([sys.executable, '-c', code] + list(args),
+                                   env=env, universal_newlines=True)
 
 
 class DrillTests(unittest.TestCase):
@@ -142,9 +158,314 @@ class ModuleTests(unittest.TestCase):
         assert Module.parse(module.to_string()) == module
 
 
+class ModuleFileTests(unittest.TestCase):
+    def test_descent_backend(self):
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        module_string = open(path, 'r', encoding='utf-8').read()
+        module = Module.parse(module_string, backend='descent')
+        assert module == Module.parse(module_string, backend='pyparsing')
+
+    def test_write(self):
+        module = Module.from_file('tests/testlib.pretty/TLC5955.kicad_mod')
+        fp = io.StringIO()
+        module.write(fp, buffer_size=64)
+        assert fp.getvalue() == module.to_string()
+
+    def test_clone(self):
+        Module.clear_cache()
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        a, b = Module.from_file(path), Module.from_file(path)
+        assert a == b == Module.parse_file(path)
+        a.lines.append(Line(start=[0, 0], end=[1, 1]))
+        a.texts[0].hide = True
+        a.pads[0].drill = Drill(1)
+        assert b == Module.parse_file(path)
+        assert Module.from_file(path) == b
+
+    def test_shared_clone(self):
+        Module.clear_cache()
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        r1 = Module.from_file(path, shared=True)
+        r2 = Module.from_file(path, shared=True)
+        assert r1 == r2 == Module.parse_file(path)
+        assert r1.lines is not r2.lines and r1.lines[0] is r2.lines[0]
+        r1.lines.append(Line(start=[0, 0], end=[1, 1]))
+        r1.place(1, 2)
+        r1.connect('1', Net('VI', code=1))
+        r1.rotate(90)
+        assert r1.texts[0] is not r2.texts[0]
+        assert r1.lines[0] is r2.lines[0]
+        r1.flip()
+        assert r1.lines[0] is not r2.lines[0]
+        assert r2 == Module.parse_file(path)
+        assert Module.from_file(path) == r2
+
+    def test_cache(self):
+        cache = ModuleCache(max_entries=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, '%d.kicad_mod' % i) for i in range(3)]
+            for path in paths:
+                shutil.copy('tests/testlib.pretty/TLC5955.kicad_mod', path)
+            for path in paths[:2]:
+                assert cache.get(path) is None
+                cache.put(path, Module.parse_file(path))
+            assert cache.get(paths[0]).name == 'TLC5955'
+            cache.put(paths[2], Module.parse_file(paths[2]))
+            assert paths[0] in cache and paths[1] not in cache
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'],
+                stats['evictions']) == (1, 2, 1)
+        assert stats['entries'] == 2 and stats['bytes'] > 0
+
+        cache = ModuleCache(max_bytes=cache.bytes // 4)
+        cache.put(paths[0], Module.parse('(module TLC5955)'))
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        cache.put(path, Module.parse_file(path))
+        assert len(cache) == 0 and cache.stats()['evictions'] == 2
+
+    def test_cache_mapping(self):
+        Module.clear_cache()
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        Module.from_file(path)
+        cache = Module.cached_modules
+        assert path in cache
+        assert list(cache) == [os.path.abspath(path)]
+        assert cache[path].name == 'TLC5955'
+        assert cache.get('missing.kicad_mod', 1) == 1
+        with raises(KeyError):
+            cache['missing.kicad_mod']
+        del cache[path]
+        assert path not in cache and len(cache) == 0
+        with raises(KeyError):
+            del cache[path]
+        cache[path] = Module.parse_file(path)
+        assert dict(cache.items())[os.path.abspath(path)].name == 'TLC5955'
+
+    def test_cache_invalidation(self):
+        Module.clear_cache()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'TLC5955.kicad_mod')
+            shutil.copy('tests/testlib.pretty/TLC5955.kicad_mod', path)
+            assert Module.from_file(path).name == 'TLC5955'
+            assert Module.from_file(path).name == 'TLC5955'
+            with open(path, 'r+') as fp:
+                string = fp.read().replace('TLC5955', 'TLC5956')
+                fp.seek(0)
+                fp.write(string)
+            os.utime(path, ns=(0, 0))
+            assert Module.from_file(path).name == 'TLC5956'
+        stats = Module.cached_modules.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 2
+        assert stats['invalidations'] == 1
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'TLC5955.kicad_mod')
+            shutil.copy('tests/testlib.pretty/TLC5955.kicad_mod', path)
+            cache = ParseCache(os.path.join(tmp, 'cache'))
+            module = Module.parse_file(path, cache_dir=cache.directory)
+            assert module == Module.parse_file(path)
+            assert cache.load(Module, path) == module
+            assert cache.load(Pcb, path) is None
+
+            # Touching the file keeps the entry, changing it doesn't
+            os.utime(path, ns=(0, 0))
+            assert cache.load(Module, path) == module
+            with open(path, 'r+') as fp:
+                string = fp.read().replace('TLC5955', 'TLC5956')
+                fp.seek(0)
+                fp.write(string)
+            os.utime(path, ns=(10 ** 9, 10 ** 9))
+            assert cache.load(Module, path) is None
+            module = Module.parse_file(path, cache_dir=cache.directory)
+            assert module.name == 'TLC5956'
+            assert cache.load(Module, path) == module
+
+            with open(cache.entry_path(Module, path), 'wb') as fp:
+                fp.write(b'garbage')
+            assert cache.load(Module, path) is None
+
+    def test_parse_cache_print_order(self):
+        path = 'tests/full_pcb.kicad_pcb'
+        with tempfile.TemporaryDirectory() as tmp:
+            Pcb.parse_file(path, cache_dir=tmp)
+            string = run_in_new_process(
+                'import sys\n'
+                'from pykicad.pcb import Pcb\n'
+                'pcb = Pcb.parse_file(sys.argv[1], cache_dir=sys.argv[2])\n'
+                'sys.stdout.write(pcb.to_string())', path, tmp)
+        assert string == Pcb.parse_file(path).to_string()
+
+    def test_load_many(self):
+        Module.clear_cache()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, '%d.kicad_mod' % i) for i in range(3)]
+            for path in paths:
+                shutil.copy('tests/testlib.pretty/TLC5955.kicad_mod', path)
+            with open(paths[1], 'w') as fp:
+                fp.write('(module broken (foo 1))')
+            Module.from_file(paths[2])
+            for workers in [1, 2]:
+                items = paths + [paths[0], ('nolib', 'TLC5955')]
+                with mock.patch.dict(os.environ, {'KISYSMOD': tmp}):
+                    modules = Module.load_many(items, workers=workers)
+                assert modules[0] == modules[2] == modules[3]
+                assert modules[0] is not modules[3]
+                assert isinstance(modules[1], ParseException)
+                assert isinstance(modules[4], LookupError)
+                Module.cached_modules.remove(paths[0])
+        stats = Module.cached_modules.stats()
+        assert stats['hits'] == 2 and stats['entries'] == 1
+
+    def test_load_many_print_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, '%d.kicad_mod' % i) for i in range(2)]
+            for path in paths:
+                with open(path, 'w') as fp:
+                    fp.write('(module %s (layer F.Cu) (pad 1 thru_hole circle '
+                             '(at 0 0) (size 1.6 1.6) (drill 0.8) '
+                             '(layers *.Cu *.Mask) (clearance 0.3) '
+                             '(solder_mask_margin 0.05)))'
+                             % os.path.basename(path))
+            output = run_in_new_process(
+                'import sys\n'
+                'from pykicad.module import Module\n'
+                'modules = Module.load_many(sys.argv[1:], workers=2)\n'
+                'strings = [module.to_string() for module in modules]\n'
+                'Module.clear_cache()\n'
+                'print(strings == [Module.from_file(path).to_string()\n'
+                '                  for path in sys.argv[1:]])', *paths)
+        assert output.strip() == 'True'
+
+
+class LibraryIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.roots = [os.path.join(self.tmp.name, root) for root in 'ab']
+        for root, libs in zip(self.roots, [['lib1'], ['lib1', 'lib2']]):
+            for lib in libs:
+                os.makedirs(os.path.join(root, lib + '.pretty'))
+                shutil.copy('tests/testlib.pretty/TLC5955.kicad_mod',
+                            os.path.join(root, lib + '.pretty'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_queries(self):
+        index = LibraryIndex(os.path.join(self.tmp.name, 'index.db'),
+                             self.roots)
+        index.refresh()
+        lib1 = os.path.join(self.roots[0], 'lib1.pretty')
+        assert index.list_libraries() == ['lib1', 'lib1', 'lib2']
+        assert index.find_library('lib1') == lib1
+        assert index.find_module('lib1', 'TLC5955') == \
+            os.path.join(lib1, 'TLC5955.kicad_mod')
+        assert index.find_module('lib3', 'TLC5955') is None
+        assert index.list_modules('lib2') == ['TLC5955']
+        assert index.list_all_modules() == ['TLC5955'] * 3
+        footprint = index.footprint('lib2', 'TLC5955')
+        assert footprint['pads'] == 57 and footprint['layer'] == 'F.Cu'
+        module = Module.parse_file(footprint['path'])
+        assert (footprint['xmin'], footprint['ymin'], footprint['xmax'],
+                footprint['ymax']) == module.bounding_box()
+        assert index.search('TLC') == [('lib1', 'TLC5955'),
+                                       ('lib1', 'TLC5955'),
+                                       ('lib2', 'TLC5955')]
+        index.close()
+        index = LibraryIndex(os.path.join(self.tmp.name, 'index.db'),
+                             self.roots)
+        assert index.find_library('lib2') is not None
+
+    def test_refresh(self):
+        scanned = []
+
+        class Index(LibraryIndex):
+            def scan(self, directory, library):
+                scanned.append(library)
+                LibraryIndex.scan(self, directory, library)
+
+        index = Index(search_path=self.roots)
+        index.refresh()
+        assert sorted(scanned) == ['lib1', 'lib1', 'lib2']
+        del scanned[:]
+        index.refresh()
+        assert scanned == []
+
+        lib2 = os.path.join(self.roots[1], 'lib2.pretty')
+        shutil.copy(os.path.join(lib2, 'TLC5955.kicad_mod'),
+                    os.path.join(lib2, 'Copy.kicad_mod'))
+        os.utime(lib2, ns=(10 ** 9, 10 ** 9))
+        index.refresh()
+        assert scanned == ['lib2']
+        assert index.list_modules('lib2') == ['Copy', 'TLC5955']
+
+        shutil.rmtree(os.path.join(self.roots[0], 'lib1.pretty'))
+        index.refresh()
+        assert index.list_libraries() == ['lib1', 'lib2']
+        assert index.find_library('lib1').startswith(self.roots[1])
+
+    def test_module_functions(self):
+        import pykicad.module
+        index = LibraryIndex(search_path=self.roots)
+        index.refresh()
+        pykicad.module.LIBRARY_INDEX = index
+        try:
+            assert list_libraries() == ['lib1', 'lib1', 'lib2']
+            assert find_module('lib2', 'TLC5955') == \
+                index.find_module('lib2', 'TLC5955')
+            assert list_all_modules() == ['TLC5955'] * 3
+        finally:
+            pykicad.module.LIBRARY_INDEX = None
+
+
 class NetTests(unittest.TestCase):
     def test_net_auto_numbering(self):
         n1, n2, n3 = Net(), Net(), Net()
         assert n1.code == 1
         assert n2.code == 2
         assert n3.code == 3
+
+
+class FootprintTests(unittest.TestCase):
+    def test_place(self):
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        footprint = Footprint.from_file(path)
+        vcc = Net('VCC', code=1)
+        module = footprint.place('U1', 1, 2, 90, 'B', 'LED driver',
+                                 {'VCC': vcc})
+        module.connect('GSCLK', vcc)
+        other = footprint.place('U2', 5, 5)
+
+        expected = Module.from_file(path)
+        expected.set_reference('U1')
+        expected.set_value('LED driver')
+        expected.connect('VCC', vcc)
+        expected.connect('GSCLK', vcc)
+        expected.flip()
+        expected.place(1, 2)
+        expected.rotate(-90)
+
+        # Printing doesn't copy the children for good
+        assert module.to_string() == expected.to_string()
+        assert module.to_string().count('(net 1 VCC)') == 2
+        assert module._pending is not None
+        assert other.to_string().count('(net ') == 0
+        assert module.pads_by_name('VCC')[0].net is vcc
+        assert module._pending is None and module == expected
+        assert footprint.module == Module.parse_file(path)
+        assert other.pads[0] is not footprint.module.pads[0]
+
+    def test_place_independent(self):
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        footprint = Footprint.from_file(path)
+        first, second = footprint.place('U1'), footprint.place('U2')
+        assert first._pending[1] is not second._pending[1]
+        assert first._pending[1] is not footprint.children
+        first.flip()
+        first.pads[0].net = Net('GND', code=2)
+        first.texts[1].text = 'changed'
+        assert second._pending is not None
+        assert second == footprint.place('U2')
+        assert second.pads[0].net is None and second.layer == 'F.Cu'
+        assert footprint.children['pads'] is footprint.module.pads
+        assert footprint.module == Module.parse_file(path)
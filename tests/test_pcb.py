@@ -1,6 +1,8 @@
+import tempfile
 import unittest
 from pytest import *
 from pykicad.pcb import *
+from pykicad import sexpr
 
 
 class NetClassTests(unittest.TestCase):
@@ -35,6 +37,23 @@ class ZoneTests(unittest.TestCase):
         assert zone.polygon[1] == (1, 1)
         assert Zone.parse(zone.to_string()) == zone
 
+    def test_point_arrays(self):
+        numpy = importorskip('numpy')
+        zone_string = '(zone (polygon (pts (xy 0 0) (xy 1 1))) ' \
+                      '(filled_polygon ' \
+                      '(pts (xy 0 0.5) (xy 1 1.5) (xy 2 2.5))))'
+        sexpr.POINT_ARRAYS = True
+        try:
+            zone = Zone.parse(zone_string, backend='descent')
+            assert Zone.parse(zone_string.encode('utf-8')) == zone
+        finally:
+            sexpr.POINT_ARRAYS = False
+        assert zone.polygon.dtype == numpy.float64
+        assert zone.polygon.shape == (2, 2)
+        assert zone.filled_polygon.tolist() == [[0, 0.5], [1, 1.5], [2, 2.5]]
+        assert zone.to_string() == Zone.parse(zone_string).to_string()
+        assert zone == Zone.parse(zone_string)
+
 
 class PcbTests(unittest.TestCase):
     def test_minimal_pcb(self):
@@ -46,6 +65,75 @@ class PcbTests(unittest.TestCase):
         assert len(pcb.modules) == 2
         assert Pcb.parse(pcb.to_string()) == pcb
 
+    def test_descent_backend(self):
+        pcb_string = open('tests/full_pcb.kicad_pcb', 'r').read()
+        pcb = Pcb.parse(pcb_string, backend='descent')
+        assert pcb == Pcb.parse(pcb_string, backend='pyparsing')
+        assert Pcb.parse(pcb.to_string(), backend='descent') == pcb
+
+    def test_mmap(self):
+        pcb = Pcb.from_file('tests/full_pcb.kicad_pcb', backend='descent')
+        assert pcb == Pcb.from_file('tests/full_pcb.kicad_pcb')
+        lazy = Pcb.from_file('tests/full_pcb.kicad_pcb', backend='descent',
+                             lazy=True)
+        assert Pcb.parse(lazy.to_string()) == pcb
+        assert lazy == pcb
+
+    def test_iterparse(self):
+        pcb = Pcb.from_file('tests/full_pcb.kicad_pcb')
+        for chunk_size in [5, 64, 2 ** 16]:
+            items = list(Pcb.iterparse('tests/full_pcb.kicad_pcb', chunk_size))
+            assert [i for i in items if isinstance(i, Net)] == pcb.nets
+            assert [i for i in items if isinstance(i, Layer)] == pcb.layers
+            assert [i for i in items if isinstance(i, Module)] == pcb.modules
+            assert [i for i in items if isinstance(i, Segment)] == pcb.segments
+            assert [i for i in items if isinstance(i, Zone)] == pcb.zones
+            assert [i for i in items if isinstance(i, Setup)] == [pcb.setup]
+
+    def test_lazy(self):
+        pcb = Pcb.from_file('tests/full_pcb.kicad_pcb')
+        lazy = Pcb.from_file('tests/full_pcb.kicad_pcb', lazy=True)
+        assert lazy.modules[0]._source is not None
+        assert lazy.modules[0].name == pcb.modules[0].name
+        assert lazy.modules[0]._source is None
+        assert lazy.modules[1]._source is not None
+        assert lazy == pcb
+
+    def test_lazy_verbatim(self):
+        pcb_string = open('tests/full_pcb.kicad_pcb', 'r').read()
+        pcb = Pcb.from_file('tests/full_pcb.kicad_pcb', lazy=True)
+        pcb.segments[0].width = 0.5
+        output = pcb.to_string()
+        segment = '(segment (start 109.37619 86.162991) (end 112 88) ' \
+                  '(width 0.25) (layer B.Cu) (net 2) (tstamp 5A1B2C3E))'
+        assert segment in pcb_string and segment in output
+        assert '(width 0.25) (layer F.Cu) (net 2))' not in output
+        start = pcb_string.index('\n  (zone ') + 3
+        zone = pcb_string[start:pcb_string.index('\n  (zone ', start)]
+        assert zone.rstrip() in output
+        pcb = Pcb.parse(output)
+        assert pcb.segments[0].width == 0.5
+        assert pcb.zones == Pcb.from_file('tests/full_pcb.kicad_pcb').zones
+
+    def test_streaming(self):
+        pcb = Pcb.from_file('tests/full_pcb.kicad_pcb')
+        with tempfile.NamedTemporaryFile('r', suffix='.kicad_pcb') as fp:
+            pcb.to_file(fp.name, streaming=True)
+            assert fp.read() == pcb.to_string()
+        pcb = Pcb()
+        with tempfile.NamedTemporaryFile('r', suffix='.kicad_pcb') as fp:
+            pcb.to_file(fp.name, streaming=True)
+            assert fp.read() == pcb.to_string()
+
+    def test_iterparse_unknown_tag(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.kicad_pcb') as fp:
+            fp.write('(kicad_pcb (version 4)\n(net 0 "")\n(foo 1)\n)\n')
+            fp.flush()
+            items = Pcb.iterparse(fp.name)
+            assert isinstance(next(items), Net)
+            with raises(ParseException):
+                next(items)
+
     def test_page(self):
         pcb = Pcb()
         assert Pcb.parse(pcb.to_string()) == pcb
@@ -75,3 +163,55 @@ class PcbTests(unittest.TestCase):
         assert Pcb.parse(pcb.to_string()) == pcb
         pcb.layers.append(Layer('F.Cu'))
         assert Pcb.parse(pcb.to_string()) == pcb
+
+    def test_lookups(self):
+        gnd, vcc = Net('GND', code=1), Net('VCC', code=2)
+        pcb = Pcb(nets=[gnd, vcc], modules=[Module(name='R1')],
+                  segments=[Segment([0, 0], [1, 1], 1, tstamp='5A1B')])
+        assert pcb.net_by_code(2) is vcc
+        assert pcb.net_by_name('GND') is gnd
+        assert pcb.module_by_reference('R1') is pcb.modules[0]
+        assert pcb.item_by_tstamp('5A1B') is pcb.segments[0]
+        assert pcb.item_by_tstamp('FFFF') is None
+
+        vcc2 = Net('VCC', code=3)
+        pcb.nets.append(vcc2)
+        assert pcb.net_by_code(3) is vcc2
+        assert pcb.net_by_name('VCC') is vcc
+        pcb.nets.remove(vcc)
+        assert pcb.net_by_code(2) is None
+        assert pcb.net_by_name('VCC') is vcc2
+        pcb.nets[0] = Net('AGND', code=1)
+        assert pcb.net_by_name('GND') is None
+        assert pcb.net_by_code(1).name == 'AGND'
+
+        pcb.modules[0].set_reference('R2')
+        assert pcb.module_by_reference('R1') is None
+        pcb.modules = [Module(name='R3')]
+        assert pcb.module_by_reference('R3') is pcb.modules[0]
+        assert Pcb.parse(pcb.to_string()) == pcb
+
+    def test_lookups_keep_lists(self):
+        pcb = Pcb(nets=[Net('GND', code=1)], modules=[Module(name='R1')])
+        modules, nets = pcb.modules, pcb.nets
+        assert pcb.module_by_reference('R1') is modules[0]
+        assert pcb.net_by_code(1) is nets[0]
+        assert modules is pcb.modules and nets is pcb.nets
+        pcb.modules = [Module(name='R2')]
+        assert isinstance(pcb.modules, ItemList)
+        pcb = Pcb.parse(pcb.to_string())
+        assert isinstance(pcb.modules, ItemList)
+        assert isinstance(pcb.nets, ItemList)
+
+    def test_lookups_after_rename(self):
+        pcb = Pcb(nets=[Net('GND', code=1)], modules=[Module(name='R1')])
+        assert pcb.module_by_reference('R9') is None
+        pcb.modules[0].set_reference('R9')
+        assert pcb.module_by_reference('R9') is pcb.modules[0]
+        assert pcb.module_by_reference('R1') is None
+        assert pcb.net_by_name('AGND') is None
+        pcb.nets[0].name = 'AGND'
+        pcb.nets[0].code = 2
+        assert pcb.net_by_name('AGND') is pcb.nets[0]
+        assert pcb.net_by_code(2) is pcb.nets[0]
+        assert pcb.net_by_name('GND') is None
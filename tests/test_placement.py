@@ -0,0 +1,96 @@
+import unittest
+from pytest import *
+from pykicad.module import *
+from pykicad.spatial import board_transform, item_shape
+
+
+class PadArraysTests(unittest.TestCase):
+    def setUp(self):
+        importorskip('numpy')
+        self.modules = []
+        for i, angle in enumerate([0, 90, 30]):
+            module = Module('U%d' % i, pads=[
+                Pad('1', size=[2, 1], at=[1, 0]),
+                Pad('2', type='thru_hole', shape='circle', size=[1, 1],
+                    at=[-1, 0.5], layers=['*.Cu'])
+            ])
+            module.place(10 * i, 5)
+            module.rotate(angle)
+            self.modules.append(module)
+        self.modules[2].flip()
+
+    def test_transform(self):
+        from pykicad.placement import PadArrays
+        pads = PadArrays(self.modules)
+        assert len(pads) == 6 and list(pads.module) == [0, 0, 1, 1, 2, 2]
+        assert pads.rows(1) == slice(2, 4)
+        for i, pad in enumerate(pads.pads):
+            module = self.modules[pads.module[i]]
+            x, y = board_transform(module)(*pad.at[:2])
+            assert approx((pads.x[i], pads.y[i])) == (x, y)
+            assert approx(pads.angle[i]) == pad.at[2]
+            box = item_shape(pad, module).bounding_box()
+            assert approx(tuple(pads.bounding_boxes()[i])) == box
+        assert list(pads.front) == [True, True, True, True, False, True]
+        assert list(pads.back) == [False, True, False, True, True, True]
+
+        self.modules[0].place(3, 4)
+        self.modules[0].at[2] = 90
+        pads.update()
+        assert approx(pads.positions[0]) == (3, 3)
+        assert approx(pads.angle[:2]) == [90, 90]
+
+    def test_flip_after_construction(self):
+        from pykicad.placement import PadArrays, place_modules
+        pads = PadArrays(self.modules)
+        place_modules(self.modules, [10, 20, 30], [5, 5, 5], [0, 90, 0],
+                      ['B', 'F', 'F'])
+        pads.update()
+        # The flipped module has copies of its pads now
+        for m, module in enumerate(self.modules):
+            rows = pads.rows(m)
+            for i, pad in zip(range(rows.start, rows.stop), module.pads):
+                x, y = board_transform(module)(*pad.at[:2])
+                assert approx((pads.x[i], pads.y[i])) == (x, y)
+                assert approx(pads.angle[i]) == pad.at[2]
+        assert approx((pads.x[1], pads.y[1])) == (9, 4.5)
+        assert list(pads.front) == [False, True, True, True, True, True]
+        assert list(pads.back) == [True, True, False, True, False, True]
+
+    def test_place_modules(self):
+        from pykicad.placement import PadArrays, place_modules
+        numpy = importorskip('numpy')
+        path = 'tests/testlib.pretty/TLC5955.kicad_mod'
+        placed = [Module.from_file(path) for _ in range(4)]
+        looped = [Module.from_file(path) for _ in range(4)]
+        x, y = numpy.arange(4.0), numpy.arange(4.0) * 2
+        angle = numpy.array([30, 90, 45, 270])
+        side = ['F', 'F', 'B', 'B']
+        place_modules(placed, x, y, angle, side)
+        for i, module in enumerate(looped):
+            if side[i] == 'B':
+                module.flip()
+            module.place(float(x[i]), float(y[i]))
+            module.rotate(int(-angle[i] if side[i] == 'B' else angle[i]))
+
+        assert placed[0].to_string() == looped[0].to_string()
+        module = placed[2]
+        assert module.at == [2, 4, 45] and type(module.at[0]) is float
+        assert module.layer == 'B.Cu' and module._pending is not None
+        pads = PadArrays(placed)
+        assert module._pending is None
+        turned = [pad.at[2] for pad in module.pads]
+        assert approx(pads.angle[pads.rows(2)]) == turned
+        assert placed == looped
+        assert [m.to_string() for m in placed] == \
+            [m.to_string() for m in looped]
+
+        # Pads that weren't read again are turned once
+        place_modules(placed, x, y, angle + 90)
+        place_modules(placed, x, y, angle + 180)
+        pads.update()
+        turned = [a + 180 for a in turned]
+        assert approx(pads.angle[pads.rows(2)]) == turned
+        assert [pad.at[2] for pad in module.pads] == turned
+        with raises(ValueError):
+            place_modules(placed, x[:2], y)
@@ -1,3 +1,6 @@
+import copy
+import io
+import pickle
 import unittest
 from pytest import *
 from pyparsing import ParseException
@@ -242,3 +245,208 @@ class ASTTests(unittest.TestCase):
         ast = AST.parse('(sexpr (a 1) (b 2))')
         assert ast.a == 1
         assert ast.b == 2
+
+    def test_attr_plans(self):
+        AST.from_schema('sexpr', {
+            '0': {
+                'a': {
+                    'b': {
+                        '_parser': number,
+                        '_attr': 'd'
+                    }
+                }
+            },
+            'pts': {
+                '_parser': number + number,
+                '_printer': lambda pt: '%d %d' % tuple(pt),
+            }
+        })
+        ast = AST.parse('(sexpr (a (b 1)) (pts 1 2))')
+        assert attr_plan('d', AST.schema) == (('0', 'a', 'b'), False, False)
+        assert find_attr('pts', [1, 2], AST.schema) == {'_pts': '1 2'}
+        assert ast.to_string() == \
+            '\n(sexpr \n    (a \n        (b 1.0000000000)) 1 2)'
+        assert set(AST.__dict__['_attr_plans']) == set(['d', 'pts'])
+
+    def test_slots(self):
+        drill = Drill(offset=[0.1, 0.2], size=0.8)
+        assert not hasattr(drill, '__dict__')
+        assert Drill._fields == ('size', 'offset')
+        assert list(drill.attributes) == ['size', 'offset']
+        assert drill.attributes['size'] == 0.8
+        drill.attributes['size'] = 0.6
+        assert drill.size == 0.6
+        with raises(KeyError):
+            drill.attributes['foo'] = 1
+        assert drill.foo is None
+        assert pickle.loads(pickle.dumps(drill)) == drill
+
+    def test_extra_attributes(self):
+        drill = Drill(size=0.8)
+        drill.foo = 1
+        assert drill.foo == 1
+        assert 'foo' not in drill.attributes
+        assert drill.to_string() == Drill(size=0.8).to_string()
+        assert pickle.loads(pickle.dumps(drill)).foo == 1
+        assert copy.copy(drill).foo == 1
+        assert copy.deepcopy(drill).foo == 1
+        assert Drill(size=0.8).foo is None
+
+
+class UnorderedChildrenTests(unittest.TestCase):
+    def test_interleaved(self):
+        AST.from_schema('sexpr', {
+            'drills': {
+                '_parser': Drill,
+                '_multiple': True,
+            },
+            'pad': {
+                '_parser': number,
+            }
+        })
+        ast = AST.parse('(sexpr (drill 1) (pad 1) (drill 2))')
+        assert ast.pad == 1.0
+        assert ast.drills[0].size == 1.0
+        assert ast.drills[1].size == 2.0
+        assert AST.parse(ast.to_string()) == ast
+
+    def test_unknown_tag(self):
+        AST.from_schema('sexpr', {'zero': number})
+        with raises(ParseException) as e:
+            AST.parse('(sexpr (one 1))', backend='pyparsing')
+        assert 'Unknown tag (one in (sexpr' in str(e.value)
+
+    def test_invalid_child(self):
+        AST.from_schema('sexpr', {'zero': number})
+        with raises(ParseException) as e:
+            AST.parse('(sexpr (zero a))', backend='pyparsing')
+        assert 'Invalid (zero in (sexpr' in str(e.value)
+
+
+class TokenizeTests(unittest.TestCase):
+    def test_tokenize(self):
+        toks = tokenize('(sexpr (a "b c") d(e\n"")')
+        assert toks == ['(', 'sexpr', '(', 'a', '"b c"', ')', 'd', '(',
+                        'e', '""', ')']
+
+    def test_tokenize_file(self):
+        string = '(sexpr (a "b c d") (e 1.5 "f (g)")) ' * 20
+        for chunk_size in [3, 7, 64]:
+            chunks = list(tokenize_file(io.StringIO(string), chunk_size))
+            assert sum(chunks, []) == tokenize(string)
+            # Minified files aren't read into a single chunk
+            assert len(chunks) > 10
+
+
+class DescentTests(unittest.TestCase):
+    def test_same_as_pyparsing(self):
+        AST.from_schema('sexpr', {
+            '0': {
+                '_attr': 'zero',
+                '_parser': number
+            },
+            'drills': {
+                '_parser': Drill,
+                '_multiple': True,
+            },
+            'flag': flag('flag'),
+            'pair': number + number
+        })
+        string = '(sexpr 1 flag (pair 1 2) (drill 1) (drill oval 2 3))'
+        ast = AST.parse(string, backend='descent')
+        assert ast.zero == 1.0
+        assert ast.flag is True
+        assert ast.drills[1].size == [2.0, 3.0]
+        assert ast == AST.parse(string, backend='pyparsing')
+
+    def test_compiled_parser(self):
+        parser = compiled_parser(Drill)
+        assert parser is compiled_parser(Drill)
+        assert "'offset'" in parser.source
+        i, drill = parser(tokenize('(drill 0.8 (offset 0.1 0.2))'), 0)
+        assert i == 9
+        assert drill == Drill.parse('(drill 0.8 (offset 0.1 0.2))')
+
+    def test_unknown_tag(self):
+        AST.from_schema('sexpr', {'zero': number})
+        with raises(ParseException) as e:
+            AST.parse('(sexpr (one 1))', backend='descent')
+        assert 'Unknown tag (one in (sexpr' in str(e.value)
+
+    def test_positional_order(self):
+        AST.from_schema('sexpr', {
+            '0': {
+                '_tag': 'start',
+                '_parser': number + number,
+            },
+            '1': {
+                '_tag': 'end',
+                '_parser': number + number
+            }
+        })
+        with raises(ParseException):
+            AST.parse('(sexpr (end 2 2) (start 1 1))', backend='descent')
+
+    def test_bytes(self):
+        AST.from_schema('sexpr', {
+            '0': {
+                '_attr': 'zero',
+                '_parser': number
+            },
+            'drills': {
+                '_parser': Drill,
+                '_multiple': True,
+            },
+            'name': text,
+            'layers': OneOrMore(Literal('F.Cu') | 'B.Cu'),
+            'code': hex
+        })
+        string = '(sexpr 1 (name "a b") (layers F.Cu B.Cu) (code 1F) ' \
+                 '(drill oval 2 3))'
+        ast = AST.parse(string.encode('utf-8'))
+        assert ast == AST.parse(string, backend='descent')
+        assert AST.parse(memoryview(string.encode('utf-8'))) == ast
+        assert ast.name == 'a b'
+        assert ast.layers == ['F.Cu', 'B.Cu']
+        assert ast.code == '1F'
+
+    def test_bytes_unknown_tag(self):
+        AST.from_schema('sexpr', {'zero': number})
+        with raises(ParseException) as e:
+            AST.parse(b'(sexpr (one 1))')
+        assert 'Unknown tag (one in (sexpr (at byte 7)' in str(e.value)
+
+
+class ProfilerTests(unittest.TestCase):
+    def test_profiler(self):
+        AST.from_schema('sexpr', {
+            'drills': {
+                '_parser': Drill,
+                '_multiple': True,
+            }
+        })
+        string = '(sexpr (drill 1) (drill oval 2 3))'
+        for backend in ['descent', 'pyparsing']:
+            calls = []
+            with Profiler(calls.append) as profiler:
+                ast = AST.parse(string, backend)
+                ast.to_string()
+            stats = profiler.stats
+            assert calls == [stats]
+            assert stats[(Drill, 'parse')]['calls'] == 2
+            assert stats[(AST, 'parse')]['calls'] == 1
+            assert stats[(Drill, 'to_string')]['calls'] == 2
+            assert stats[(AST, 'parse')]['time'] >= \
+                stats[(Drill, 'parse')]['time']
+            assert stats[(AST, 'parse')]['bytes'] > \
+                stats[(Drill, 'parse')]['bytes'] > 0
+            assert 'Drill' in profiler.summary()
+
+        with Profiler() as profiler:
+            with raises(ParseException):
+                AST.parse('(sexpr (drill 1) (drill x))', 'descent')
+        assert profiler._stack == []
+        assert profiler.stats[(Drill, 'parse')]['calls'] == 1
+        assert (AST, 'parse') not in profiler.stats
+        AST.parse(string)
+        assert profiler.stats[(Drill, 'parse')]['calls'] == 1
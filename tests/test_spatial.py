@@ -0,0 +1,143 @@
+import math
+import random
+import unittest
+from pytest import *
+from pykicad.pcb import *
+from pykicad.spatial import *
+
+
+class ShapeTests(unittest.TestCase):
+    def test_distance(self):
+        track = Shape('polyline', [(0, 0), (10, 0)], 0.5)
+        assert track.distance(5, 2) == 1.5
+        assert track.distance(12, 0) == 1.5
+        assert track.distance(5, 0.2) == 0
+        ring = Shape('circle', [(0, 0)], 0.1, 5)
+        assert approx(ring.distance(0, 0)) == 4.9
+        square = Shape('polygon', [(0, 0), (2, 0), (2, 2), (0, 2)])
+        assert square.distance(1, 1) == 0
+        assert square.distance(3, 1) == 1
+        assert square.bounding_box() == (0, 0, 2, 2)
+        assert square.intersects((0.5, 0.5, 1, 1))
+        assert track.intersects((4, -1, 5, 1))
+        assert not track.intersects((4, 1, 5, 2))
+        assert not ring.intersects((-1, -1, 1, 1))
+        assert ring.intersects((4, -1, 6, 1))
+
+    def test_shape_distance(self):
+        track = Shape('polyline', [(0, 0), (10, 0)], 0.5)
+        other = Shape('polyline', [(0, 2), (10, 2)], 0.5)
+        disc = Shape('circle', [(5, -3)], 1)
+        square = Shape('polygon', [(4, -1), (6, -1), (6, 1), (4, 1)])
+        assert approx(shape_distance(track, other)) == 1
+        assert approx(shape_distance(other, disc)) == 3.5
+        assert shape_distance(track, square) == 0
+        assert approx(shape_distance(square, other)) == 0.5
+        inner = Shape('polygon', [(4.5, -0.5), (5, -0.5), (5, 0)])
+        assert shape_distance(square, inner) == 0
+
+    def test_pad_shape(self):
+        module = Module('U1', at=[10, 10, 90], pads=[
+            Pad('1', shape='rect', size=[2, 1], at=[1, 0, 90]),
+            Pad('2', shape='oval', size=[2, 1], at=[-1, 0, 90]),
+            Pad('3', shape='circle', size=[1, 1], at=[0, 0])
+        ])
+        rect, oval, circle = [item_shape(pad, module) for pad in module.pads]
+        # Rotated counterclockwise with the y axis pointing down
+        assert approx(rect.bounding_box()) == (9.5, 8, 10.5, 10)
+        assert approx(oval.bounding_box()) == (9.5, 10, 10.5, 12)
+        assert circle.bounding_box() == (9.5, 9.5, 10.5, 10.5)
+
+    def test_layer_matches(self):
+        assert layer_matches('*.Cu', 'In1.Cu')
+        assert layer_matches('F.Cu', 'F&B.Cu')
+        assert not layer_matches('F.Cu', 'B.Cu')
+        assert not layer_matches('*.Cu', 'F.Mask')
+
+
+class SpatialIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.module = Module('U1', at=[50, 50], pads=[
+            Pad('1', size=[1, 1], at=[-1, 0], layers=['F.Cu', 'F.Mask']),
+            Pad('2', type='thru_hole', shape='circle', size=[1, 1], at=[1, 0],
+                layers=['*.Cu', '*.Mask'])
+        ], lines=[Line([-3, -2], [3, -2], layer='F.CrtYd'),
+                  Line([-3, 2], [3, 2], layer='F.CrtYd')])
+        self.segment = Segment([0, 0], [10, 0], 1, width=0.2, layer='F.Cu')
+        self.via = Via([20, 0], 0.8, 0.4, 1)
+        self.outline = GrLine([0, 0], [100, 0], layer='Edge.Cuts')
+        self.pcb = Pcb(modules=[self.module], segments=[self.segment],
+                       vias=[self.via], lines=[self.outline])
+        self.index = SpatialIndex.from_pcb(self.pcb, cell_size=1)
+
+    def test_query(self):
+        index = self.index
+        assert len(index) == 6
+        assert index.query((5, -1, 6, 1), 'F.Cu') == [self.segment]
+        assert index.query((5, -1, 6, 1), 'B.Cu') == []
+        assert index.query((19, -1, 21, 1), 'In1.Cu') == [self.via]
+        pad1, pad2 = self.module.pads
+        assert index.query((48, 49, 52, 51), 'B.Cu') == [pad2]
+        assert index.module(pad2) is self.module
+        assert index.query((45, 45, 55, 55), 'F.CrtYd') == [self.module]
+        assert set(map(id, index.query((45, 45, 55, 55)))) == \
+            set(map(id, [self.module, pad1, pad2]))
+        assert index.query((50, -1, 51, 1), 'Edge.Cuts') == [self.outline]
+
+    def test_within_and_nearest(self):
+        index = self.index
+        assert index.within((15, 0), 5, 'F.Cu') == [self.via, self.segment]
+        assert index.within((15, 0), 4, 'F.Cu') == []
+        assert index.nearest((15, 0), 'F.Cu') is self.via
+        assert index.nearest((12, 0), 'F.Cu') is self.segment
+        assert index.nearest((50, 40), 'F.Cu') is self.module.pads[0]
+        assert index.nearest((15, 0), 'F.Cu', max_distance=1) is None
+        assert index.nearest((15, 0), 'F.SilkS') is None
+        assert index.nearest((15, 0), 'F.Cu', accept=lambda item:
+                             item is not self.via) is self.segment
+
+    def test_update(self):
+        index = self.index
+        self.module.place(20, 20)
+        index.update(self.module)
+        assert index.query((45, 45, 55, 55), 'F.Cu') == []
+        assert index.nearest((22, 20), 'F.Cu') is self.module.pads[1]
+        self.segment.end = [10, 10]
+        index.update(self.segment)
+        assert index.query((9, 9, 11, 11), 'F.Cu') == [self.segment]
+        index.remove(self.module)
+        assert len(index) == 3
+        assert self.module.pads[0] not in index
+        index.insert(self.module)
+        assert len(index) == 6
+        with raises(ValueError):
+            index.insert(self.via)
+
+    def test_random(self):
+        rng = random.Random(0)
+        index = SpatialIndex(cell_size=2)
+
+        def point():
+            return [rng.uniform(0, 100), rng.uniform(0, 100)]
+
+        items = [Via(point(), 0.5, 0.3, 1) for _ in range(300)]
+        items += [Segment(point(), point(), 1, width=0.25)
+                  for _ in range(300)]
+        for item in items:
+            index.insert(item)
+        for _ in range(20):
+            x, y = rng.uniform(-10, 110), rng.uniform(-10, 110)
+
+            def distance(item):
+                return index.shape(item).distance(x, y)
+
+            nearest = index.nearest((x, y), 'F.Cu')
+            assert distance(nearest) == min(map(distance, items))
+            near = [item for item in items if distance(item) <= 3]
+            assert sorted(map(id, index.within((x, y), 3, 'F.Cu'))) == \
+                sorted(map(id, near))
+            box = (x - 3, y - 3, x + 3, y + 3)
+            overlapping = [item for item in items
+                           if index.shape(item).intersects(box)]
+            assert sorted(map(id, index.query(box))) == \
+                sorted(map(id, overlapping))